@@ -0,0 +1,30 @@
+"""
+Benchmark DictORM's operations on Sqlite (in memory and in a file) and on
+Postgres when it's available.  Run every benchmark, and keep the results:
+
+    python -m benchmarks --output baseline.json
+
+Run the benchmarks again after a change, and compare them to the baseline.  Any
+benchmark which has become slower than the threshold is a regression, and the
+exit status is 1:
+
+    python -m benchmarks --compare baseline.json --threshold 0.1
+
+Postgres is connected to using the DICTORM_BENCHMARK_DSN environment variable,
+which defaults to the database of the tests.
+"""
+from .backends import BACKENDS, get_backends
+from .runner import compare, load_results, run, write_results
+from .suite import BENCHMARKS, GROUPS, benchmark
+
+__all__ = [
+    'BACKENDS',
+    'BENCHMARKS',
+    'GROUPS',
+    'benchmark',
+    'compare',
+    'get_backends',
+    'load_results',
+    'run',
+    'write_results',
+]
@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+import argparse
+import sys
+
+from . import BACKENDS, GROUPS, compare, get_backends, load_results, run, write_results
+
+
+def _ints(value: str):
+    return [int(i) for i in value.split(',')]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__)
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help='Comma separated backends, Postgres is skipped if unavailable (default: %(default)s)')
+    parser.add_argument('--groups', default=','.join(GROUPS),
+                        help='Comma separated groups of benchmarks (default: %(default)s)')
+    parser.add_argument('--rows', type=_ints, default=[100, 1000],
+                        help='Comma separated counts of rows (default: 100,1000)')
+    parser.add_argument('--widths', type=_ints, default=[0, 16],
+                        help='Comma separated counts of extra columns (default: 0,16)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each benchmark (default: %(default)s)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare the results to this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='The fraction a benchmark may slow down before it is a regression '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    backends = get_backends(args.backends.split(','))
+    results = run(backends, args.rows, args.widths, args.groups.split(','), args.repeat, log=print)
+    if args.output:
+        write_results(args.output, results)
+    if not args.compare:
+        return 0
+
+    comparisons = compare(load_results(args.compare), results, args.threshold)
+    for comparison in comparisons:
+        print('{0}{1} {2:.6f}s -> {3:.6f}s ({4:+.1%})'.format(
+            'REGRESSION ' if comparison['regression'] else '', comparison['benchmark'],
+            comparison['baseline'], comparison['median'], comparison['change']))
+    regressions = [i for i in comparisons if i['regression']]
+    print(f'{len(regressions)} regressions in {len(comparisons)} benchmarks')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
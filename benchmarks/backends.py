@@ -0,0 +1,153 @@
+"""
+The databases benchmarks are run on, and the schema they are run against.
+"""
+import os
+import sqlite3
+import tempfile
+from functools import partial
+from typing import Callable, List, Optional
+
+__all__ = [
+    'Backend',
+    'BACKENDS',
+    'POSTGRES_DSN',
+    'bulk_insert',
+    'create_schema',
+    'get_backends',
+    'seed',
+]
+
+# Postgres is only benchmarked if this database accepts connections
+POSTGRES_DSN = os.environ.get(
+    'DICTORM_BENCHMARK_DSN',
+    'dbname=postgres user=postgres password=dictorm host=localhost port=54321 connect_timeout=3')
+
+TABLES = ('person_department', 'person', 'car', 'department')
+
+
+class Backend:
+    """
+    A kind of database.  "connect" creates a new connection to the database each
+    time it's called, and can be pickled so processes can connect.
+    """
+
+    def __init__(self, name: str, kind: str, connect: Callable, cleanup: Callable = None):
+        self.name = name
+        self.kind = kind
+        self.connect = connect
+        self._cleanup = cleanup
+
+    def __repr__(self):  # pragma: no cover
+        return f'Backend({self.name!r})'
+
+    def cleanup(self):
+        if self._cleanup is not None:
+            self._cleanup()
+
+
+def _memory() -> Backend:
+    # Each connection is a new, empty database
+    return Backend('sqlite-memory', 'sqlite', partial(sqlite3.connect, ':memory:', check_same_thread=False))
+
+
+def _file() -> Backend:
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, 'benchmark.sqlite3')
+    return Backend('sqlite-file', 'sqlite', partial(sqlite3.connect, path, check_same_thread=False),
+                   directory.cleanup)
+
+
+def _postgres() -> Optional[Backend]:
+    try:
+        import psycopg2
+        from psycopg2.extras import DictCursor
+    except ImportError:
+        return None
+
+    connect = partial(psycopg2.connect, POSTGRES_DSN, cursor_factory=DictCursor)
+    try:
+        connect().close()
+    except psycopg2.OperationalError:
+        return None
+    return Backend('postgres', 'postgres', connect)
+
+
+BACKENDS = {
+    'sqlite-memory': _memory,
+    'sqlite-file': _file,
+    'postgres': _postgres,
+}
+
+
+def get_backends(names: List[str]) -> List[Backend]:
+    """
+    Create the named backends, Postgres is skipped if it isn't available.
+    """
+    backends = []
+    for name in names:
+        if name not in BACKENDS:
+            raise ValueError(f'Unknown backend {name!r}, choose from {", ".join(BACKENDS)}')
+        backend = BACKENDS[name]()
+        if backend is not None:
+            backends.append(backend)
+    return backends
+
+
+def create_schema(conn, kind: str, width: int = 0):
+    """
+    Create the benchmark tables, dropping them first.  The person table has
+    "width" extra text columns.
+    """
+    serial = 'SERIAL PRIMARY KEY' if kind == 'postgres' else 'INTEGER PRIMARY KEY'
+    extra = ''.join(f', extra{i} TEXT' for i in range(width))
+    cascade = ' CASCADE' if kind == 'postgres' else ''
+    curs = conn.cursor()
+    for table in TABLES:
+        curs.execute(f'DROP TABLE IF EXISTS {table}{cascade}')
+    for sql in (
+            f'CREATE TABLE department (id {serial}, name TEXT)',
+            f'CREATE TABLE car (id {serial}, name TEXT)',
+            f'CREATE TABLE person (id {serial}, name TEXT, car_id INTEGER REFERENCES car(id){extra})',
+            'CREATE TABLE person_department ('
+            ' person_id INTEGER REFERENCES person(id),'
+            ' department_id INTEGER REFERENCES department(id),'
+            ' PRIMARY KEY (person_id, department_id))',
+    ):
+        curs.execute(sql)
+    conn.commit()
+
+
+def bulk_insert(db, table: str, rows: List[dict]):
+    """
+    Insert rows using multi-row INSERTs, small enough for Sqlite's limit of
+    query parameters.
+    """
+    if not rows:
+        return
+    size = max(1, 900 // len(rows[0]))
+    for i in range(0, len(rows), size):
+        db.execute(db.curs, *db.bulk_insert(table, rows[i:i + size]).build(), table=table)
+
+
+def seed(db, rows: int, width: int = 0, persons_per_car: int = 2, departments: int = 10,
+         departments_per_person: int = 2):
+    """
+    Insert "rows" persons into the benchmark tables of a DictDB, with a car
+    for every "persons_per_car" persons, and "departments_per_person" departments
+    for each person.
+    """
+    bulk_insert(db, 'department', [{'name': f'department{i}'} for i in range(departments)])
+    bulk_insert(db, 'car', [{'name': f'car{i}'} for i in range(max(1, rows // persons_per_car))])
+    car_ids = [i['id'] for i in db['car'].get_where()]
+    department_ids = [i['id'] for i in db['department'].get_where()]
+    persons = []
+    for i in range(rows):
+        person = {'name': f'person{i}', 'car_id': car_ids[i % len(car_ids)]}
+        person.update((f'extra{j}', f'value{i}') for j in range(width))
+        persons.append(person)
+    bulk_insert(db, 'person', persons)
+    per_person = min(departments_per_person, departments)
+    bulk_insert(db, 'person_department', [
+        {'person_id': person['id'], 'department_id': department_ids[(person['id'] + j) % departments]}
+        for person in db['person'].get_where() for j in range(per_person)])
+    db.conn.commit()
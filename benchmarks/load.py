@@ -0,0 +1,227 @@
+"""
+Drive a mixed workload against DictORM from many threads or processes, and
+report throughput and latency percentiles.  The benchmark tables are created
+and seeded first, with the provided fan-out:
+
+    python -m benchmarks.load --backend sqlite-file --rows 10000 --workers 8 --duration 30 \\
+        --mix read=60,reference=25,write=10,insert=5
+
+Each operation of the mix is chosen at random, in proportion to its weight:
+
+    read        get a person by primary key
+    reference   get a person, their car and their departments
+    write       get a person, change their name and flush them
+    insert      insert a new person
+
+Only Sqlite files and Postgres can be used, each worker connects on its own.
+"""
+import argparse
+import json
+import math
+import random
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict as DictHint, List
+
+from dictorm import DictDB
+
+from .backends import Backend, create_schema, get_backends, seed
+from .suite import add_references
+
+__all__ = [
+    'DEFAULT_MIX',
+    'OPERATIONS',
+    'parse_mix',
+    'percentile',
+    'run_load',
+]
+
+
+def _read(db: DictDB, person_id: int, rng: random.Random):
+    db['person'].get_one(person_id)
+    db.conn.rollback()
+
+
+def _reference(db: DictDB, person_id: int, rng: random.Random):
+    person = db['person'].get_one(person_id)
+    if person is not None:
+        person['car']
+        person['departments']
+    db.conn.rollback()
+
+
+def _write(db: DictDB, person_id: int, rng: random.Random):
+    person = db['person'].get_one(person_id)
+    if person is not None:
+        person['name'] = f'person{rng.random()}'
+        person.flush()
+    db.conn.commit()
+
+
+def _insert(db: DictDB, person_id: int, rng: random.Random):
+    db['person'](name=f'new{rng.random()}', car_id=db['person'].get_one(person_id)['car_id']).flush()
+    db.conn.commit()
+
+
+# The weights of the operations of the default mix
+DEFAULT_MIX = 'read=60,reference=25,write=10,insert=5'
+
+# name -> function which does one operation on a person
+OPERATIONS: DictHint[str, Callable] = {
+    'read': _read,
+    'reference': _reference,
+    'write': _write,
+    'insert': _insert,
+}
+
+
+def parse_mix(mix: str) -> DictHint[str, float]:
+    """
+    Parse a mix such as "read=60,write=40" into the weight of each operation.
+    """
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'Unknown operation {name!r}, choose from {", ".join(OPERATIONS)}')
+        weights[name] = float(weight or 1)
+    if not any(weights.values()):
+        raise ValueError('At least one operation must have a weight')
+    return weights
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """
+    Get the nearest-rank percentile of already sorted values.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _work(connect: Callable, mix: DictHint[str, float], rows: int, duration: float, worker: int) -> dict:
+    """
+    Do random operations until "duration" seconds have passed.  Get the
+    latencies and errors of each operation.
+    """
+    rng = random.Random(worker)
+    db = DictDB(connect())
+    add_references(db)
+    names, weights = list(mix), list(mix.values())
+    latencies = {i: [] for i in names}
+    errors = dict.fromkeys(names, 0)
+    deadline = time.monotonic() + duration
+    try:
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                OPERATIONS[name](db, rng.randint(1, rows), rng)
+            except Exception:
+                db.conn.rollback()
+                errors[name] += 1
+                continue
+            latencies[name].append(time.perf_counter() - start)
+    finally:
+        db.conn.close()
+    return {'latencies': latencies, 'errors': errors}
+
+
+def run_load(backend: Backend, rows: int = 1000, workers: int = 4, duration: float = 10.0,
+             mix: DictHint[str, float] = None, processes: bool = False, persons_per_car: int = 2,
+             departments: int = 10, departments_per_person: int = 2) -> dict:
+    """
+    Create and seed the benchmark tables, then drive "mix" from "workers"
+    threads (or processes) for "duration" seconds.  Latencies are reported in
+    seconds.
+    """
+    if backend.name == 'sqlite-memory':
+        raise ValueError('Workers can\'t share an in-memory database, use a Sqlite file')
+    mix = mix or parse_mix(DEFAULT_MIX)
+    conn = backend.connect()
+    create_schema(conn, backend.kind)
+    seed(DictDB(conn), rows, persons_per_car=persons_per_car, departments=departments,
+         departments_per_person=departments_per_person)
+    conn.close()
+
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    start = time.perf_counter()
+    with executor(workers) as pool:
+        results = list(pool.map(partial(_work, backend.connect, mix, rows, duration), range(workers)))
+    elapsed = time.perf_counter() - start
+
+    operations = {}
+    for name in mix:
+        latencies = sorted(i for result in results for i in result['latencies'][name])
+        operations[name] = {
+            'count': len(latencies),
+            'errors': sum(i['errors'][name] for i in results),
+            'throughput': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else 0.0,
+        }
+    count = sum(i['count'] for i in operations.values())
+    return {
+        'backend': backend.name,
+        'rows': rows,
+        'workers': workers,
+        'processes': processes,
+        'duration': elapsed,
+        'count': count,
+        'throughput': count / elapsed,
+        'operations': operations,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default='sqlite-file', choices=['sqlite-file', 'postgres'])
+    parser.add_argument('--database', help='The Sqlite file to use, a temporary file is used by default')
+    parser.add_argument('--rows', type=int, default=1000, help='Persons to seed (default: %(default)s)')
+    parser.add_argument('--persons-per-car', type=int, default=2)
+    parser.add_argument('--departments', type=int, default=10)
+    parser.add_argument('--departments-per-person', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=4, help='Threads or processes (default: %(default)s)')
+    parser.add_argument('--processes', action='store_true', help='Use processes instead of threads')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run (default: %(default)s)')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Weights of the operations (default: %(default)s)')
+    parser.add_argument('--output', help='Write the report to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.database:
+        backend = Backend('sqlite-file', 'sqlite', partial(sqlite3.connect, args.database, check_same_thread=False))
+    else:
+        backends = get_backends([args.backend])
+        if not backends:
+            print(f'{args.backend} is not available', file=sys.stderr)
+            return 1
+        backend, = backends
+    try:
+        report = run_load(backend, args.rows, args.workers, args.duration, args.mix, args.processes,
+                          args.persons_per_car, args.departments, args.departments_per_person)
+    finally:
+        backend.cleanup()
+
+    print('{backend} {workers} {kind}: {count} operations, {throughput:.1f}/s'.format(
+        kind='processes' if args.processes else 'threads', **report))
+    for name, stats in report['operations'].items():
+        print('  {name:<10} {count:>8} {throughput:>9.1f}/s  p50 {p50_ms:8.3f}ms  p90 {p90_ms:8.3f}ms  '
+              'p99 {p99_ms:8.3f}ms  max {max_ms:8.3f}ms  errors {errors}'.format(
+                  name=name, **stats, **{f'{k}_ms': stats[k] * 1000 for k in ('p50', 'p90', 'p99', 'max')}))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Measure the Python overhead DictORM adds to single operations, compared with
+doing the same work using sqlite3 and plain dicts.  Other than get_one, nothing
+is sent to the database; only building queries and handling Dicts is timed.
+
+    python -m benchmarks.micro
+
+Each operation has a budget, the most microseconds of overhead it may add.
+Budgets are multiplied by the DICTORM_OVERHEAD_SCALE environment variable, to
+allow for slower machines.
+"""
+import os
+import sqlite3
+import sys
+import timeit
+from collections import OrderedDict
+from typing import Callable, Dict as DictHint, List, Tuple
+
+from dictorm import And, DictDB
+from dictorm.dictorm import args_to_comp
+
+__all__ = [
+    'BUDGETS',
+    'MICRO_BENCHMARKS',
+    'budget',
+    'create_db',
+    'measure',
+    'over_budget',
+]
+
+# name -> function which is provided a DictDB and returns a (dictorm, raw)
+# pair of callables that each do one operation
+MICRO_BENCHMARKS: DictHint[str, Callable] = OrderedDict()
+
+# name -> the most microseconds of overhead an operation may add
+BUDGETS = {
+    'select_build': 40,
+    'insert_build': 15,
+    'update_build': 30,
+    'operator_iter': 15,
+    'args_to_comp': 15,
+    'dict_construction': 6,
+    'dict_getitem': 2,
+    'dict_setitem': 3,
+    'get_one': 60,
+}
+
+PERSON_SQL = 'CREATE TABLE person (id INTEGER PRIMARY KEY, name TEXT, car_id INTEGER, other INTEGER)'
+PERSON = {'name': 'Bob', 'car_id': 2, 'other': 3}
+
+
+def micro_benchmark(name: str):
+    """
+    Register a micro-benchmark function.
+    """
+
+    def register(func: Callable) -> Callable:
+        MICRO_BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def create_db() -> DictDB:
+    """
+    Create a DictDB of an in-memory database with a person table.
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute(PERSON_SQL)
+    conn.execute('INSERT INTO person (name, car_id, other) VALUES (?, ?, ?)', tuple(PERSON.values()))
+    conn.commit()
+    return DictDB(conn)
+
+
+@micro_benchmark('select_build')
+def select_build_benchmark(db: DictDB) -> Tuple[Callable, Callable]:
+    Person = db['person']
+
+    def dictorm():
+        return Person.get_where(Person['id'] > 1, name='Bob').query.build()
+
+    def raw():
+        return 'SELECT * FROM "person" WHERE "id">? AND "name"=? ORDER BY id ASC', [1, 'Bob']
+
+    return dictorm, raw
+
+
+@micro_benchmark('insert_build')
+def insert_build_benchmark(db: DictDB) -> Tuple[Callable, Callable]:
+    def dictorm():
+        return db.insert('person', **PERSON).build()
+
+    def raw():
+        keys = sorted(PERSON)
+        return ('INSERT INTO "person" ({0}) VALUES ({1})'.format(
+            ', '.join(f'"{i}"' for i in keys), ', '.join('?' for _ in keys)), [PERSON[i] for i in keys])
+
+    return dictorm, raw
+
+
+@micro_benchmark('update_build')
+def update_build_benchmark(db: DictDB) -> Tuple[Callable, Callable]:
+    Person = db['person']
+
+    def dictorm():
+        return db.update('person', **PERSON).where(Person['id'] == 1).build()
+
+    def raw():
+        keys = sorted(PERSON)
+        return ('UPDATE "person" SET {0} WHERE "id"=?'.format(', '.join(f'"{i}"=?' for i in keys)),
+                [PERSON[i] for i in keys] + [1])
+
+    return dictorm, raw
+
+
+@micro_benchmark('operator_iter')
+def operator_iter_benchmark(db: DictDB) -> Tuple[Callable, Callable]:
+    Person = db['person']
+    operator = And(Person['id'] > 1, Person['name'] == 'Bob', Person['car_id'] == 2, Person['other'] == 3)
+    values = (1, 'Bob', 2, 3)
+
+    def dictorm():
+        return list(operator)
+
+    def raw():
+        return list(values)
+
+    return dictorm, raw
+
+
+@micro_benchmark('args_to_comp')
+def args_to_comp_benchmark(db: DictDB) -> Tuple[Callable, Callable]:
+    Person = db['person']
+
+    def dictorm():
+        return args_to_comp(And(), Person, 1, **PERSON)
+
+    def raw():
+        return ' AND '.join(f'"{i}"=?' for i in ('id',) + tuple(PERSON)), [1] + list(PERSON.values())
+
+    return dictorm, raw
+
+
+@micro_benchmark('dict_construction')
+def dict_construction_benchmark(db: DictDB) -> Tuple[Callable, Callable]:
+    Person = db['person']
+
+    def dictorm():
+        return Person(PERSON)
+
+    def raw():
+        return dict(PERSON)
+
+    return dictorm, raw
+
+
+@micro_benchmark('dict_getitem')
+def dict_getitem_benchmark(db: DictDB) -> Tuple[Callable, Callable]:
+    person, plain = db['person'](PERSON), dict(PERSON)
+
+    def dictorm():
+        return person['name']
+
+    def raw():
+        return plain['name']
+
+    return dictorm, raw
+
+
+@micro_benchmark('dict_setitem')
+def dict_setitem_benchmark(db: DictDB) -> Tuple[Callable, Callable]:
+    person, plain = db['person'](PERSON), dict(PERSON)
+
+    def dictorm():
+        person['name'] = 'Alice'
+
+    def raw():
+        plain['name'] = 'Alice'
+
+    return dictorm, raw
+
+
+@micro_benchmark('get_one')
+def get_one_benchmark(db: DictDB) -> Tuple[Callable, Callable]:
+    Person = db['person']
+    curs = db.conn.cursor()
+
+    def dictorm():
+        return Person.get_one(1)
+
+    def raw():
+        row = curs.execute('SELECT * FROM "person" WHERE "id"=?', (1,)).fetchone()
+        return dict(zip(('id', 'name', 'car_id', 'other'), row))
+
+    return dictorm, raw
+
+
+def _per_call(func: Callable, number: int, repeat: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def measure(names: List[str] = None, number: int = 10000, repeat: int = 5) -> List[dict]:
+    """
+    Time each operation, and its raw equivalent.  Times are the fastest of
+    "repeat" runs, in microseconds per operation.
+    """
+    db = create_db()
+    results = []
+    for name, func in MICRO_BENCHMARKS.items():
+        if names is not None and name not in names:
+            continue
+        dictorm, raw = func(db)
+        dictorm_us = _per_call(dictorm, number, repeat) * 1e6
+        raw_us = _per_call(raw, number, repeat) * 1e6
+        results.append({
+            'name': name,
+            'dictorm': dictorm_us,
+            'raw': raw_us,
+            'overhead': dictorm_us - raw_us,
+            'budget': budget(name),
+        })
+    return results
+
+
+def budget(name: str) -> float:
+    """
+    Get the budget of an operation, scaled by DICTORM_OVERHEAD_SCALE.
+    """
+    return BUDGETS[name] * float(os.environ.get('DICTORM_OVERHEAD_SCALE', 1))
+
+
+def over_budget(results: List[dict]) -> List[dict]:
+    return [i for i in results if i['overhead'] > i['budget']]
+
+
+def main() -> int:
+    results = measure()
+    for result in results:
+        print('{name:<18} dictorm {dictorm:8.2f}us  raw {raw:8.2f}us  overhead {overhead:8.2f}us'
+              '  budget {budget:6.1f}us'.format(**result))
+    over = over_budget(results)
+    for result in over:
+        print(f'OVER BUDGET {result["name"]}')
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
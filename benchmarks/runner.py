@@ -0,0 +1,130 @@
+"""
+Run benchmarks, and compare their results against a baseline.
+"""
+import json
+import platform
+import statistics
+import time
+from typing import Callable, Iterable, List, Optional
+
+from dictorm import DictDB, __version__
+
+from .backends import Backend, create_schema, seed
+from .suite import BENCHMARKS, Case, add_references
+
+__all__ = [
+    'compare',
+    'load_results',
+    'run',
+    'time_runs',
+    'write_results',
+]
+
+
+def time_runs(func: Callable, repeat: int, after: Callable = None) -> List[float]:
+    """
+    Call "func" "repeat" times, get the seconds each call took.  "after" is
+    called after each call, but isn't timed.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+        if after is not None:
+            after()
+    return times
+
+
+def run(backends: Iterable[Backend], rows: Iterable[int] = (100, 1000), widths: Iterable[int] = (0, 16),
+        groups: Iterable[str] = None, repeat: int = 5, log: Callable[[str], None] = None) -> List[dict]:
+    """
+    Run each benchmark of "groups" (all groups if None) on each backend, for
+    every count of rows and width of the person table.
+    """
+    groups = set(groups) if groups else None
+    results = []
+    for backend in backends:
+        for width in widths:
+            for count in rows:
+                conn = backend.connect()
+                create_schema(conn, backend.kind, width)
+                db = DictDB(conn)
+                seed(db, count, width)
+                add_references(db)
+                case = Case(backend, conn, db, count, width)
+                for (group, name), func in BENCHMARKS.items():
+                    if groups is not None and group not in groups:
+                        continue
+                    times = time_runs(func(case), repeat, conn.rollback)
+                    result = {
+                        'group': group,
+                        'name': name,
+                        'backend': backend.name,
+                        'rows': count,
+                        'width': width,
+                        'repeat': repeat,
+                        'min': min(times),
+                        'median': statistics.median(times),
+                        'mean': statistics.mean(times),
+                    }
+                    results.append(result)
+                    if log is not None:
+                        log(_describe(result) + f' {result["median"]:.6f}s')
+                conn.rollback()
+                conn.close()
+        backend.cleanup()
+    return results
+
+
+def _key(result: dict) -> tuple:
+    return result['group'], result['name'], result['backend'], result['rows'], result['width']
+
+
+def _describe(result: dict) -> str:
+    return '{0}.{1} {2} rows={3} width={4}'.format(*_key(result))
+
+
+def write_results(path: str, results: List[dict]):
+    """
+    Write results, and the environment they were gotten in, to a JSON file.
+    """
+    document = {
+        'dictorm': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': results,
+    }
+    with open(path, 'w') as fh:
+        json.dump(document, fh, indent=2)
+
+
+def load_results(path: str) -> List[dict]:
+    with open(path) as fh:
+        return json.load(fh)['results']
+
+
+def compare(baseline: List[dict], results: List[dict], threshold: float = 0.1,
+            minimum: float = 0.0005) -> List[dict]:
+    """
+    Compare the median time of each result to the same benchmark of the
+    baseline.  A result is a regression when it is more than "threshold"
+    (a fraction) slower than the baseline, and more than "minimum" seconds
+    slower; timings that small are mostly noise.
+    """
+    baseline = {_key(i): i for i in baseline}
+    comparisons = []
+    for result in results:
+        before: Optional[dict] = baseline.get(_key(result))
+        if before is None:
+            continue
+        change = (result['median'] - before['median']) / before['median'] if before['median'] else 0.0
+        comparisons.append({
+            'benchmark': _describe(result),
+            'baseline': before['median'],
+            'median': result['median'],
+            'change': change,
+            'regression': change > threshold and result['median'] - before['median'] > minimum,
+        })
+    return comparisons
@@ -0,0 +1,219 @@
+"""
+The benchmarks, grouped by the operations they measure.  Each benchmark is a
+function which is provided a Case, sets up what it needs, and returns the
+callable that will be timed.  Anything written by the timed callable is rolled
+back after each run.
+"""
+from collections import OrderedDict
+from typing import Callable, Dict as DictHint, List
+
+from dictorm import DictDB, ResultCache
+
+from .backends import Backend
+
+__all__ = [
+    'BENCHMARKS',
+    'Case',
+    'GROUPS',
+    'add_references',
+    'benchmark',
+]
+
+# (group, name) -> benchmark function
+BENCHMARKS: DictHint[tuple, Callable] = OrderedDict()
+
+
+def benchmark(group: str, name: str):
+    """
+    Register a benchmark function.
+    """
+
+    def register(func: Callable) -> Callable:
+        BENCHMARKS[(group, name)] = func
+        return func
+
+    return register
+
+
+class Case:
+    """
+    A seeded database with "rows" persons which have "width" extra columns.
+    """
+
+    def __init__(self, backend: Backend, conn, db: DictDB, rows: int, width: int):
+        self.backend = backend
+        self.conn = conn
+        self.db = db
+        self.rows = rows
+        self.width = width
+
+    def person(self, i: int) -> dict:
+        person = {'name': f'new{i}'}
+        person.update((f'extra{j}', f'value{i}') for j in range(self.width))
+        return person
+
+
+def add_references(db: DictDB):
+    """
+    Add the references of the benchmark tables to a DictDB.
+    """
+    Person, Car, Department, PD = db['person'], db['car'], db['department'], db['person_department']
+    Person['car'] = Person['car_id'] == Car['id']
+    Car['owners'] = Car['id'].many(Person['car_id'])
+    PD['department'] = PD['department_id'] == Department['id']
+    Person['person_departments'] = Person['id'].many(PD['person_id'])
+    Person['departments'] = Person['person_departments'].substratum('department')
+    Car['owner_departments'] = Car['owners'].aggregate('departments')
+
+
+@benchmark('inserts', 'flush')
+def insert_flush(case: Case):
+    Person = case.db['person']
+
+    def run():
+        for i in range(case.rows):
+            Person(case.person(i)).flush()
+
+    return run
+
+
+@benchmark('inserts', 'bulk')
+def insert_bulk(case: Case):
+    db = case.db
+    persons = [case.person(i) for i in range(case.rows)]
+    # Sqlite limits the parameters of a query
+    size = max(1, 900 // len(persons[0]))
+
+    def run():
+        for i in range(0, len(persons), size):
+            db.execute(db.curs, *db.bulk_insert('person', persons[i:i + size]).build(), table='person')
+
+    return run
+
+
+@benchmark('get_one', 'pk')
+def get_one_pk(case: Case):
+    Person = case.db['person']
+    ids = [i['id'] for i in Person.get_where()]
+
+    def run():
+        for i in ids:
+            Person.get_one(i)
+
+    return run
+
+
+@benchmark('get_where', 'scan')
+def get_where_scan(case: Case):
+    Person = case.db['person']
+
+    def run():
+        list(Person.get_where())
+
+    return run
+
+
+@benchmark('get_where', 'scan_cached')
+def get_where_scan_cached(case: Case):
+    Person = DictDB(case.conn, result_cache=ResultCache())['person']
+    list(Person.get_where())
+
+    def run():
+        list(Person.get_where())
+
+    return run
+
+
+@benchmark('references', 'one_to_one')
+def references_one_to_one(case: Case):
+    Person = case.db['person']
+
+    def run():
+        for person in Person.get_where():
+            person['car']
+
+    return run
+
+
+@benchmark('references', 'many')
+def references_many(case: Case):
+    Car = case.db['car']
+
+    def run():
+        for car in Car.get_where():
+            list(car['owners'])
+
+    return run
+
+
+@benchmark('references', 'substratum')
+def references_substratum(case: Case):
+    Person = case.db['person']
+
+    def run():
+        for person in Person.get_where():
+            person['departments']
+
+    return run
+
+
+@benchmark('references', 'aggregate')
+def references_aggregate(case: Case):
+    Car = case.db['car']
+
+    def run():
+        for car in Car.get_where():
+            car['owner_departments']
+
+    return run
+
+
+@benchmark('flush', 'update')
+def flush_update(case: Case):
+    persons = list(case.db['person'].get_where())
+
+    def run():
+        for person in persons:
+            person['name'] = person['name'][::-1]
+            person.flush()
+
+    return run
+
+
+@benchmark('build', 'select')
+def build_select(case: Case):
+    Person = case.db['person']
+
+    def run():
+        for i in range(case.rows):
+            Person.get_where(Person['id'] > i, name='Bob').query.build()
+
+    return run
+
+
+@benchmark('build', 'insert')
+def build_insert(case: Case):
+    db = case.db
+    persons = [case.person(i) for i in range(case.rows)]
+
+    def run():
+        for person in persons:
+            db.insert('person', **person).returning('*').build()
+
+    return run
+
+
+@benchmark('build', 'update')
+def build_update(case: Case):
+    db = case.db
+    Person = db['person']
+    persons = [case.person(i) for i in range(case.rows)]
+
+    def run():
+        for i, person in enumerate(persons):
+            db.update('person', **person).where(Person['id'] == i).returning('*').build()
+
+    return run
+
+
+GROUPS: List[str] = list(OrderedDict.fromkeys(group for group, _ in BENCHMARKS))
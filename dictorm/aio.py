@@ -0,0 +1,586 @@
+"""
+Provide asyncio support.  AsyncDictDB, AsyncTable and AsyncDict behave like
+DictDB, Table and Dict, but every method that queries the database must be
+awaited.  Queries are built by dictorm.pg and dictorm.sqlite, just like the
+synchronous classes.
+
+Sqlite is supported using aiosqlite.  Postgres is supported using a DB-API style
+async driver (such as aiopg) whose cursors accept psycopg2's DictCursor.
+
+>>> conn = await aiosqlite.connect('example.db')
+>>> db = await AsyncDictDB.create(conn)
+>>> Person = db['person']
+>>> bob = await Person(name='Bob').flush()
+>>> async for person in Person.get_where():
+>>>     person
+{'name':'Bob', 'id':1}
+>>> Person['manager'] = Person['manager_id'] == Person['id']
+>>> await bob['manager']
+None
+"""
+import asyncio
+import sqlite3
+import time
+from inspect import isawaitable
+from itertools import chain
+from typing import Optional
+
+from .dictorm import DBKind, Dict, NoCache, RawQuery, Table, UnexpectedRows
+from .dictorm import PRAGMA_TABLE_INFO, SQLITE_TABLES, args_to_comp, schema_from_rows, schema_queries
+from .instrument import QueryEvent, operation_of
+from .pg import Select, Insert, Update, Delete
+from .pg import QueryHint
+from .pg import Column
+from .sqlite import Insert as SqliteInsert
+from .sqlite import Column as SqliteColumn
+from .sqlite import Update as SqliteUpdate
+
+try:  # pragma: no cover
+    import aiosqlite
+except ImportError:  # pragma: no cover
+    aiosqlite = None
+
+try:  # pragma: no cover
+    from psycopg2.extras import DictCursor
+except ImportError:  # pragma: no cover
+    DictCursor = None
+
+__all__ = [
+    'AsyncDict',
+    'AsyncDictDB',
+    'AsyncResultsGenerator',
+    'AsyncTable',
+    'ReferenceLoader',
+]
+
+
+async def _resolve(value):
+    """
+    Await the provided value if it is awaitable.  Drivers disagree on which
+    cursor methods are coroutines.
+    """
+    if isawaitable(value):
+        return await value
+    return value
+
+
+class AsyncDict(Dict):
+    """
+    A Dict whose flush and delete methods must be awaited.  A reference must also
+    be awaited:
+
+    >>> car = await bob['car']
+    >>> subordinates = await bob['subordinates']
+    >>> async for subordinate in bob['subordinates']:
+    >>>     subordinate
+    """
+
+    async def flush(self):
+        """
+        Insert or Update this Dict, see Dict.flush.
+        """
+        if self.table.refs:
+            for i in self.values():
+                if isinstance(i, AsyncDict):
+                    await i.flush()
+
+        d = await self._execute_query(self._flush_query())
+        return self._flushed(d)
+
+    async def delete(self):
+        """
+        Delete this row from it's table in the database.  Requires primary keys
+        to be specified.
+        """
+        query = self.table.db.delete(self.table.name).where(
+            self._old_pk_and or self.pk_and())
+        return await self._execute_query(query)
+
+    async def _execute_query(self, query: QueryHint):
+        curs = await self.table.db.get_cursor()
+        try:
+            built = query.build()
+            execute = self.table.db.execute
+            if isinstance(built, list):
+                for sql, values in built:
+                    await execute(curs, sql, values, self.table.name)
+                if query.append_returning:
+                    return await curs.fetchone()
+            else:
+                sql, values = built
+                await execute(curs, sql, values, self.table.name)
+                if query._returning:
+                    return await curs.fetchone()
+        finally:
+            await _resolve(curs.close())
+
+    def __getitem__(self, key):
+        """
+        Get the provided "key" from this Dict instance.  If the key refers to a
+        referenced row, an awaitable is returned which will get the referenced
+        row(s).
+        """
+        ref = self.table.refs.get(key)
+        if not ref:
+            return super(AsyncDict, self).__getitem__(key)
+        if ref.many and not ref._substratum:
+            table = ref.column2.table
+            return table.get_where(table[ref.column2.column] == self[ref.column1.column])
+        return self._get_reference(key, ref)
+
+    async def _get_reference(self, key, ref):
+        # Only get the referenced row once, if it has a value, the reference's
+        # column hasn't been changed.
+        val = dict.get(self, key)
+        if val:
+            return val
+        table = ref.column2.table
+        comparison = table[ref.column2.column] == self[ref.column1.column]
+
+        if not ref.many and self.table.db.loader is not None:
+            val = await self.table.db.loader.load(ref, self[ref.column1.column])
+            if ref._substratum and val:
+                return await _resolve(val[ref._substratum])
+            dict.__setitem__(self, key, val)
+            return val
+
+        if ref.many:
+            results = [await _resolve(i[ref._substratum]) for i in await table.get_where(comparison)]
+            if ref._aggregate:
+                results = list(chain(*results))
+            return results
+
+        val = await table.get_one(comparison)
+        if ref._substratum and val:
+            return await _resolve(val[ref._substratum])
+        dict.__setitem__(self, key, val)
+        return val
+
+
+class ReferenceLoader:
+    """
+    Collects the one-to-one references awaited during one iteration of the event
+    loop, and gets the rows referenced by each column using one query.  See
+    AsyncDictDB.batch.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = {}
+
+    def load(self, ref, value) -> asyncio.Future:
+        """
+        Get a Future of the row referenced by "value".
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        if value is None:
+            future.set_result(None)
+            return future
+        if not self.pending:
+            # Called after the Tasks that are ready in this iteration
+            loop.call_soon(self._dispatch)
+        key = (ref.column2.table.name, ref.column2.column)
+        futures = self.pending.setdefault(key, (ref, {}))[1]
+        futures.setdefault(value, []).append(future)
+        return future
+
+    def _dispatch(self):
+        pending, self.pending = self.pending, {}
+        for ref, futures in pending.values():
+            asyncio.ensure_future(self._get(ref, futures))
+
+    async def _get(self, ref, futures: dict):
+        table, column = ref.column2.table, ref.column2.column
+        if self.db.kind == DBKind.postgres:
+            comparison = table[column].Any(list(futures))
+        else:
+            comparison = table[column].In(list(futures))
+        found = {}
+        try:
+            for row in await table.get_where(comparison):
+                if row[column] in found:
+                    raise UnexpectedRows('More than one row selected.')
+                found[row[column]] = row
+        except Exception as e:
+            for future in chain(*futures.values()):
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for value, value_futures in futures.items():
+            for future in value_futures:
+                if not future.done():
+                    future.set_result(found.get(value))
+
+
+class AsyncResultsGenerator:
+    """
+    An asynchronous ResultsGenerator.  The query will not be executed until the
+    results are iterated over using "async for", or awaited.  Awaiting an
+    AsyncResultsGenerator returns a list of all results.
+
+    >>> async for person in Person.get_where():
+    >>>     person
+    >>> persons = await Person.get_where()
+    """
+
+    def __init__(self, table, query: QueryHint, db):
+        self.table: AsyncTable = table
+        self.query = query
+        self.cache = []
+        self.completed = False
+        self.executed = False
+        self.db_kind = db.kind
+        self.db: AsyncDictDB = db
+        self.curs = None
+        self._nocache = False
+
+    def __aiter__(self):
+        if self.completed:
+            return self._iter_cache()
+        return self
+
+    async def _iter_cache(self):
+        for i in self.cache:
+            yield i
+
+    async def __anext__(self) -> AsyncDict:
+        await self.__execute_once()
+        d = await self.curs.fetchone() if self.curs else None
+        if not d:
+            await self.close()
+            self.completed = True
+            raise StopAsyncIteration
+        # Convert returned dictionary to a Dict
+        d = self.table(d)
+        d._in_db = True
+        if self._nocache is False:
+            self.cache.append(d)
+        return d
+
+    async def __execute_once(self):
+        if not self.executed:
+            self.executed = True
+            self.curs = await self.db.get_cursor()
+            sql, values = self.query.build()
+            await self.db.execute(self.curs, sql, values, self.table.name)
+
+    async def close(self):
+        """
+        Close this generator's cursor, no more results will be gotten.
+        """
+        if self.curs is not None:
+            curs, self.curs = self.curs, None
+            await _resolve(curs.close())
+
+    def __await__(self):
+        return self._all().__await__()
+
+    async def _all(self) -> list:
+        if self.completed and self._nocache:
+            raise NoCache('Caching has been disabled.')
+        results = [i async for i in self]
+        return self.cache if self._nocache is False else results
+
+    def nocache(self):
+        """
+        Return a new AsyncResultsGenerator that will not cache the results.
+        """
+        results = type(self)(self.table, self.query._copy(), self.db)
+        results._nocache = True
+        return results
+
+    def refine(self, *a, **kw):
+        """
+        Return a new AsyncResultsGenerator with a refined query.  See
+        ResultsGenerator.refine.
+        """
+        query = self.query._copy()
+        query = args_to_comp(query, self.table, *a, **kw)
+        return type(self)(self.table, query, self.db)
+
+    def order_by(self, order_by):
+        """
+        Return a new AsyncResultsGenerator with a modified ORDER BY clause.
+        """
+        query = self.query._copy().order_by(order_by)
+        return type(self)(self.table, query, self.db)
+
+    def limit(self, limit):
+        """
+        Return a new AsyncResultsGenerator with a modified LIMIT clause.
+        """
+        query = self.query._copy().limit(limit)
+        return type(self)(self.table, query, self.db)
+
+    def offset(self, offset):
+        """
+        Return a new AsyncResultsGenerator with a modified OFFSET clause.
+        """
+        query = self.query._copy().offset(offset)
+        return type(self)(self.table, query, self.db)
+
+
+def _not_supported(name: str):
+    def method(self, *a, **kw):
+        raise TypeError(f'AsyncTable does not support {name}')
+
+    method.__name__ = name
+    method.__doc__ = 'Not supported, raises a TypeError.'
+    return method
+
+
+class AsyncTable(Table):
+    """
+    A Table whose get_one and count methods must be awaited.  get_where and
+    get_raw return an AsyncResultsGenerator.
+
+    AsyncDictDB has no result cache, memory limit or connection pool, the Table
+    methods which use them raise a TypeError.
+    """
+
+    invalidate = _not_supported('invalidate')
+    memory_usage = _not_supported('memory_usage')
+    evict = _not_supported('evict')
+    parallel_map = _not_supported('parallel_map')
+    parallel_load = _not_supported('parallel_load')
+
+    def __call__(self, *a, **kw) -> AsyncDict:
+        """
+        Used to insert a row into this table.
+        """
+        d = AsyncDict(self, *a, **kw)
+        for ref_name in self.refs:
+            d[ref_name] = None
+        return d
+
+    def get_where(self, *a, **kw) -> AsyncResultsGenerator:
+        """
+        Get all rows as AsyncDicts where column values are as specified.  See
+        Table.get_where.
+        """
+        return AsyncResultsGenerator(self, self._select(*a, **kw), self.db)
+
+    async def get_one(self, *a, **kw) -> Optional[AsyncDict]:
+        """
+        Get a single row as an AsyncDict.  See Table.get_one.
+        """
+        rgen = self.get_where(*a, **kw)
+        try:
+            i = await rgen.__anext__()
+        except StopAsyncIteration:
+            return None
+        try:
+            await rgen.__anext__()
+        except StopAsyncIteration:  # Should only be one result
+            pass
+        else:
+            await rgen.close()
+            raise UnexpectedRows('More than one row selected.')
+        return i
+
+    def get_raw(self, sql_query: str, *a) -> AsyncResultsGenerator:
+        """
+        Get all rows returned by the raw SQL query provided, as AsyncDicts.
+        """
+        return AsyncResultsGenerator(self, RawQuery(sql_query, *a), self.db)
+
+    async def count(self) -> int:
+        """
+        Get the count of rows in this table.
+        """
+        curs = await self.db.get_cursor()
+        try:
+            await self.db.execute(curs, 'SELECT COUNT(*) FROM {table}'.format(
+                table=self.name), table=self.name)
+            return int((await curs.fetchone())[0])
+        finally:
+            await _resolve(curs.close())
+
+
+class _Batch:
+
+    def __init__(self, db):
+        self.db = db
+        self.outer = None
+
+    async def __aenter__(self):
+        self.outer = self.db.loader
+        if self.outer is None:
+            self.db.loader = ReferenceLoader(self.db)
+        return self.db.loader
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.db.loader = self.outer
+
+
+class _Transaction:
+    """
+    An aiopg-style connection is always in autocommit mode, and has no usable
+    commit or rollback methods.  Its transaction is controlled using BEGIN,
+    COMMIT and ROLLBACK statements executed by a cursor.
+    """
+
+    def __init__(self, db, commit: bool):
+        self.db = db
+        self.commit = commit
+        self.statements = db.kind == DBKind.postgres and getattr(db.conn, 'autocommit', False) is True
+
+    async def _statement(self, sql: str):
+        curs = await self.db.get_cursor()
+        try:
+            await self.db.execute(curs, sql)
+        finally:
+            await _resolve(curs.close())
+
+    async def __aenter__(self):
+        if self.statements:
+            await self._statement('BEGIN')
+        return self.db
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            if self.statements:
+                await self._statement('ROLLBACK')
+            else:
+                await _resolve(self.db.conn.rollback())
+        elif self.commit:
+            # Commit if no exceptions occur
+            if self.statements:
+                await self._statement('COMMIT')
+            else:
+                await _resolve(self.db.conn.commit())
+
+
+class AsyncDictDB(dict):
+    """
+    Get all the tables from the provided async connection.  The tables are
+    introspected when refresh_tables is awaited, use AsyncDictDB.create to do
+    both at once.
+
+    >>> db = await AsyncDictDB.create(your_async_db_connection)
+    >>> db['table1']
+    Table('table1')
+    """
+
+    def __init__(self, db_conn):
+        self.conn = db_conn
+        if aiosqlite is not None and isinstance(db_conn, aiosqlite.Connection):
+            self.kind = DBKind.sqlite3
+            self.insert = SqliteInsert
+            self.update = SqliteUpdate
+            self.column = SqliteColumn
+            self.conn.row_factory = sqlite3.Row
+        else:
+            self.kind = DBKind.postgres
+            self.insert = Insert
+            self.update = Update
+            self.column = Column
+        self.select = Select
+        self.delete = Delete
+        # Each query gets its own cursor, Tasks must not share a cursor.
+        self.curs = None
+        self.loader: Optional[ReferenceLoader] = None
+        self.before_execute = []
+        self.after_execute = []
+        super(AsyncDictDB, self).__init__()
+
+    def __repr__(self):  # pragma: no cover
+        return f'AsyncDictDB({self.kind}, {self.conn})'
+
+    @classmethod
+    async def create(cls, db_conn):
+        """
+        Create an AsyncDictDB and get all of its tables.
+        """
+        db = cls(db_conn)
+        await db.refresh_tables()
+        return db
+
+    @classmethod
+    def table_factory(cls) -> AsyncTable:
+        return AsyncTable
+
+    async def get_cursor(self):
+        """
+        Returns a cursor from the provided database connection that DictORM
+        objects expect.
+        """
+        if self.kind == DBKind.sqlite3:
+            return await self.conn.cursor()
+        return await self.conn.cursor(cursor_factory=DictCursor)
+
+    async def execute(self, curs, sql: str, values: list = None, table: str = None,
+                      operation: str = None):
+        """
+        Execute a query using the provided cursor, calling the before_execute
+        and after_execute hooks.  See DictDB.execute.
+        """
+        args = (sql,) if values is None else (sql, values)
+        if not self.before_execute and not self.after_execute:
+            await curs.execute(*args)
+            return curs
+
+        event = QueryEvent(sql, values, table, operation or operation_of(sql))
+        for hook in self.before_execute:
+            hook(event)
+        start = time.perf_counter()
+        try:
+            await curs.execute(*args)
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.elapsed = time.perf_counter() - start
+            event.rowcount = curs.rowcount
+            for hook in self.after_execute:
+                hook(event)
+        return curs
+
+    async def refresh_tables(self):
+        """
+        Create all AsyncTable instances from all tables found in the database.
+        """
+        curs = await self.get_cursor()
+        try:
+            names = None
+            if self.kind == DBKind.sqlite3 and not PRAGMA_TABLE_INFO:
+                await self.execute(curs, SQLITE_TABLES, operation='introspect')
+                names = [i[0] for i in await curs.fetchall()]
+            results = []
+            for sql, values in schema_queries(self.kind, names):
+                await self.execute(curs, sql, values, operation='introspect')
+                results.append(await curs.fetchall())
+        finally:
+            await _resolve(curs.close())
+
+        # Reset this AsyncDictDB because it may contain old tables
+        self.clear()
+        table_cls = self.table_factory()
+        for name, (columns_info, pks) in schema_from_rows(self.kind, results, names).items():
+            self[name] = table_cls(name, self, columns_info=columns_info, pks=pks)
+
+    def batch(self):
+        """
+        Async context manager which gets one-to-one references using as few
+        queries as possible.  The references awaited by Tasks during one
+        iteration of the event loop are gotten using one query per referenced
+        column.
+
+        >>> async with db.batch():
+        >>>     owners = await asyncio.gather(*(car['owner'] for car in cars))
+        """
+        return _Batch(self)
+
+    def transaction(self, commit: bool = False):
+        """
+        Async context manager to rollback changes in case of an error.
+
+        >>> async with db.transaction(commit=True):
+        >>>     await Person(name='Bob').flush()
+
+        The transaction of an autocommit Postgres connection (such as aiopg's) is
+        started with BEGIN, and ended with COMMIT or ROLLBACK.  If commit is
+        False and no error occurs, that transaction is left open.
+        """
+        return _Transaction(self, commit)
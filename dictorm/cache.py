@@ -0,0 +1,294 @@
+"""
+Share the rows of a query between the callers who execute it.  Provided to
+DictDB, these are used by ResultsGenerators (a SingleFlight only by those of
+bounded queries, see DictDB):
+
+>>> db = DictDB(your_db_connection, single_flight=True)
+>>> db = DictDB(your_db_connection, result_cache=ResultCache(maxsize=1000, ttl=60))
+
+Listeners evict cached rows when other processes change the database:
+
+>>> listener = db.listen(connect)
+"""
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, FrozenSet, Hashable, Iterable, List, Optional
+
+from .instrument import estimate_size
+
+__all__ = [
+    'DataVersionListener',
+    'INVALIDATION_CHANNEL',
+    'NotifyListener',
+    'ResultCache',
+    'SingleFlight',
+    'query_key',
+]
+
+# The Postgres channel which invalidations are sent on, with a "<table>:<pk>" payload
+INVALIDATION_CHANNEL = 'dictorm_invalidate'
+
+
+def query_key(sql: str, values) -> Hashable:
+    """
+    Get a hashable key of a built query.  Values that can't be hashed (such as
+    a dict of a json column) are compared using their repr.
+    """
+    values = tuple(values or ())
+    try:
+        hash(values)
+    except TypeError:
+        values = repr(values)
+    return sql, values
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.rows = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Execute only one of many identical queries at a time.  A caller who asks for
+    the rows of a query that is already being executed by another thread waits
+    for those rows instead of executing the query again.
+
+    Waiting callers get the rows of the executing caller's transaction.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key: Hashable, fetch: Callable[[], list]) -> List:
+        """
+        Call "fetch" and return its rows, unless a call with the same key is
+        in progress, then wait for a copy of that call's rows.  An error raised
+        by "fetch" is raised to every caller who waited for it.
+
+        If "fetch" returns something other than a list, it can't be shared and
+        every caller who waited for it gets None.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return list(call.rows) if isinstance(call.rows, list) else None
+
+        try:
+            call.rows = fetch()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.rows
+
+
+class ResultCache:
+    """
+    Keep the rows of queries, keyed by their SQL and values.  The least recently
+    used rows are evicted once more than "maxsize" queries are kept, and rows
+    expire "ttl" seconds after they were gotten (they never expire if ttl is
+    None).
+
+    Every query's rows are tagged with the tables it reads.  Invalidating a
+    table evicts the rows of every query that read it.
+
+    The rows of a query are only kept if there are at most "max_rows" of them,
+    the rows of a bigger query are streamed from its cursor instead.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, max_rows: int = 1000):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        if max_rows < 0:
+            raise ValueError('max_rows must be at least 0')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        # key -> (expires, rows, tables, estimated bytes), least recently used first
+        self.entries = OrderedDict()
+        # The estimated bytes of all entries, kept as entries are put and removed
+        self.bytes = 0
+        # table -> keys of the queries that read it
+        self.tags = {}
+        # table -> count of invalidations, used to detect an invalidation
+        # while a query was being executed
+        self.generations = {}
+        self.clears = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Optional[List]:
+        """
+        Get a copy of the rows of a query, or None if they aren't kept.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def generation(self, tables: Iterable[str]) -> tuple:
+        """
+        Get the invalidation count of each table, pass it to put so rows gotten
+        before an invalidation are not kept.
+        """
+        with self.lock:
+            return self._generation(tables)
+
+    def put(self, key: Hashable, rows: list, tables: FrozenSet[str], generation: tuple = None):
+        """
+        Keep the rows of a query which read "tables".
+        """
+        rows = list(rows)
+        size = estimate_size(rows)
+        with self.lock:
+            if generation is not None and generation != self._generation(tables):
+                return
+            self._remove(key)
+            expires = None if self.ttl is None else time.monotonic() + self.ttl
+            self.entries[key] = (expires, rows, tables, size)
+            self.bytes += size
+            for table in tables:
+                self.tags.setdefault(table, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tables: str):
+        """
+        Evict the rows of every query which read any of the provided tables.
+        """
+        with self.lock:
+            for table in tables:
+                self.generations[table] = self.generations.get(table, 0) + 1
+                for key in self.tags.pop(table, ()):
+                    self._remove(key)
+
+    def clear(self):
+        """
+        Evict all rows.
+        """
+        with self.lock:
+            self.clears += 1
+            self.entries.clear()
+            self.tags.clear()
+            self.bytes = 0
+
+    def memory_usage(self) -> int:
+        """
+        Estimate the bytes used by the rows that are kept.  The rows of each
+        query are measured once, when they are put.
+        """
+        return self.bytes
+
+    def _generation(self, tables: Iterable[str]) -> tuple:
+        return (self.clears,) + tuple(self.generations.get(i, 0) for i in tables)
+
+    def _remove(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[3]
+            for table in entry[2]:
+                self.tags.get(table, set()).discard(key)
+
+
+class _Listener(threading.Thread):
+    """
+    A thread which calls "invalidated" with the name of each table changed by
+    another process, or with None if it doesn't know which table was changed.
+    The thread connects using "connect".
+    """
+
+    def __init__(self, connect: Callable, invalidated: Callable[[Optional[str]], None],
+                 interval: float = 1.0):
+        super(_Listener, self).__init__(daemon=True)
+        self.connect = connect
+        self.invalidated = invalidated
+        self.interval = interval
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+        self.error = None
+
+    def run(self):
+        conn = None
+        try:
+            conn = self.connect()
+            self.listen(conn)
+        except Exception as e:
+            self.error = e
+        finally:
+            # Never leave a caller waiting for this listener to be ready
+            self.ready.set()
+            if conn is not None:
+                conn.close()
+
+    def listen(self, conn):  # pragma: no cover
+        raise NotImplementedError()
+
+    def stop(self):
+        """
+        Stop listening, and wait for the thread to finish.
+        """
+        self.stopped.set()
+        self.join()
+
+
+class NotifyListener(_Listener):
+    """
+    Listen for the invalidations sent on the INVALIDATION_CHANNEL by other
+    Postgres connections.
+    """
+
+    def listen(self, conn):
+        conn.autocommit = True
+        conn.cursor().execute(f'LISTEN {INVALIDATION_CHANNEL}')
+        self.ready.set()
+        while not self.stopped.is_set():
+            if select.select([conn], [], [], self.interval) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self.invalidated(notify.payload.partition(':')[0])
+
+
+class DataVersionListener(_Listener):
+    """
+    Poll a Sqlite database's data_version, which changes when another connection
+    commits a change.  Sqlite can't tell which tables were changed.
+    """
+
+    def listen(self, conn):
+        curs = conn.cursor()
+        version = curs.execute('PRAGMA data_version').fetchone()[0]
+        self.ready.set()
+        while not self.stopped.wait(self.interval):
+            new_version = curs.execute('PRAGMA data_version').fetchone()[0]
+            if new_version != version:
+                version = new_version
+                self.invalidated(None)
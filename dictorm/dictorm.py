@@ -1,21 +1,38 @@
 """What if you could insert a Python dictionary into the database?  DictORM allows you to select/insert/update rows of a database as if they were Python Dictionaries."""
+import csv
 import enum
+import json
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+import weakref
 from json import dumps
-from typing import Union, Optional, List
+from typing import Callable, FrozenSet, Iterator, Union, Optional, List
 
 __version__ = '4.2'
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from contextlib import contextmanager
+from functools import partial
 from itertools import chain
-from sys import modules
-
-from .pg import Select, Insert, Update, Delete
+from os import PathLike
+from sys import _getframe, modules
+
+from .cache import DataVersionListener, INVALIDATION_CHANNEL, NotifyListener, ResultCache
+from .cache import SingleFlight, query_key
+from .instrument import Metrics, NPlusOneDetector, ProfileReport, QueryEvent, SlowQueryLog, operation_of
+from .instrument import _ThreadOwner, deep_size, query_shape, render_prometheus
+from .pg import Select, Insert, BulkInsert, Update, Delete
 from .pg import And, QueryHint
 from .pg import Column, Comparison, Operator
 from .sqlite import Insert as SqliteInsert
+from .sqlite import BulkInsert as SqliteBulkInsert
 from .sqlite import Column as SqliteColumn
 from .sqlite import Update as SqliteUpdate
+from .tracing import NO_SPAN
 
 db_conn_type = sqlite3.Connection
 CursorHint = sqlite3.Cursor
@@ -38,13 +55,20 @@ __all__ = [
     '__version__',
     'And',
     'CannotUpdateColumn',
+    'ConnectionReleased',
     'DBKind',
     'Dict',
     'DictDB',
+    'EXPORT_FORMATS',
+    'LoadResult',
     'NoCache',
     'NoPrimaryKey',
+    'PoolError',
     'RawQuery',
+    'ReferenceBatch',
+    'ResultCache',
     'ResultsGenerator',
+    'SqlitePool',
     'Table',
     'UnexpectedRows',
 ]
@@ -66,11 +90,40 @@ class CannotUpdateColumn(Exception):
     pass
 
 
+class PoolError(Exception):
+    pass
+
+
+class ConnectionReleased(Exception):
+    pass
+
+
 class DBKind(enum.Enum):
     postgres = enum.auto()
     sqlite3 = enum.auto()
 
 
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_BUFFER_SIZE = 1 << 16
+
+
+class LoadResult:
+    """
+    The outcome of Table.parallel_load.  "errors" is a list of (batch_number,
+    exception) of every batch that failed.  The batch_number is None if the
+    error wasn't of a single batch, such as a failed commit.
+    """
+
+    def __init__(self):
+        self.inserted = 0
+        self.batches = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    def __repr__(self):  # pragma: no cover
+        return f'LoadResult(inserted={self.inserted}, batches={self.batches}, errors={len(self.errors)})'
+
+
 class Dict(dict):
     """
     This is a representation of a database row that behaves exactly like a
@@ -104,10 +157,14 @@ class Dict(dict):
     def __init__(self, table, *a, **kw):
         self.table: Table = table
         self._in_db = False
-        self._curs: CursorHint = table.db.curs
         super(Dict, self).__init__(*a, **kw)
         self._old_pk_and = None
 
+    @property
+    def _curs(self) -> CursorHint:
+        # Get the cursor when it's needed, it may belong to this thread's pooled connection
+        return self.table.db.curs
+
     def flush(self):
         """
         Insert this dictionary into it's table if its not yet in the Database, or
@@ -118,11 +175,21 @@ class Dict(dict):
         All original column/values will bet inserted/updated by this method.
         All references will be flushed as well.
         """
-        if self.table.refs:
-            for i in self.values():
-                if isinstance(i, Dict):
-                    i.flush()
+        with self.table.db.span('dictorm.flush', **{'db.sql.table': self.table.name}):
+            if self.table.refs:
+                for i in self.values():
+                    if isinstance(i, Dict):
+                        i.flush()
+
+            d = self.__execute_query(self._flush_query())
+            self._flushed(d)
+            self.table.invalidate(self._pk_string())
+        return self
 
+    def _flush_query(self) -> QueryHint:
+        """
+        Build the Insert or Update query that will flush this Dict.
+        """
         # This will be sent to the DB, don't convert dicts to json unless
         # the table has json columns.
         items = self.no_refs()
@@ -134,21 +201,23 @@ class Dict(dict):
         if not self._in_db:
             # Insert this Dict into it's respective table, interpolating
             # my values into the query
-            query = self.table.db.insert(self.table.name, **items
-                                         ).returning('*')
-            d = self.__execute_query(query)
-            self._in_db = True
-        else:
-            # Update this dictionary's row
-            if not self.table.pks:
-                raise NoPrimaryKey(
-                    'Cannot update to {0}, no primary keys defined.'.format(
-                        self.table))
-            # Update without references, "wheres" are the primary values
-            query = self.table.db.update(self.table.name, **items
-                                         ).where(self._old_pk_and or self.pk_and()).returning('*')
-            d = self.__execute_query(query)
-
+            return self.table.db.insert(self.table.name, **items
+                                        ).returning('*')
+
+        # Update this dictionary's row
+        if not self.table.pks:
+            raise NoPrimaryKey(
+                'Cannot update to {0}, no primary keys defined.'.format(
+                    self.table))
+        # Update without references, "wheres" are the primary values
+        return self.table.db.update(self.table.name, **items
+                                    ).where(self._old_pk_and or self.pk_and()).returning('*')
+
+    def _flushed(self, d):
+        """
+        Update this Dict with the row returned by its flush query.
+        """
+        self._in_db = True
         if d:
             super(Dict, self).__init__(d)
         self._old_pk_and = self.pk_and()
@@ -161,18 +230,22 @@ class Dict(dict):
         """
         query = self.table.db.delete(self.table.name).where(
             self._old_pk_and or self.pk_and())
-        return self.__execute_query(query)
+        with self.table.db.span('dictorm.delete', **{'db.sql.table': self.table.name}):
+            result = self.__execute_query(query)
+            self.table.invalidate(self._pk_string())
+        return result
 
     def __execute_query(self, query):
-        built = query.build()
+        built = self.table.db.build_query(query)
+        execute = partial(self.table.db.execute, self._curs, table=self.table.name)
         if isinstance(built, list):
             for sql, values in built:
-                self._curs.execute(sql, values)
+                execute(sql, values)
             if query.append_returning:
                 return self._curs.fetchone()
         else:
             sql, values = built
-            self._curs.execute(sql, values)
+            execute(sql, values)
             if query._returning:
                 return self._curs.fetchone()
 
@@ -184,6 +257,10 @@ class Dict(dict):
         return And(*[self.table[k] == v for k, v in self.items() if k in \
                      self.table.pks])
 
+    def _pk_string(self) -> Optional[str]:
+        # The primary key values sent with an invalidation
+        return ','.join(str(super(Dict, self).get(k)) for k in self.table.pks) or None
+
     def no_pks(self):
         """
         Return a dictionary without the primary keys that are associated with
@@ -222,19 +299,31 @@ class Dict(dict):
             comparison = table[ref.column2.column] == self[ref.column1.column]
 
             if ref.many:
-                gen = table.get_where(comparison)
-                if ref._substratum:
-                    gen = [i[ref._substratum] for i in gen]
-                if ref._aggregate:
-                    gen = list(chain(*gen))
+                self.table.db.reference_resolved(self.table, key)
+                with self._reference_span(key):
+                    gen = table.get_where(comparison)
+                    if ref._substratum:
+                        gen = [i[ref._substratum] for i in gen]
+                    if ref._aggregate:
+                        gen = list(chain(*gen))
                 return gen
             else:
-                val = table.get_one(comparison)
+                batch = self.table.db.current_batch()
+                if batch is not None:
+                    val = batch.get_reference(self, key, ref)
+                else:
+                    self.table.db.reference_resolved(self.table, key)
+                    with self._reference_span(key):
+                        val = table.get_one(comparison)
                 if ref._substratum and val:
                     return val[ref._substratum]
                 super(Dict, self).__setitem__(key, val)
         return val
 
+    def _reference_span(self, key: str):
+        return self.table.db.span('dictorm.reference', **{'db.sql.table': self.table.name,
+                                                          'dictorm.reference': key})
+
     def get(self, key, default=None):
         # Provide the same functionality as a dict.get, but use this class's
         # __getitem__ instead of builtin __getitem__
@@ -258,6 +347,110 @@ class Dict(dict):
     get.__doc__ = dict.get.__doc__
 
 
+class ReferenceBatch:
+    """
+    Gets the one-to-one references of many Dicts using one query.  Dicts gotten
+    while a batch is in use are kept.  When one of their references is gotten,
+    the referenced rows of all the kept Dicts of that table are gotten at once,
+    and are shared by all references to the same column.  See DictDB.batch.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.dicts = {}
+        self.loaded = {}
+
+    def add(self, d: Dict):
+        """
+        Keep a Dict so its references can be gotten with the others.
+        """
+        self.dicts.setdefault(d.table.name, []).append(d)
+
+    def get_reference(self, d: Dict, key: str, ref: Comparison) -> Optional[Dict]:
+        """
+        Get the row referenced by "d[key]", getting the same reference of every
+        kept Dict at the same time.
+        """
+        value = d[ref.column1.column]
+        if value is None:
+            return None
+        # References to the same column share the rows that have been gotten
+        loaded = self.loaded.setdefault((ref.column2.table.name, ref.column2.column), {})
+        if value not in loaded:
+            self._load(loaded, d.table.name, key, ref, value)
+        return loaded[value]
+
+    def _load(self, loaded: dict, table_name: str, key: str, ref: Comparison, value):
+        fk = ref.column1.column
+        values = {value}
+        values.update(i[fk] for i in self.dicts.get(table_name, ())
+                      if fk in i and not dict.get(i, key))
+        values = [i for i in values if i is not None and i not in loaded]
+
+        table, column = ref.column2.table, ref.column2.column
+        if self.db._metrics is not None:
+            self.db._metrics.reference_resolved(table_name, key)
+        if self.db.kind == DBKind.postgres:
+            comparison = table[column].Any(values)
+        else:
+            comparison = table[column].In(values)
+        found = {}
+        with self.db.span('dictorm.reference', **{'db.sql.table': table_name, 'dictorm.reference': key,
+                                                  'dictorm.batch_size': len(values)}):
+            for row in table.get_where(comparison):
+                if row[column] in found:
+                    raise UnexpectedRows('More than one row selected.')
+                found[row[column]] = row
+        loaded.update((i, found.get(i)) for i in values)
+
+
+# A table named in a raw query
+_TABLE_CLAUSE = re.compile(r'\b(FROM|USING|JOIN|INTO|UPDATE)\b', re.IGNORECASE)
+_TABLE_REFERENCE = re.compile(r'\s*(?:"(\w+)"|(\w+))(?:\.(?:"(\w+)"|(\w+)))?')
+# The start of the next table of a FROM list, or the end of the list
+_FROM_LIST = re.compile(r'[(),]|\b(?:WHERE|GROUP|HAVING|ORDER|LIMIT|OFFSET|UNION|INTERSECT|EXCEPT|WINDOW|FOR'
+                        r'|RETURNING)\b', re.IGNORECASE)
+
+
+def _referenced_tables(sql: str) -> Optional[List[str]]:
+    """
+    Get the names of the tables a query reads or changes, including every table
+    of a comma separated FROM list.  The schema of a qualified name is dropped.
+    None is returned if a table can't be read, such as a quoted name which
+    isn't a plain word.
+    """
+    names = []
+
+    def reference(position: int) -> bool:
+        if sql[position:].lstrip().startswith('('):
+            # A subquery's tables are found by its own clauses
+            return True
+        match = _TABLE_REFERENCE.match(sql, position)
+        if match is None:
+            return False
+        names.append(match.group(3) or match.group(4) or match.group(1) or match.group(2))
+        return True
+
+    for clause in _TABLE_CLAUSE.finditer(sql):
+        if not reference(clause.end()):
+            return None
+        if clause.group(1).upper() not in ('FROM', 'USING'):
+            continue
+        depth = 0
+        for token in _FROM_LIST.finditer(sql, clause.end()):
+            text = token.group()
+            if text == '(':
+                depth += 1
+            elif text == ')' and depth:
+                depth -= 1
+            elif depth == 0:
+                if text != ',':
+                    break
+                if not reference(token.end()):
+                    return None
+    return names
+
+
 class RawQuery:
     """
     Used only for Table.get_raw.  Merely returns the provided args when build is called.
@@ -270,6 +463,9 @@ class RawQuery:
     def build(self):
         return self.sql_query, self.args
 
+    def _copy(self):
+        return RawQuery(self.sql_query, *self.args)
+
 
 class ResultsGenerator:
     """
@@ -277,6 +473,13 @@ class ResultsGenerator:
     results will be fetched until "__next__" is called.  Results are cached and
     will not be gotten again.  To get new results if they have been changed,
     create a new ResultsGenerator instance, or flush your Dict.
+
+    A cursor is borrowed from the DictDB when the query is executed, and is
+    returned once all results have been gotten.  Use close (or a with statement)
+    to return the cursor before all results have been gotten:
+
+    >>> with Person.get_where() as persons:
+    >>>     bob = next(persons)
     """
 
     def __init__(self, table, query: QueryHint, db):
@@ -287,44 +490,205 @@ class ResultsGenerator:
         self.executed = False
         self.db_kind = db.kind
         self.db: DictDB = db
-        self.curs: CursorHint = self.db.get_cursor()
+        self.curs: Optional[CursorHint] = None
+        self._rowcount = -1
         self._nocache = False
+        # Evicted before all results were gotten, see evict
+        self._evicted = False
+        self._single_flight = False
+        self._batches_ahead = 0
+        self._batch_size = 0
+        self._prefetcher: Optional[_Prefetcher] = None
+        self._rows: Optional[Iterator] = None
+        # A running estimate of the bytes of the cached Dicts, kept when the
+        # DictDB has a memory_limit
+        self._bytes = 0
+        self._dict_size: Optional[int] = None
+        # The pool connection this generator's cursor belongs to
+        self._checkout: Optional[_Checkout] = None
+
+    def __del__(self):
+        # A prefetching thread would wait forever for this generator to get
+        # its next batch.
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
 
     def __iter__(self):
-        if self.completed:
+        if self.completed and self._evicted:
+            # The results weren't all cached, get them again
+            self.executed = self.completed = self._nocache = self._evicted = False
+            return self
+        elif self.completed:
             return iter(self.cache)
         else:
             return self
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def __next__(self) -> Dict:
         self.__execute_once()
-        d = self.curs.fetchone()
+        profile = self.db._profile
+        if profile is not None:
+            start = time.perf_counter()
+        d = self.__fetchone()
         if not d:
             self.completed = True
+            self._checkout = None
+            self.close()
             raise StopIteration
+        metrics = self.db._metrics
+        if metrics is not None:
+            if self._rows is None:
+                metrics.rows_fetched(self.table.name)
+            metrics.dicts_materialized(self.table.name)
+        if profile is not None:
+            fetched = time.perf_counter()
+            profile.add('row_conversion', fetched - start)
         # Convert returned dictionary to a Dict
         d = self.table(d)
         d._in_db = True
+        if profile is not None:
+            profile.add('dict_construction', time.perf_counter() - fetched)
         if self._nocache is False:
             self.cache.append(d)
+        if self.db.memory_limit is not None:
+            self.db.materialized(self, d)
+        batch = self.db.current_batch()
+        if batch is not None:
+            batch.add(d)
         return d
 
+    def __fetchone(self):
+        if self._checkout is not None and self._checkout.released:
+            raise ConnectionReleased('the connection of these results was returned to the pool, get'
+                                     ' them before the transaction ends')
+        if self._rows is not None:
+            row = next(self._rows, None)
+            if row is not None or self.curs is None:
+                return row
+            # The rest of the rows are streamed from the cursor
+            self._rows = None
+        if self._prefetcher:
+            try:
+                return self._prefetcher.fetchone()
+            except Exception:
+                self.close()
+                raise
+        return self.curs.fetchone() if self.curs else None
+
     def __execute_once(self):
         if not self.executed:
             self.executed = True
-            sql, values = self.query.build()
-            self.curs.execute(sql, values)
+            if self._nocache is False:
+                self.table._generators.add(self)
+            with self.db.span('dictorm.results', **{'db.sql.table': self.table.name}) as span:
+                self.__execute(span)
+            if self.curs is not None and self.db.pool is not None:
+                # Stopped if the connection is returned to the pool before all
+                # results are gotten
+                self._checkout = self.db._local.checkout
+                self._checkout.results.add(self)
+
+    def __execute(self, span):
+        sql, values = self.db.build_query(self.query)
+        if self._batches_ahead:
+            span.set_attribute('dictorm.prefetch', True)
+            self.curs = self.__prefetch_cursor()
+            execute = partial(self.db.execute, self.curs, sql, values, self.table.name)
+            self._prefetcher = _Prefetcher(self.curs, execute, self._batches_ahead,
+                                           self._batch_size)
+            return
+        single_flight = self.db.single_flight is not None and self.__bounded()
+        if not self._nocache and (single_flight or self.db.result_cache is not None):
+            rows = self.db.fetch_rows(sql, values, self._tables(sql), self.table.name, single_flight)
+            if isinstance(rows, _StreamedRows):
+                self.curs, rows = rows.curs, rows.rows
+                self._rowcount = self.curs.rowcount
+            else:
+                self._rowcount = len(rows)
+            span.set_attribute('dictorm.rowcount', self._rowcount)
+            self._rows = iter(rows)
+            return
+        curs = self.db.borrow_cursor()
+        try:
+            self.db.execute(curs, sql, values, self.table.name)
+        except Exception:
+            self.db.return_cursor(curs)
+            raise
+        self.curs = curs
+        self._rowcount = curs.rowcount
+
+    def __bounded(self) -> bool:
+        # Only the rows of queries which get a few rows are shared by
+        # single_flight, unless the caller opted in.
+        limit = getattr(self.query, '_limit', None)
+        return self._single_flight or (isinstance(limit, int) and limit >= 0)
+
+    def _tables(self, sql: str) -> Optional[FrozenSet[str]]:
+        """
+        Get the names of the tables used by this generator's query, or None if a
+        raw query uses anything other than the tables of the DictDB (such as a
+        view or a function) or its tables can't be read.
+        """
+        tables = {self.table.name}
+        if isinstance(self.query, RawQuery):
+            names = _referenced_tables(sql)
+            if names is None or any(i not in self.db for i in names):
+                return None
+            tables.update(names)
+        return frozenset(tables)
+
+    def __prefetch_cursor(self) -> CursorHint:
+        if self.db_kind == DBKind.postgres:
+            # A server-side cursor, so each batch is a separate trip to the
+            # database which can overlap with the caller's work.
+            return self._server_cursor('prefetch')
+        return self.db.borrow_cursor()
+
+    def _server_cursor(self, purpose: str, itersize: int = None) -> CursorHint:
+        """
+        Create a Postgres server-side cursor, which fetches "itersize" rows at
+        a time.  Server-side cursors can't be reused, close it when done.
+        """
+        curs = self.db.conn.cursor(f'dictorm_{purpose}_{id(self)}', cursor_factory=DictCursor)
+        if itersize is not None:
+            curs.itersize = itersize
+        return curs
+
+    def close(self):
+        """
+        Return this generator's cursor to the DictDB.  No more results will be
+        gotten, but results that have already been gotten are still cached.
+        """
+        self._rows = None
+        prefetcher, self._prefetcher = self._prefetcher, None
+        if prefetcher is not None:
+            prefetcher.stop()
+        if self.curs is not None:
+            curs, self.curs = self.curs, None
+            if prefetcher is not None and self.db_kind == DBKind.postgres:
+                # Server-side cursors can't be reused
+                curs.close()
+            else:
+                self.db.return_cursor(curs)
 
     def __len__(self) -> int:
         self.__execute_once()
-        if self.db_kind == DBKind.sqlite3:
-            # sqlite3's cursor.rowcount doesn't support select statements
-            # returns a 0 because this method is called when a ResultsGenerator
-            # is converted into a list()
+        if self.db_kind == DBKind.sqlite3 or self._prefetcher:
+            # sqlite3's cursor.rowcount doesn't support select statements, and
+            # a prefetching query may still be executing.  Returns a 0 because
+            # this method is called when a ResultsGenerator is converted into a
+            # list()
             return 0
-        return self.curs.rowcount
+        return self._rowcount
 
     def __getitem__(self, i) -> Dict:
+        if self._evicted:
+            raise NoCache('The cached results have been evicted.')
         if isinstance(i, int) and i >= 0:
             try:
                 return self.cache[i]
@@ -349,10 +713,68 @@ class ResultsGenerator:
         """
         Return a new ResultsGenerator that will not cache the results.
         """
-        results = ResultsGenerator(self.table, self.query._copy(), self.db)
+        results = type(self)(self.table, self.query._copy(), self.db)
         results._nocache = True
         return results
 
+    def single_flight(self):
+        """
+        Return a new ResultsGenerator whose rows are shared with identical
+        queries executed by other threads at the same time, if the DictDB has
+        single_flight enabled.  A query with a LIMIT, or of get_one, is shared
+        without calling this.  All rows of a shared query are fetched at once.
+        """
+        results = type(self)(self.table, self.query._copy(), self.db)
+        results._single_flight = True
+        return results
+
+    def prefetching(self, batches_ahead: int = 2, batch_size: int = 100):
+        """
+        Return a new ResultsGenerator which executes its query and fetches
+        batches of "batch_size" rows in a background thread, while the caller
+        works with the rows already gotten.  At most "batches_ahead" batches
+        will wait to be gotten.  Postgres batches are fetched from a server-side
+        cursor.  Sqlite connections must be created with
+        check_same_thread=False.
+
+        Any error is raised by "__next__".  Use close (or a with statement) to
+        stop the background thread if not all results will be gotten.
+
+        >>> with Person.get_where().prefetching(batches_ahead=4) as persons:
+        >>>     for person in persons:
+        >>>         process(person)
+        """
+        if batches_ahead < 1 or batch_size < 1:
+            raise ValueError('batches_ahead and batch_size must be at least 1')
+        results = type(self)(self.table, self.query._copy(), self.db)
+        results._nocache = self._nocache
+        results._batches_ahead = batches_ahead
+        results._batch_size = batch_size
+        return results
+
+    def memory_usage(self) -> int:
+        """
+        Estimate the bytes used by the cached Dicts of this generator, including
+        the referenced rows that have been gotten and kept by those Dicts.
+        """
+        return deep_size(self.cache)
+
+    def evict(self):
+        """
+        Drop the cached Dicts of this generator.  A generator which has gotten
+        all of its results will execute its query again if it's iterated again.
+        A generator which hasn't will not cache its remaining results, it can't
+        be indexed, and it will execute its query again if it's iterated again
+        once all results have been gotten.
+        """
+        if self.completed:
+            self.executed = self.completed = False
+        else:
+            self._nocache = self._evicted = True
+        self.cache = []
+        self._bytes = 0
+        self.table._generators.discard(self)
+
     def refine(self, *a, **kw):
         """
         Return a new ResultsGenerator with a refined query.  Arguments provided
@@ -368,7 +790,7 @@ class ResultsGenerator:
         """
         query = self.query._copy()
         query = args_to_comp(query, self.table, *a, **kw)
-        return ResultsGenerator(self.table, query, self.db)
+        return type(self)(self.table, query, self.db)
 
     def order_by(self, order_by):
         """
@@ -380,7 +802,7 @@ class ResultsGenerator:
             .order_by('entrydate DESC')
         """
         query = self.query._copy().order_by(order_by)
-        return ResultsGenerator(self.table, query, self.db)
+        return type(self)(self.table, query, self.db)
 
     def limit(self, limit):
         """
@@ -392,7 +814,7 @@ class ResultsGenerator:
             .limit('ALL')
         """
         query = self.query._copy().limit(limit)
-        return ResultsGenerator(self.table, query, self.db)
+        return type(self)(self.table, query, self.db)
 
     def offset(self, offset):
         """
@@ -403,7 +825,145 @@ class ResultsGenerator:
             .offset(10)
         """
         query = self.query._copy().offset(offset)
-        return ResultsGenerator(self.table, query, self.db)
+        return type(self)(self.table, query, self.db)
+
+    def export(self, path_or_file, format: str = 'csv', batch_size: int = 1000) -> int:
+        """
+        Write all rows of this query to a file without converting them to Dicts.
+        Accepts a path or an open text file.  Rows are streamed in batches of
+        "batch_size" so memory use does not depend on the size of the results.
+        A Postgres CSV export is handed to COPY, other Postgres exports are
+        fetched using a server-side cursor.  Returns the number of rows written.
+
+        Examples:
+            .export('people.csv')
+            .export('people.jsonl', format='jsonl')
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f'Cannot export to "{format}", expected one of {EXPORT_FORMATS}')
+
+        # Use a separate cursor so this export doesn't interfere with iteration
+        if self.db_kind == DBKind.postgres and format != 'csv':
+            # A client-side cursor would buffer all rows when the query is executed
+            curs = self._server_cursor('export', batch_size)
+            try:
+                return self._export(curs, path_or_file, format, batch_size)
+            finally:
+                curs.close()
+        curs = self.db.borrow_cursor()
+        try:
+            return self._export(curs, path_or_file, format, batch_size)
+        finally:
+            self.db.return_cursor(curs)
+
+    def _export(self, curs: CursorHint, path_or_file, format: str, batch_size: int) -> int:
+        with _open_export(path_or_file) as fh:
+            if self.db_kind == DBKind.postgres and format == 'csv':
+                sql = curs.mogrify(*self.query.build()).decode()
+                self.db.execute(curs, f'COPY ({sql}) TO STDOUT WITH CSV HEADER', table=self.table.name,
+                                copy_file=fh)
+                return curs.rowcount
+
+            self.db.execute(curs, *self.query.build(), table=self.table.name)
+            # A server-side cursor's description is only known once rows are fetched
+            rows = curs.fetchmany(batch_size)
+            columns = [i[0] for i in curs.description]
+            if format == 'csv':
+                writer = csv.writer(fh)
+                writer.writerow(columns)
+                write_rows = writer.writerows
+            else:
+                def write_rows(rows):
+                    fh.writelines(dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+
+            count = 0
+            while rows:
+                write_rows(rows)
+                count += len(rows)
+                rows = curs.fetchmany(batch_size)
+        return count
+
+
+class _StreamedRows:
+    """
+    The first rows of a query which got too many rows to be kept by a
+    ResultCache, and the borrowed cursor the rest of its rows are fetched from.
+    """
+
+    def __init__(self, rows: list, curs: CursorHint):
+        self.rows = rows
+        self.curs = curs
+
+
+class _Prefetcher:
+    """
+    Execute a query (by calling "execute") and fetch its rows in a background
+    thread.  Batches of rows
+    are kept in a bounded queue, an error is kept in the queue to be raised by
+    fetchone.
+    """
+
+    def __init__(self, curs: CursorHint, execute: Callable, batches_ahead: int, batch_size: int):
+        self.batches = queue.Queue(maxsize=batches_ahead)
+        self.stopped = threading.Event()
+        self.rows = iter(())
+        self.done = False
+        self.thread = threading.Thread(target=self._fetch, args=(curs, execute, batch_size),
+                                       daemon=True)
+        self.thread.start()
+
+    def _fetch(self, curs: CursorHint, execute: Callable, batch_size: int):
+        try:
+            execute()
+            rows = True
+            while rows and not self.stopped.is_set():
+                rows = curs.fetchmany(batch_size)
+                self.batches.put(rows)
+        except Exception as e:
+            self.batches.put(e)
+
+    def fetchone(self):
+        """
+        Get the next row, waiting for the next batch if necessary.  Returns None
+        once all rows have been gotten.
+        """
+        for row in self.rows:
+            return row
+        if self.done:
+            return None
+        batch = self.batches.get()
+        if isinstance(batch, Exception):
+            self.done = True
+            raise batch
+        if not batch:
+            self.done = True
+            return None
+        self.rows = iter(batch)
+        return next(self.rows)
+
+    def stop(self):
+        """
+        Stop fetching, and wait for the background thread to finish.
+        """
+        self.stopped.set()
+        while self.thread.is_alive():
+            # Make room for a batch the thread is waiting to put
+            try:
+                self.batches.get_nowait()
+            except queue.Empty:
+                self.thread.join(0.01)
+
+
+@contextmanager
+def _open_export(path_or_file):
+    """
+    Yield the provided file, or open (and later close) the provided path for writing.
+    """
+    if isinstance(path_or_file, (str, bytes, PathLike)):
+        with open(path_or_file, 'w', newline='', buffering=EXPORT_BUFFER_SIZE) as fh:
+            yield fh
+    else:
+        yield path_or_file
 
 
 class Table(object):
@@ -468,36 +1028,64 @@ class Table(object):
     3
     """
 
-    def __init__(self, table_name, db):
+    def __init__(self, table_name, db, columns_info: List[dict] = None, pks: List[str] = None):
         self.name = table_name
         self.db = db
-        self.curs = db.curs
         self.pks = []
         self.refs = {}
-        self._refresh_pks()
+        # Primary keys and column info may have already been gotten by DictDB.refresh_tables
+        if pks is None:
+            self._refresh_pks()
+        else:
+            self.pks = list(pks)
+        self._introspected_pks = list(self.pks)
         self.order_by = None
         self.fks = {}
         self._updateable_column_names = set()
-        self.cached_columns_info = None
+        self.cached_columns_info = columns_info
         self.cached_column_names = None
+        # The ResultsGenerators of this table which cache their results
+        self._generators = weakref.WeakSet()
 
     def _refresh_pks(self):
         """
         Get a list of Primary Keys set for this table in the DB.
         """
         if self.db.kind == DBKind.sqlite3:
-            self.curs.execute('pragma table_info(%s)' % self.name)
-            self.pks = [i['name'] for i in self.curs.fetchall() if i['pk']]
+            self.db.execute(self.curs, 'pragma table_info(%s)' % self.name, table=self.name,
+                            operation='introspect')
+            # "pk" is the position of the column in the primary key
+            self.pks = [i['name'] for i in sorted(self.curs.fetchall(), key=lambda i: i['pk']) if i['pk']]
 
         elif self.db.kind == DBKind.postgres:
-            self.curs.execute('''SELECT a.attname
+            self.db.execute(self.curs, '''SELECT a.attname
                     FROM pg_index i
+                    CROSS JOIN generate_subscripts(i.indkey, 1) AS k
                     JOIN pg_attribute a ON a.attrelid = i.indrelid
-                    AND a.attnum = ANY(i.indkey)
+                    AND a.attnum = i.indkey[k]
                     WHERE i.indrelid = '%s'::regclass
-                    AND i.indisprimary;''' % self.name)
+                    AND i.indisprimary
+                    ORDER BY k;''' % self.name, table=self.name, operation='introspect')
             self.pks = [i[0] for i in self.curs.fetchall()]
 
+    @property
+    def curs(self) -> CursorHint:
+        return self.db.curs
+
+    def _update_schema(self, columns_info: List[dict], pks: List[str]):
+        """
+        Use newly introspected column info and primary keys.  Cached column
+        information is only reset if the columns have changed, and custom
+        primary keys are kept unless the table's primary keys have changed.
+        """
+        if columns_info != self.cached_columns_info:
+            self.cached_columns_info = columns_info
+            self.cached_column_names = None
+            self._updateable_column_names = set()
+        if pks != self._introspected_pks:
+            self.pks = list(pks)
+            self._introspected_pks = list(pks)
+
     def __repr__(self) -> str:  # pragma: no cover
         return f'Table({self.name}, {self.pks})'
 
@@ -549,6 +1137,12 @@ class Table(object):
         >>> bob in Person
         True
 
+        """
+        return ResultsGenerator(self, self._select(*a, **kw), self.db)
+
+    def _select(self, *a, **kw) -> Select:
+        """
+        Build the Select query used by get_where.
         """
         # When column names are quoted in an SQLite statement and the column doesn't exist, SQLite doesn't raise
         # an exception.  We'll raise an exception if any columns don't exist.
@@ -565,8 +1159,7 @@ class Table(object):
             order_by = self.order_by
         elif self.pks:
             order_by = str(self.pks[0]) + ' ASC'
-        query = Select(self.name, operator_group).order_by(order_by)
-        return ResultsGenerator(self, query, self.db)
+        return Select(self.name, operator_group).order_by(order_by)
 
     def get_one(self, *a, **kw) -> Optional[Dict]:
         """
@@ -577,6 +1170,8 @@ class Table(object):
         UnexpectedRows error.
         """
         rgen = self.get_where(*a, **kw)
+        # At most a few rows are expected, they can be shared by single_flight
+        rgen._single_flight = True
         try:
             i = next(rgen)
         except StopIteration:
@@ -586,6 +1181,8 @@ class Table(object):
         except StopIteration:  # Should only be one result
             pass
         else:
+            # Return the borrowed cursor, the other rows will never be gotten
+            rgen.close()
             raise UnexpectedRows('More than one row selected.')
         return i
 
@@ -603,10 +1200,251 @@ class Table(object):
         """
         Get the count of rows in this table.
         """
-        self.curs.execute('SELECT COUNT(*) FROM {table}'.format(
-            table=self.name))
+        self.db.execute(self.curs, 'SELECT COUNT(*) FROM {table}'.format(
+            table=self.name), table=self.name)
         return int(self.curs.fetchone()[0])
 
+    def memory_usage(self) -> int:
+        """
+        Estimate the bytes used by the cached Dicts of this table's
+        ResultsGenerators.
+        """
+        seen = set()
+        return sum(deep_size(i.cache, seen) for i in list(self._generators))
+
+    def evict(self):
+        """
+        Drop the cached Dicts of all of this table's ResultsGenerators.
+        """
+        for generator in list(self._generators):
+            generator.evict()
+
+    def invalidate(self, pk: str = None):
+        """
+        Evict the cached rows of every query which read this table.  Dicts of
+        this table do this when they are flushed or deleted, call this after
+        changing this table any other way.
+
+        If the DictDB notifies other processes of invalidations, a notification
+        (with the changed primary key, if provided) is sent using this thread's
+        cursor.  It will be received when the transaction is committed.
+        """
+        if self.db.result_cache is not None:
+            self.db.result_cache.invalidate(self.name)
+        if self.db.notify:
+            self.db.notify_invalidation(self.name, pk)
+
+    def parallel_map(self, func: Callable, *a, workers: int = None, partitions: int = None,
+                     connect: Callable = None, count_only: bool = False, **kw) -> Union[Iterator, int]:
+        """
+        Call "func" with every row (that matches the arguments, see get_where)
+        using a pool of worker processes.  The rows are split into "partitions"
+        ranges of this table's primary key, each worker process gets a range of
+        rows using its own connection.
+
+        Returns a generator of func's results, in no particular order.  If
+        count_only is True, func's results are discarded and the count of rows is
+        returned.
+
+        "func" and "connect" are sent to the worker processes, they must be
+        picklable.  "connect" is called to create each worker's connection, it is
+        only optional for a Sqlite database file.  Workers can't see changes that
+        haven't been committed.
+
+        >>> def name_length(person):
+        >>>     return len(person['name'])
+        >>> sum(Person.parallel_map(name_length, Person['id'] > 10, workers=4))
+        """
+        if len(self.pks) != 1:
+            raise NoPrimaryKey(f'A single Primary Key is required to partition {self}')
+        connect = connect or self.db._connect_callable()
+        workers = workers or os.cpu_count()
+        partitions = partitions or workers * 4
+
+        pk = self.pks[0]
+        where = args_to_comp(And(), self, *a, **kw)
+        sql = f'SELECT MIN("{pk}"), MAX("{pk}") FROM "{self.name}"'
+        if where.operators_or_comp:
+            sql += f' WHERE {where}'
+        curs = self.db.borrow_cursor()
+        try:
+            self.db.execute(curs, sql, list(where), self.name)
+            low, high = curs.fetchone()
+        finally:
+            self.db.return_cursor(curs)
+        if low is None:
+            return 0 if count_only else iter([])
+        if not isinstance(low, int):
+            raise ValueError(f'Cannot partition {self}, its Primary Key is not an integer')
+
+        # Split the primary keys into ranges of (nearly) equal width
+        bounds = sorted({low + (high - low + 1) * i // partitions for i in range(partitions + 1)})
+        queries = []
+        for start, end in zip(bounds, bounds[1:]):
+            comparison = And(*where.operators_or_comp, self[pk] >= start, self[pk] < end)
+            queries.append(Select(self.name, comparison).order_by(f'{pk} ASC').build())
+
+        results = self._parallel_map(func, queries, workers, connect, count_only)
+        return sum(results) if count_only else results
+
+    def parallel_load(self, rows, connections: int = 4, batch_size: int = 1000, connect: Callable = None,
+                      single_transaction: bool = False, timeout: float = 60.0) -> LoadResult:
+        """
+        Insert many rows (dictionaries of column values) using many connections
+        at once.  The rows are split into batches of "batch_size", which are fed
+        to "connections" threads through a bounded queue.  Each thread uses its
+        own connection (created by "connect", which is only optional for a Sqlite
+        database file) to insert each batch using multi-row INSERTs, small enough
+        for Sqlite's limit of query parameters.
+
+        Each batch is committed after it is inserted, unless single_transaction
+        is True.  Then, every connection is committed once all batches have been
+        inserted, or rolled back if any batch failed or a connection waited more
+        than "timeout" seconds for the others to finish.  Each connection still
+        commits its own transaction, so this is not atomic: if a commit fails
+        after another connection has committed, the rows of that other
+        connection are kept.  Sqlite only allows one connection to write at a
+        time, use a single connection for a single transaction.
+
+        >>> result = Person.parallel_load({'name': i} for i in names)
+        >>> result.inserted, result.errors
+        (10000, [])
+        """
+        connect = connect or self.db._connect_callable()
+        result = LoadResult()
+        batches = queue.Queue(maxsize=connections * 2)
+        lock = threading.Lock()
+        finished = threading.Barrier(connections)
+        # Set when the rows can't be gotten, the remaining batches are dropped
+        aborted = threading.Event()
+        start = time.perf_counter()
+
+        def failed(number, error):
+            with lock:
+                result.errors.append((number, error))
+
+        def insert(conn, batch):
+            curs = conn.cursor()
+            size = max(1, 900 // len(batch[0]))
+            for i in range(0, len(batch), size):
+                self.db.execute(curs, *self.db.bulk_insert(self.name, batch[i:i + size]).build(),
+                                table=self.name)
+            if self.db.notify:
+                self.db.notify_invalidation(self.name, curs=curs)
+
+        def load():
+            try:
+                conn = connect()
+            except Exception as e:
+                conn, connect_error = None, e
+            try:
+                while True:
+                    item = batches.get()
+                    if item is None:
+                        break
+                    number, batch = item
+                    if conn is None:
+                        failed(number, connect_error)
+                        continue
+                    if aborted.is_set() or (single_transaction and result.errors):
+                        # This transaction will be rolled back, don't bother inserting
+                        continue
+                    try:
+                        insert(conn, batch)
+                        if not single_transaction:
+                            conn.commit()
+                    except Exception as e:
+                        failed(number, e)
+                        try:
+                            conn.rollback()
+                        except Exception as e:
+                            # The connection is broken, fail its remaining batches
+                            conn.close()
+                            conn, connect_error = None, e
+                    else:
+                        with lock:
+                            result.inserted += len(batch)
+                            result.batches += 1
+                if single_transaction:
+                    # Only commit once every connection has inserted its batches
+                    try:
+                        finished.wait(timeout)
+                    except threading.BrokenBarrierError as e:
+                        failed(None, e)
+                    if conn is not None and (result.errors or aborted.is_set()):
+                        conn.rollback()
+                    elif conn is not None:
+                        conn.commit()
+            except Exception as e:
+                failed(None, e)
+                # Don't let the other connections wait for this one
+                finished.abort()
+            finally:
+                if conn is not None:
+                    conn.close()
+
+        def put(item):
+            while True:
+                try:
+                    batches.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    if not any(thread.is_alive() for thread in threads):
+                        return
+
+        with self.db.span('dictorm.bulk_load', **{'db.sql.table': self.name,
+                                                  'dictorm.connections': connections}) as span:
+            threads = [threading.Thread(target=load, daemon=True) for _ in range(connections)]
+            for thread in threads:
+                thread.start()
+            try:
+                batch = []
+                number = 0
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) == batch_size:
+                        put((number, batch))
+                        batch, number = [], number + 1
+                if batch:
+                    put((number, batch))
+            except BaseException:
+                aborted.set()
+                # Make room for the threads to be stopped
+                while not batches.empty():
+                    try:
+                        batches.get_nowait()
+                    except queue.Empty:
+                        break
+                raise
+            finally:
+                for _ in threads:
+                    put(None)
+                for thread in threads:
+                    thread.join()
+
+            if single_transaction and result.errors:
+                result.inserted = result.batches = 0
+            span.set_attribute('dictorm.rowcount', result.inserted)
+            span.set_attribute('dictorm.errors', len(result.errors))
+        if result.inserted and self.db.result_cache is not None:
+            # Other processes were notified by each batch
+            self.db.result_cache.invalidate(self.name)
+        result.seconds = time.perf_counter() - start
+        if self.db._metrics is not None:
+            self.db._metrics.bulk_loaded(self.name, result.inserted, result.seconds)
+        return result
+
+    def _parallel_map(self, func: Callable, queries: List[tuple], workers: int, connect: Callable,
+                      count_only: bool) -> Iterator:
+        with ProcessPoolExecutor(workers, initializer=_parallel_init, initargs=(connect,)) as executor:
+            futures = [executor.submit(_parallel_partition, self.name, sql, values, func, count_only)
+                       for sql, values in queries]
+            for future in as_completed(futures):
+                if count_only:
+                    yield future.result()
+                else:
+                    yield from future.result()
+
     @property
     def columns(self) -> List[str]:
         """
@@ -629,11 +1467,11 @@ class Table(object):
 
         if self.db.kind == DBKind.sqlite3:
             sql = "PRAGMA TABLE_INFO(" + str(self.name) + ")"
-            self.curs.execute(sql)
+            self.db.execute(self.curs, sql, table=self.name, operation='introspect')
             self.cached_columns_info = [dict(i) for i in self.curs.fetchall()]
         else:
             sql = "SELECT * FROM information_schema.columns WHERE table_name=%s"
-            self.curs.execute(sql, [self.name, ])
+            self.db.execute(self.curs, sql, [self.name, ], self.name, 'introspect')
             self.cached_columns_info = [dict(i) for i in self.curs.fetchall()]
         return self.cached_columns_info
 
@@ -711,6 +1549,84 @@ class Table(object):
         raise ValueError('Cannot check if item is in this Table because it is not a Dict.')
 
 
+class SqlitePool:
+    """
+    A thread-safe pool of Sqlite3 connections.  It has the same interface as
+    psycopg2's ThreadedConnectionPool, so it can be provided to a DictDB.
+    Connections are created when they are needed, up to "maxconn" connections.
+
+    Connections may be used by more than one thread (one at a time), so
+    check_same_thread is disabled.  Use a shared-cache URI to pool an in-memory
+    database:
+
+    >>> pool = SqlitePool('file:example?mode=memory&cache=shared', uri=True)
+    >>> db = DictDB(pool)
+    """
+
+    def __init__(self, database: str, maxconn: int = 10, **kwargs):
+        self.database = database
+        self.maxconn = maxconn
+        kwargs.setdefault('check_same_thread', False)
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._free = []
+        self._used = set()
+
+    def getconn(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._free:
+                conn = self._free.pop()
+            elif len(self._used) < self.maxconn:
+                conn = sqlite3.connect(self.database, **self._kwargs)
+            else:
+                raise PoolError('connection pool exhausted')
+            self._used.add(conn)
+            return conn
+
+    def putconn(self, conn: sqlite3.Connection, close: bool = False):
+        # Don't let a connection's transaction leak into the next thread
+        conn.rollback()
+        with self._lock:
+            self._used.discard(conn)
+            if close:
+                conn.close()
+            else:
+                self._free.append(conn)
+
+    def closeall(self):
+        with self._lock:
+            for conn in self._free + list(self._used):
+                conn.close()
+            self._free, self._used = [], set()
+
+
+class _Checkout:
+    """
+    A connection checked out of a DictDB's pool by a thread, along with its free
+    cursors and the ResultsGenerators that are reading from its cursors.
+    """
+    __slots__ = ('conn', 'cursors', 'results', 'released')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursors = []
+        self.results = weakref.WeakSet()
+        self.released = False
+
+
+def _return_checkout(pool, checkout: _Checkout):
+    """
+    Return a checked out connection to the pool.  Called by DictDB.release, or
+    when the thread that checked it out exits.
+    """
+    checkout.released = True
+    for results in list(checkout.results):
+        results.close()
+    for curs in checkout.cursors:
+        curs.close()
+    pool.putconn(checkout.conn)
+
+
 class DictDB(dict):
     """
     Get all the tables from the provided Psycopg2/Sqlite3 connection.  Create a
@@ -726,49 +1642,436 @@ class DictDB(dict):
 
     If your tables have changed while your DictDB instance existed, you can call
     DictDB.refresh_tables() to have it rebuild all Table objects.
+
+    A lazy DictDB only lists the table names when it is created, each Table is
+    built the first time it is gotten:
+
+    >>> db = DictDB(your_db_connection, lazy=True)
+    >>> list(db.keys())
+    ['table1', 'other_table']
+    >>> db['table1']
+    Table('table1')
+
+    The tables, columns and primary keys can be kept in a schema cache file.
+    They will only be introspected again when the schema of the database has
+    changed:
+
+    >>> db = DictDB(your_db_connection, schema_cache='/tmp/dictorm-schema.json')
+
+    A DictDB can be shared by many threads if it is provided with a connection
+    pool (psycopg2's ThreadedConnectionPool, or a SqlitePool).  Each thread
+    checks out its own connection and cursor when it first queries the database,
+    and keeps it until the end of a transaction() or until release() is called:
+
+    >>> db = DictDB(ThreadedConnectionPool(1, 10, **db_login))
+    >>> with db.transaction(commit=True):
+    >>>     db['person'](name='Bob').flush()
+
+    If single_flight is True, a query which is already being executed by another
+    thread is not executed again, the other thread's rows are used instead.
+    Only queries with a LIMIT, and those of get_one, are shared; other queries
+    can opt in using ResultsGenerator.single_flight.  A thread which waits for
+    another gets the rows of the other thread's transaction snapshot, which
+    may not match its own (and won't include its own uncommitted changes).
+
+    The rows of queries can be kept by a ResultCache.  The rows of a query are
+    evicted when a Dict of a table it reads is flushed or deleted, when the
+    table's invalidate method is called, and when a transaction() is rolled
+    back:
+
+    >>> db = DictDB(your_db_connection, result_cache=ResultCache(maxsize=1000, ttl=60))
+
+    Other processes can be notified when a Dict is flushed or deleted, if notify
+    is True.  Listen for their notifications to evict the cached rows of the
+    tables they changed:
+
+    >>> db = DictDB(your_db_connection, result_cache=ResultCache(), notify=True)
+    >>> listener = db.listen(partial(psycopg2.connect, **db_login))
+
+    If metrics is True, queries, rows, references and bulk loads are counted,
+    see the metrics method.
+
+    Flushes, deletes, queries, references and bulk loads are traced if a tracer
+    (such as an OpenTelemetry tracer) is provided, see dictorm.tracing:
+
+    >>> db = DictDB(your_db_connection, tracer=trace.get_tracer('dictorm'))
+
+    The memory used by cached rows can be limited to about "memory_limit"
+    bytes, see enforce_memory_limit:
+
+    >>> db = DictDB(your_db_connection, memory_limit=512 * 1024 * 1024)
     """
 
-    def __init__(self, db_conn: db_conn_type):
+    # The most cursors that will be kept for reuse by ResultsGenerators
+    max_free_cursors = 8
+
+    # The memory limit is enforced each time this many Dicts have been created
+    memory_check_interval = 1000
+
+    def __init__(self, db_conn: db_conn_type, lazy: bool = False, schema_cache: str = None,
+                 single_flight: bool = False, result_cache: ResultCache = None, notify: bool = False,
+                 metrics: bool = False, tracer=None, memory_limit: int = None):
         self._real_getitem = super().__getitem__
-        self.conn = db_conn
+        # Held while Tables are built, so a Table is only built by one thread
+        self._build_lock = threading.RLock()
+        self.pool = None
+        self._local = threading.local()
+        if hasattr(db_conn, 'getconn') and hasattr(db_conn, 'putconn'):
+            # This thread's connection will be used to introspect the tables
+            self.pool = db_conn
+            db_conn = self.conn
+        self._conn = db_conn
+        self.lazy = lazy
+        self.schema_cache = schema_cache
+        self._cached_schema = None
+        self.single_flight = SingleFlight() if single_flight else None
+        self.result_cache = result_cache
+        self.notify = notify
+        self.before_execute = []
+        self.after_execute = []
+        self._metrics = Metrics() if metrics else None
+        if self._metrics is not None:
+            self.after_execute.append(self._metrics)
+        self.tracer = tracer
+        self._profile: Optional[ProfileReport] = None
+        self.memory_limit = memory_limit
+        self._materialized = 0
         if 'sqlite3' in modules and isinstance(db_conn, sqlite3.Connection):
             self.kind = DBKind.sqlite3
             self.insert = SqliteInsert
+            self.bulk_insert = SqliteBulkInsert
             self.update = SqliteUpdate
             self.column = SqliteColumn
         else:
             self.kind = DBKind.postgres
             self.insert = Insert
+            self.bulk_insert = BulkInsert
             self.update = Update
             self.column = Column
         self.select = Select
         self.delete = Delete
 
-        self.curs = self.get_cursor()
+        self._curs = None if self.pool else self.get_cursor()
+        self._cursors = []
         self.refresh_tables()
         self.conn.rollback()
+        self.release()
         super(DictDB, self).__init__()
 
     def __repr__(self):  # pragma: no cover
-        return f'DictDB({self.kind}, {self.conn})'
+        return f'DictDB({self.kind}, {self.pool or self._conn})'
+
+    @property
+    def conn(self) -> db_conn_type:
+        """
+        The database connection, or this thread's connection if this DictDB was
+        provided with a pool.
+        """
+        if self.pool is None:
+            return self._conn
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self._local.conn = conn = self.pool.getconn()
+            self._local.curs = None
+            checkout = self._local.checkout = _Checkout(conn)
+            self._local.cursors = checkout.cursors
+            # The connection is returned when the thread exits, if it isn't
+            # released before then
+            owner = self._local.owner = _ThreadOwner()
+            self._local.release = weakref.finalize(owner, _return_checkout, self.pool, checkout)
+            self._local.release.atexit = False
+        return conn
+
+    @property
+    def curs(self) -> CursorHint:
+        """
+        The cursor used by Tables and Dicts, or this thread's cursor if this
+        DictDB was provided with a pool.
+        """
+        if self.pool is None:
+            return self._curs
+        # Check out this thread's connection before its cursor is checked
+        self.conn
+        curs = self._local.curs
+        if curs is None:
+            self._local.curs = curs = self.get_cursor()
+        return curs
+
+    def release(self):
+        """
+        Return this thread's connection to the pool.  Does nothing if this DictDB
+        wasn't provided with a pool.  This thread's cursors are closed, and a
+        ResultsGenerator which hasn't gotten all of its results raises
+        ConnectionReleased if it is iterated again.  A thread's connection is
+        released when the thread exits.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if self.pool is not None and conn is not None:
+            if self._local.curs is not None:
+                self._local.curs.close()
+            self._local.release()
+            self._local.conn = self._local.curs = self._local.cursors = None
+            self._local.checkout = self._local.owner = self._local.release = None
+
+    def execute(self, curs: CursorHint, sql: str, values: list = None, table: str = None,
+                operation: str = None, copy_file=None) -> CursorHint:
+        """
+        Execute a query using the provided cursor.  Every query of this DictDB
+        is executed here.  If "copy_file" is provided, "sql" is a Postgres
+        "COPY ... TO STDOUT" which is written to that file.
+
+        Each before_execute hook is called with a QueryEvent before the query is
+        executed, each after_execute hook is called with the same event once the
+        query has been executed (or has failed).  "operation" is taken from the
+        query's first word if it isn't provided, see dictorm.instrument.
+
+        If this DictDB has a tracer, the query is executed within a span, see
+        dictorm.tracing.
+        """
+        if self.tracer is None:
+            return self._execute(curs, sql, values, table, operation, copy_file)
+        operation = operation or operation_of(sql)
+        with self.span('dictorm.execute', **{
+            'db.system': self._db_system,
+            'db.sql.table': table or '',
+            'db.operation': operation,
+            'db.statement': query_shape(sql),
+        }) as span:
+            self._execute(curs, sql, values, table, operation, copy_file)
+            span.set_attribute('dictorm.rowcount', curs.rowcount)
+        return curs
+
+    def _execute(self, curs: CursorHint, sql: str, values: list = None, table: str = None,
+                 operation: str = None, copy_file=None) -> CursorHint:
+        if not self.before_execute and not self.after_execute and copy_file is None:
+            if values is None:
+                curs.execute(sql)
+            else:
+                curs.execute(sql, values)
+            return curs
+
+        event = QueryEvent(sql, values, table, operation or operation_of(sql))
+        for hook in self.before_execute:
+            hook(event)
+        start = time.perf_counter()
+        try:
+            if copy_file is not None:
+                curs.copy_expert(sql, copy_file)
+            elif values is None:
+                curs.execute(sql)
+            else:
+                curs.execute(sql, values)
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.elapsed = time.perf_counter() - start
+            event.rowcount = curs.rowcount
+            for hook in self.after_execute:
+                hook(event)
+        return curs
+
+    def build_query(self, query: QueryHint) -> tuple:
+        """
+        Build a query, timing it if this DictDB is being profiled.
+        """
+        if self._profile is None:
+            return query.build()
+        start = time.perf_counter()
+        built = query.build()
+        self._profile.add('query_building', time.perf_counter() - start)
+        return built
+
+    def span(self, name: str, **attributes):
+        """
+        Start a span of this DictDB's tracer, to be used in a with statement.
+        Returns NO_SPAN if this DictDB has no tracer.
+        """
+        if self.tracer is None:
+            return NO_SPAN
+        return self.tracer.start_as_current_span(name, attributes=attributes)
+
+    @property
+    def _db_system(self) -> str:
+        # The database's name in the OpenTelemetry conventions
+        return 'postgresql' if self.kind == DBKind.postgres else 'sqlite'
+
+    def fetch_rows(self, sql: str, values: list, tables: Optional[FrozenSet[str]] = frozenset(),
+                   table: str = None, single_flight: bool = True) -> Union[list, _StreamedRows]:
+        """
+        Execute a query and get all of its rows.  An identical query being
+        executed by another thread is waited for if single_flight is enabled
+        for this DictDB and for this query.
+
+        The rows of a SELECT are kept by the result_cache, tagged with the
+        tables it reads.  Any other query invalidates those tables.
+
+        If "tables" is None the tables of the query aren't known, so its rows
+        aren't kept, and the whole result_cache is cleared if it isn't a SELECT.
+
+        A query which gets more than the result_cache's max_rows is neither
+        kept nor shared.  Its first rows are returned in a _StreamedRows, with
+        the borrowed cursor the rest of them can be fetched from.
+        """
+        cache = self.result_cache
+        max_rows = cache.max_rows if cache is not None else None
+
+        def fetch():
+            curs = self.borrow_cursor()
+            try:
+                self.execute(curs, sql, values, table)
+                if not curs.description:
+                    rows = []
+                elif max_rows is None:
+                    rows = curs.fetchall()
+                else:
+                    rows = curs.fetchmany(max_rows + 1)
+                    if len(rows) > max_rows:
+                        rows, curs = _StreamedRows(rows, curs), None
+            finally:
+                if curs is not None:
+                    self.return_cursor(curs)
+            if self._metrics is not None:
+                self._metrics.rows_fetched(table, len(rows.rows if isinstance(rows, _StreamedRows) else rows))
+            return rows
+
+        key = query_key(sql, values)
+        if cache is not None and not sql.lstrip().upper().startswith('SELECT'):
+            try:
+                return fetch()
+            finally:
+                if tables is None:
+                    cache.clear()
+                for table in tables or ():
+                    self[table].invalidate()
+
+        if tables is None:
+            cache = None
+        if cache is not None:
+            rows = cache.get(key)
+            if rows is not None:
+                return rows
+            generation = cache.generation(tables)
+
+        if self.single_flight is None or not single_flight:
+            rows = fetch()
+        else:
+            rows = self.single_flight.do(key, fetch)
+            if rows is None:
+                # The other caller's rows were streamed, they can't be shared
+                rows = fetch()
+
+        if cache is not None and isinstance(rows, list):
+            cache.put(key, rows, tables, generation)
+        return rows
+
+    def notify_invalidation(self, table_name: str, pk: str = None, curs: CursorHint = None):
+        """
+        Notify the listeners of other processes that a table (or a row of it)
+        has been changed.  Sent on the INVALIDATION_CHANNEL using the provided
+        cursor, or this thread's cursor.  Sqlite listeners don't need to be
+        notified.
+        """
+        if self.kind == DBKind.postgres:
+            payload = table_name if pk is None else f'{table_name}:{pk}'
+            self.execute(curs or self.curs, 'SELECT pg_notify(%s, %s)', [INVALIDATION_CHANNEL, payload],
+                         table_name, 'other')
+
+    def listen(self, connect: Callable = None, interval: float = 1.0):
+        """
+        Start a thread which evicts the cached rows of tables changed by other
+        processes.  The thread uses its own connection, created by "connect"
+        (which is only optional for a Sqlite database file).  Postgres listeners
+        LISTEN for the notifications of DictDBs created with notify=True.
+        Sqlite listeners check for changes every "interval" seconds, and evict
+        all cached rows because Sqlite can't tell which tables were changed.
+
+        Call the listener's stop method to stop listening.
+        """
+        connect = connect or self._connect_callable()
+        listener_cls = NotifyListener if self.kind == DBKind.postgres else DataVersionListener
+        listener = listener_cls(connect, self._invalidated, interval)
+        listener.start()
+        listener.ready.wait()
+        if listener.error is not None:
+            raise listener.error
+        return listener
+
+    def _invalidated(self, table_name: Optional[str]):
+        if self.result_cache is None:
+            return
+        if table_name is None:
+            self.result_cache.clear()
+        else:
+            self.result_cache.invalidate(table_name)
+
+    def borrow_cursor(self) -> CursorHint:
+        """
+        Get a cursor that was returned by a ResultsGenerator, or a new cursor if
+        none are free.  Return it using return_cursor.
+        """
+        if self.pool is None:
+            cursors = self._cursors
+        else:
+            # Check out this thread's connection before its cursors are checked
+            self.conn
+            cursors = self._local.cursors
+        if cursors:
+            return cursors.pop()
+        return self.get_cursor()
+
+    def return_cursor(self, curs: CursorHint):
+        """
+        Keep a borrowed cursor so it can be reused, or close it if enough cursors
+        are kept already.  A cursor of a connection that has been returned to the
+        pool is closed.
+        """
+        if self.pool is None:
+            cursors = self._cursors
+        elif getattr(self._local, 'conn', None) is curs.connection:
+            cursors = self._local.cursors
+        else:
+            cursors = None
+
+        if cursors is not None and len(cursors) < self.max_free_cursors:
+            cursors.append(curs)
+        else:
+            curs.close()
 
     def __getitem__(self, item: str) -> Table:
-        return self._real_getitem(item)
+        table = self._real_getitem(item)
+        if table is None:
+            # Lazy DictDB, this Table hasn't been built yet
+            with self._build_lock:
+                # Another thread may have built it while this one waited
+                table = self._real_getitem(item)
+                if table is None:
+                    table = self._build_tables([item])[item]
+        return table
+
+    def get(self, item: str, default=None) -> Optional[Table]:
+        return self[item] if item in self else default
+
+    def values(self):
+        self.__build_all()
+        return super().values()
+
+    def items(self):
+        self.__build_all()
+        return super().items()
+
+    def __build_all(self):
+        # Build the Tables of a lazy DictDB which haven't been built yet
+        if self.lazy:
+            with self._build_lock:
+                names = [name for name, table in super().items() if table is None]
+                if names:
+                    self._build_tables(names)
 
     @classmethod
     def table_factory(cls) -> Table:
         return Table
 
-    def __list_tables(self):
-        if self.kind == DBKind.sqlite3:
-            self.curs.execute('SELECT name FROM sqlite_master WHERE type ='
-                              '"table"')
-        else:
-            self.curs.execute('''SELECT DISTINCT table_name
-                    FROM information_schema.columns
-                    WHERE table_schema='public' ''')
-        return self.curs.fetchall()
-
     def get_cursor(self) -> CursorHint:
         """
         Returns a cursor from the provided database connection that DictORM
@@ -782,36 +2085,528 @@ class DictDB(dict):
             curs = self.conn.cursor(cursor_factory=DictCursor)
             return curs
 
-    def refresh_tables(self):
+    def _introspect(self, names: List[str] = None) -> dict:
+        """
+        Get the column info and primary keys of every table (or only those
+        tables in "names").  They will be gotten from the schema cache, if it was
+        loaded.
+
+        Returns a dictionary of {table_name: (columns_info, pks)}.
+        """
+        schema = self._cached_schema
+        if schema is None:
+            return self._query_schema(names)
+        if names is None:
+            return schema
+        return {i: schema[i] for i in names if i in schema}
+
+    def _query_schema(self, names: List[str] = None) -> dict:
+        """
+        Query the column info and primary keys of every table (or only those
+        tables in "names").  See schema_queries.
+        """
+        if names is None and self.kind == DBKind.sqlite3 and not PRAGMA_TABLE_INFO:
+            self.execute(self.curs, SQLITE_TABLES, operation='introspect')
+            names = [i[0] for i in self.curs.fetchall()]
+        results = []
+        for sql, values in schema_queries(self.kind, names):
+            self.execute(self.curs, sql, values, operation='introspect')
+            results.append(self.curs.fetchall())
+        return schema_from_rows(self.kind, results, names)
+
+    def _schema_identity(self) -> Optional[str]:
+        """
+        Get a string that identifies this database in the schema cache.  An
+        in-memory Sqlite database has no identity, and can't be cached.
+        """
+        if self.kind == DBKind.sqlite3:
+            self.execute(self.curs, 'PRAGMA database_list', operation='introspect')
+            path = {i['name']: i['file'] for i in self.curs.fetchall()}.get('main')
+            return f'sqlite:{path}' if path else None
+        self.execute(self.curs, 'SELECT current_database(), inet_server_addr(), inet_server_port()',
+                     operation='introspect')
+        return 'postgres:{0}:{1}:{2}'.format(*self.curs.fetchone())
+
+    def _schema_fingerprint(self) -> str:
+        """
+        Get a value that changes when the schema of the database changes.  Sqlite
+        increments its schema_version, Postgres changes the xmin of catalog rows
+        that are modified.
+        """
+        if self.kind == DBKind.sqlite3:
+            self.execute(self.curs, 'PRAGMA schema_version', operation='introspect')
+            return str(self.curs.fetchone()[0])
+        self.execute(self.curs, '''SELECT md5(string_agg(
+                    c.oid::text || ':' || c.xmin::text || ':' || a.attnum::text || ':' || a.xmin::text,
+                    ',' ORDER BY c.oid, a.attnum))
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                JOIN pg_attribute a ON a.attrelid = c.oid
+                WHERE n.nspname = 'public' ''', operation='introspect')
+        return str(self.curs.fetchone()[0])
+
+    def _connect_callable(self) -> Callable:
+        """
+        Get a picklable callable that creates a new connection to this database.
+        This is only possible for a Sqlite database file.
+        """
+        identity = self._schema_identity()
+        if self.kind != DBKind.sqlite3 or identity is None:
+            raise ValueError('A connect callable is required to create new connections to the database')
+        return partial(sqlite3.connect, identity[len('sqlite:'):])
+
+    def _load_schema_cache(self) -> Optional[dict]:
         """
-        Create all Table instances from all tables found in the database.
+        Get the schema of this database from the schema cache file.  If the
+        cached schema is missing or out of date, introspect the schema and
+        rewrite the cache.
         """
+        identity = self._schema_identity()
+        if identity is None:
+            return None
+        fingerprint = self._schema_fingerprint()
+
+        try:
+            with open(self.schema_cache) as fh:
+                cache = json.load(fh)
+        except (OSError, ValueError):
+            cache = {}
+
+        entry = cache.get(identity)
+        if entry and entry['fingerprint'] == fingerprint:
+            return {k: (v['columns_info'], v['pks']) for k, v in entry['tables'].items()}
+
+        schema = self._query_schema()
+        cache[identity] = {
+            'fingerprint': fingerprint,
+            'tables': {k: {'columns_info': c, 'pks': p} for k, (c, p) in schema.items()},
+        }
+        # Replace the cache file at once, other processes may be reading it
+        tmp_path = f'{self.schema_cache}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(cache, fh, default=str)
+        os.replace(tmp_path, self.schema_cache)
+        return schema
+
+    def __list_tables(self) -> List[str]:
+        if self._cached_schema is not None:
+            return list(self._cached_schema)
+        if self.kind == DBKind.sqlite3:
+            self.execute(self.curs, SQLITE_TABLES, operation='introspect')
+        else:
+            self.execute(self.curs, '''SELECT DISTINCT table_name
+                    FROM information_schema.columns
+                    WHERE table_schema='public' ''', operation='introspect')
+        return [i[0] for i in self.curs.fetchall()]
+
+    def _build_tables(self, names: List[str] = None) -> dict:
+        """
+        Create and keep the Table instances of the provided table names, or all
+        tables if no names are provided.
+        """
+        table_cls = self.table_factory()
+        tables = {}
+        with self._build_lock:
+            for name, (columns_info, pks) in self._introspect(names).items():
+                tables[name] = self[name] = table_cls(name, self, columns_info=columns_info, pks=pks)
+        return tables
+
+    def _refresh_changed_tables(self):
+        """
+        Add Tables that have been created, remove Tables that have been dropped,
+        and update the schema of existing Tables.  Existing Tables are kept, so
+        their references, primary keys and ordering are kept.
+        """
+        if self.lazy:
+            names = self.__list_tables()
+            # Only Tables that have been built need to be introspected
+            schema = self._introspect([i for i in names if i in self and self._real_getitem(i) is not None])
+        else:
+            schema = self._introspect()
+            names = list(schema)
+
+        for name in set(self).difference(names):
+            super(DictDB, self).__delitem__(name)
+
+        table_cls = self.table_factory()
+        for name in names:
+            table = self._real_getitem(name) if name in self else None
+            if table is not None and name in schema:
+                table._update_schema(*schema[name])
+            elif name in schema:
+                self[name] = table_cls(name, self, columns_info=schema[name][0], pks=schema[name][1])
+            elif name not in self:
+                super(DictDB, self).__setitem__(name, None)
+
+    def refresh_tables(self, changed_only: bool = False):
+        """
+        Create all Table instances from all tables found in the database.  The
+        columns and primary keys of all tables are gotten at once, and handed to
+        each Table.
+
+        If changed_only is True, only add or remove the tables that have been
+        created or dropped.  Existing Tables (and their references) are kept, and
+        their columns are updated if they have changed.
+
+        A lazy DictDB only gets the names of the tables, each Table will be
+        created when it is first gotten.
+
+        If a schema cache file was provided, the schema will be loaded from it
+        unless the schema of the database has changed.
+        """
+        self._cached_schema = self._load_schema_cache() if self.schema_cache else None
+        if changed_only:
+            return self._refresh_changed_tables()
+
         if self.keys():
             # Reset this DictDB because it contains old tables
             super(DictDB, self).__init__()
-        table_cls = self.table_factory()
-        name_key = 'name' if self.kind == DBKind.sqlite3 else 'table_name'
-        for table in self.__list_tables():
-            name = table[name_key]
-            self[name] = table_cls(name, self)
+        if self.lazy:
+            super(DictDB, self).update(dict.fromkeys(self.__list_tables()))
+        else:
+            self._build_tables()
+
+    def _built_tables(self) -> List[Table]:
+        # The Tables of a lazy DictDB that haven't been built have no rows
+        return [i for i in dict.values(self) if i is not None]
+
+    def memory_usage(self) -> dict:
+        """
+        Estimate the bytes used by the cached Dicts of each Table's
+        ResultsGenerators, and by the rows kept by the ResultCache.
+
+        >>> db.memory_usage()
+        {'tables': {'person': 81920, 'car': 2048}, 'result_cache': 0, 'total': 83968}
+        """
+        tables = {i.name: i.memory_usage() for i in self._built_tables()}
+        result_cache = self.result_cache.memory_usage() if self.result_cache is not None else 0
+        return {'tables': tables, 'result_cache': result_cache,
+                'total': sum(tables.values()) + result_cache}
+
+    def materialized(self, results: ResultsGenerator, d: Dict):
+        """
+        Count a Dict created by a ResultsGenerator, and add its size to the
+        generator's running estimate.  A generator's first Dict is measured,
+        and every memory_check_interval Dicts the Dict is measured again and
+        the memory limit is enforced.
+        """
+        self._materialized += 1
+        check = self._materialized >= self.memory_check_interval
+        if check or results._dict_size is None:
+            # The column names are shared by every Dict, they aren't counted
+            results._dict_size = deep_size(d, {id(i) for i in d})
+        if results._nocache is False:
+            results._bytes += results._dict_size
+        if check:
+            self._materialized = 0
+            self.enforce_memory_limit()
+
+    def _estimated_usage(self) -> int:
+        # The running estimates of the generators and the ResultCache, the
+        # cached rows aren't measured again.
+        usage = sum(i._bytes for table in self._built_tables() for i in list(table._generators))
+        if self.result_cache is not None:
+            usage += self.result_cache.memory_usage()
+        return usage
+
+    def enforce_memory_limit(self) -> bool:
+        """
+        Evict cached rows if they use more than memory_limit bytes, according
+        to the running estimates kept as Dicts are created and rows are cached
+        (referenced rows gotten later aren't counted, see memory_usage).  The
+        ResultCache is cleared first, if that isn't enough every Table's
+        ResultsGenerators are evicted (see ResultsGenerator.evict).  Returns
+        True if anything was evicted.
+        """
+        if self.memory_limit is None or self._estimated_usage() <= self.memory_limit:
+            return False
+        if self.result_cache is not None:
+            self.result_cache.clear()
+            if self._estimated_usage() <= self.memory_limit:
+                return True
+        for table in self._built_tables():
+            table.evict()
+        return True
+
+    def metrics(self) -> dict:
+        """
+        Get a snapshot of the metrics of this DictDB, which must have been
+        created with metrics=True.  See dictorm.instrument.Metrics.snapshot, and
+        dictorm.instrument.render_prometheus to render it.  "cache" has the
+        counters of the result_cache, if there is one.
+        """
+        if self._metrics is None:
+            raise ValueError('Metrics are not collected, create the DictDB with metrics=True')
+        snapshot = self._metrics.snapshot()
+        cache = self.result_cache
+        if cache is not None:
+            snapshot['cache'] = {'hits': cache.hits, 'misses': cache.misses,
+                                 'evictions': cache.evictions, 'entries': len(cache)}
+        return snapshot
+
+    def write_metrics(self, path: str):
+        """
+        Write the metrics of this DictDB to a file in the Prometheus text format.
+        The file is replaced at once, it can be read by a scraper at any time.
+        """
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as fh:
+            fh.write(render_prometheus(self.metrics()))
+        os.replace(tmp_path, path)
+
+    def log_slow_queries(self, path: str = None, threshold: float = 0.5, **kw) -> SlowQueryLog:
+        """
+        Write queries slower than "threshold" seconds to the rotating log file
+        "path", with the plans of the slowest kinds of queries.  Keyword
+        arguments are passed to dictorm.instrument.SlowQueryLog, use "logger"
+        to write to your own logger instead.  Call the returned log's close
+        method to stop logging.
+
+        >>> slow_log = db.log_slow_queries('/var/log/dictorm-slow.log', threshold=0.2,
+        >>>                                sample_rate=0.01)
+        >>> slow_log = db.log_slow_queries(logger=logging.getLogger('slow_queries'))
+        """
+        slow_log = SlowQueryLog(self, path, threshold, **kw)
+        self.after_execute.append(slow_log)
+        return slow_log
+
+    @contextmanager
+    def profile(self, cprofile: bool = False):
+        """
+        Context manager which profiles this DictDB.  The report splits the time
+        spent into the database, getting rows from the driver, creating Dicts
+        and building queries, and totals the time of each query shape.  If
+        "cprofile" is True, this thread is also profiled by cProfile.  See
+        dictorm.instrument.ProfileReport.
+
+        >>> with db.profile(cprofile=True) as report:
+        >>>     run_job()
+        >>> print(report.summary())
+        >>> report.dictorm_functions()
+        """
+        report = ProfileReport(cprofile)
+        outer, self._profile = self._profile, report
+        self.after_execute.append(report)
+        start = time.perf_counter()
+        if report.profile is not None:
+            report.profile.enable()
+        try:
+            yield report
+        finally:
+            if report.profile is not None:
+                report.profile.disable()
+            report.elapsed = time.perf_counter() - start
+            self.after_execute.remove(report)
+            self._profile = outer
+
+    @contextmanager
+    def detect_n_plus_one(self, threshold: int = 10, action: str = 'warn'):
+        """
+        Context manager which detects references that are gotten one row at a
+        time by this thread.  If a line of code gets the same reference more
+        than "threshold" times, it is warned (or raised if "action" is "raise")
+        as an N+1 query.  See dictorm.instrument.NPlusOneDetector.
+
+        >>> with db.detect_n_plus_one(threshold=5, action='raise') as detector:
+        >>>     run_tests()
+        >>> detector.by_reference()
+        Counter({('person', 'car'): 3})
+        """
+        outer = getattr(self._local, 'detector', None)
+        self._local.detector = detector = NPlusOneDetector(threshold, action)
+        try:
+            yield detector
+        finally:
+            self._local.detector = outer
+
+    def reference_resolved(self, table: Table, ref_name: str):
+        """
+        Called before a query gets the reference "ref_name" of a Dict of "table".
+        """
+        if self._metrics is not None:
+            self._metrics.reference_resolved(table.name, ref_name)
+        detector = getattr(self._local, 'detector', None)
+        if detector is not None:
+            detector.resolved(table.name, ref_name, _call_site())
+
+    def current_batch(self) -> Optional[ReferenceBatch]:
+        """
+        Get this thread's ReferenceBatch, if this thread is in a batch.
+        """
+        return getattr(self._local, 'batch', None)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager which gets one-to-one references using as few queries
+        as possible.  Each reference of the Dicts gotten in a batch is gotten
+        using one query for all of those Dicts the first time it is used.  A
+        nested batch is part of the outer batch.
+
+        >>> with db.batch():
+        >>>     cars = Car.get_where()
+        >>>     owners = [car['owner'] for car in cars]  # One query
+        """
+        if self.current_batch() is not None:
+            yield self.current_batch()
+            return
+        self._local.batch = ReferenceBatch(self)
+        try:
+            yield self._local.batch
+        finally:
+            self._local.batch = None
 
     @contextmanager
     def transaction(self, commit: bool = False):
         """
         Context manager to rollback changes in case of an error.
 
+        If this DictDB was provided with a pool, the transaction's connection is
+        returned to the pool when the transaction ends.
+
         :param commit: Commit changes on close, if True.
         :return:
         """
+        checked_out = self.pool is not None and getattr(self._local, 'conn', None) is None
         try:
             yield
         except Exception:
             self.conn.rollback()
+            if self.result_cache is not None:
+                # Rows of the rolled back changes may have been cached
+                self.result_cache.clear()
             raise
         else:
             # Commit if no exceptions occur
             if commit:
                 self.conn.commit()
+        finally:
+            if checked_out:
+                self.release()
+
+
+def _call_site() -> str:
+    """
+    Get the file and line of the code (outside of this module) that is getting
+    a reference.
+    """
+    frame = _getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:  # pragma: no cover
+        return 'unknown'
+    return f'{frame.f_code.co_filename}:{frame.f_lineno}'
+
+
+# The DictDB of a parallel_map worker process
+_parallel_db = None
+
+
+def _parallel_init(connect: Callable):
+    """
+    Connect a parallel_map worker process to the database.
+    """
+    global _parallel_db
+    _parallel_db = DictDB(connect(), lazy=True)
+
+
+def _parallel_partition(table_name: str, sql: str, values: list, func: Callable, count_only: bool):
+    """
+    Call func with each row of a parallel_map partition.
+    """
+    rows = _parallel_db[table_name].get_raw(sql, *values).nocache()
+    if count_only:
+        count = 0
+        for row in rows:
+            func(row)
+            count += 1
+        return count
+    return [func(row) for row in rows]
+
+
+# Sqlite 3.16 added the table-valued pragma functions
+PRAGMA_TABLE_INFO = sqlite3.sqlite_version_info >= (3, 16)
+
+SQLITE_TABLES = 'SELECT name FROM sqlite_master WHERE type = "table" ORDER BY rowid'
+
+
+def schema_queries(kind: DBKind, names: List[str] = None) -> List[tuple]:
+    """
+    Build the queries that get the column info and primary keys of every table
+    (or only those tables in "names") in as few queries as possible.  Sqlite gets
+    everything from a single pragma_table_info join, Postgres uses one query for
+    columns and one for primary keys.
+
+    Sqlite older than 3.16 uses one PRAGMA table_info per table, "names" must
+    be provided (see SQLITE_TABLES).
+
+    Returns a list of (sql, values), the rows of each should be passed to
+    schema_from_rows.
+    """
+    if kind == DBKind.sqlite3 and not PRAGMA_TABLE_INFO:
+        if names is None:
+            raise ValueError('The names of the tables are required by Sqlite older than 3.16')
+        return [('PRAGMA table_info("{0}")'.format(name.replace('"', '""')), []) for name in names]
+
+    if kind == DBKind.sqlite3:
+        sql = """SELECT m.name AS dictorm_table, p.*
+                FROM sqlite_master m
+                JOIN pragma_table_info(m.name) p
+                WHERE m.type = 'table'"""
+        if names is not None:
+            sql += ' AND m.name IN ({0})'.format(', '.join('?' * len(names)))
+        return [(sql + ' ORDER BY m.rowid, p.cid', list(names or []))]
+
+    columns_sql = """SELECT * FROM information_schema.columns
+            WHERE table_schema='public'"""
+    pks_sql = """SELECT c.relname, a.attname
+            FROM pg_index i
+            CROSS JOIN generate_subscripts(i.indkey, 1) AS k
+            JOIN pg_class c ON c.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_attribute a ON a.attrelid = i.indrelid
+            AND a.attnum = i.indkey[k]
+            WHERE i.indisprimary
+            AND n.nspname = 'public'"""
+    values = []
+    if names is not None:
+        columns_sql += ' AND table_name = ANY(%s)'
+        pks_sql += ' AND c.relname = ANY(%s)'
+        values = [list(names)]
+    return [
+        (columns_sql + ' ORDER BY table_name, ordinal_position', values),
+        (pks_sql + ' ORDER BY c.relname, k', values),
+    ]
+
+
+def schema_from_rows(kind: DBKind, results: List[list], names: List[str] = None) -> dict:
+    """
+    Distribute the rows returned by the schema_queries to their tables.  The
+    "names" provided to schema_queries must be provided again.
+
+    Returns a dictionary of {table_name: (columns_info, pks)}.
+    """
+    tables = {}
+    if kind == DBKind.sqlite3:
+        if PRAGMA_TABLE_INFO:
+            columns = [dict(row) for row in results[0]]
+        else:
+            columns = [dict(row, dictorm_table=name) for name, rows in zip(names, results) for row in rows]
+        for column in columns:
+            columns_info, pks = tables.setdefault(column.pop('dictorm_table'), ([], []))
+            columns_info.append(column)
+        for name, (columns_info, pks) in tables.items():
+            # "pk" is the position of the column in the primary key
+            pks.extend(i['name'] for i in sorted(columns_info, key=lambda i: i['pk']) if i['pk'])
+        return tables
+
+    columns_rows, pks_rows = results
+    for row in columns_rows:
+        tables.setdefault(row['table_name'], ([], []))[0].append(dict(row))
+    for relname, attname in pks_rows:
+        if relname in tables:
+            tables[relname][1].append(attname)
+    return tables
 
 
 def args_to_comp(operator: Operator, table: Table, *args, **kwargs):
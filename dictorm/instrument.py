@@ -0,0 +1,636 @@
+"""
+Observe every query executed by a DictDB.  All queries are executed by
+DictDB.execute, which calls the DictDB's before_execute hooks with a QueryEvent,
+executes the query, then calls the after_execute hooks with the same event.
+
+>>> stats = QueryStats()
+>>> db.after_execute.append(stats)
+>>> list(db['person'].get_where())
+>>> stats.snapshot()[('person', 'select')]['count']
+1
+
+Find references that are gotten one row at a time (N+1 queries):
+
+>>> with db.detect_n_plus_one(threshold=10, action='raise'):
+>>>     names = [person['car']['name'] for person in Person.get_where()]
+NPlusOneError: Reference "car" of Table("person") was gotten more than 10 times from app.py:12 ...
+
+Log slow queries, grouped by the shape of their SQL:
+
+>>> db.log_slow_queries('/var/log/dictorm-slow.log', threshold=0.5)
+
+Collect metrics, and render them in the Prometheus text format:
+
+>>> db = DictDB(your_db_connection, metrics=True)
+>>> print(render_prometheus(db.metrics()))
+
+Split the time of a job between the database and DictORM's own work:
+
+>>> with db.profile() as report:
+>>>     run_job()
+>>> print(report.summary())
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import warnings
+import weakref
+from bisect import bisect_left
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+from typing import Dict, Optional, Tuple
+
+__all__ = [
+    'LATENCY_BUCKETS',
+    'Metrics',
+    'NPlusOneDetector',
+    'NPlusOneError',
+    'NPlusOneWarning',
+    'OPERATIONS',
+    'PROFILE_CATEGORIES',
+    'ProfileReport',
+    'QueryEvent',
+    'QueryStats',
+    'SlowQueryLog',
+    'deep_size',
+    'estimate_size',
+    'operation_of',
+    'query_shape',
+    'render_prometheus',
+]
+
+# The parts of DictORM's time split by a ProfileReport
+PROFILE_CATEGORIES = ('database', 'row_conversion', 'dict_construction', 'query_building')
+
+# The kinds of queries DictDB executes
+OPERATIONS = ('select', 'insert', 'update', 'delete', 'introspect', 'other')
+
+# The upper bounds (in seconds) of the latency histogram buckets, the last
+# bucket counts everything slower.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, float('inf'))
+
+
+def operation_of(sql: str) -> str:
+    """
+    Get the operation of a query from its first word.
+    """
+    word = sql.lstrip()[:6].lower()
+    return word if word in OPERATIONS else 'other'
+
+
+# Literals and lists of placeholders which don't change the shape of a query
+_SHAPE_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\((?:\s*(?:\?|%s)\s*,)+\s*(?:\?|%s)\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def query_shape(sql: str) -> str:
+    """
+    Get the shape of a query: its SQL without literal values, and with every
+    list of placeholders (such as a Sqlite IN) collapsed.  Queries built by
+    dictorm.pg and dictorm.sqlite only differ in these ways when they have the
+    same shape.
+    """
+    for pattern, replacement in _SHAPE_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def deep_size(obj, seen: set = None) -> int:
+    """
+    Estimate the bytes used by an object, and by everything in it if it's a
+    dict (or a Dict), list, tuple or set.  Other objects aren't looked into, so
+    a Dict's Table isn't counted.  Objects whose id is in "seen" aren't counted
+    again, share it to count many objects which share their values.
+    """
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+
+def estimate_size(items: list, sample: int = 16) -> int:
+    """
+    Estimate the bytes used by a list and everything in it, measuring only
+    "sample" of its items (evenly spaced) with deep_size.  Values shared by
+    many items are counted for each of them.
+    """
+    if len(items) <= sample:
+        return deep_size(items)
+    step = len(items) / sample
+    sampled = sum(deep_size(items[int(i * step)]) for i in range(sample))
+    return sys.getsizeof(items) + sampled * len(items) // sample
+
+
+class QueryEvent:
+    """
+    A query executed by DictDB.execute.  "elapsed" (seconds) and "rowcount" are
+    None until the query has been executed.  "rowcount" is the driver's
+    rowcount, which is -1 for Sqlite selects.  "error" is the exception raised
+    by the query, if any.
+    """
+
+    __slots__ = ('sql', 'values', 'table', 'operation', 'elapsed', 'rowcount', 'error')
+
+    def __init__(self, sql: str, values, table: Optional[str], operation: str):
+        self.sql = sql
+        self.values = values
+        self.table = table
+        self.operation = operation
+        self.elapsed = None
+        self.rowcount = None
+        self.error = None
+
+    def __repr__(self):  # pragma: no cover
+        return f'QueryEvent({self.operation} {self.table}, elapsed={self.elapsed}, rowcount={self.rowcount})'
+
+
+class QueryStats:
+    """
+    An after_execute hook which counts queries, errors, rows and latency by
+    table and operation.  Latencies are counted in the LATENCY_BUCKETS
+    histogram.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Dict[Tuple[Optional[str], str], dict] = {}
+
+    def __call__(self, event: QueryEvent):
+        key = (event.table, event.operation)
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = {
+                    'count': 0, 'errors': 0, 'rows': 0, 'seconds': 0.0,
+                    'buckets': [0] * len(LATENCY_BUCKETS),
+                }
+            stats['count'] += 1
+            stats['seconds'] += event.elapsed
+            stats['buckets'][bisect_left(LATENCY_BUCKETS, event.elapsed)] += 1
+            if event.error is not None:
+                stats['errors'] += 1
+            elif event.rowcount and event.rowcount > 0:
+                stats['rows'] += event.rowcount
+
+    def snapshot(self) -> Dict[Tuple[Optional[str], str], dict]:
+        """
+        Get a copy of the stats of each (table, operation).
+        """
+        with self.lock:
+            return {k: dict(v, buckets=list(v['buckets'])) for k, v in self.stats.items()}
+
+    def merge(self, stats: Dict[Tuple[Optional[str], str], dict]):
+        """
+        Add a snapshot of other stats to these.
+        """
+        with self.lock:
+            for key, other in stats.items():
+                own = self.stats.get(key)
+                if own is None:
+                    self.stats[key] = dict(other, buckets=list(other['buckets']))
+                    continue
+                for name in ('count', 'errors', 'rows', 'seconds'):
+                    own[name] += other[name]
+                own['buckets'] = [a + b for a, b in zip(own['buckets'], other['buckets'])]
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+
+class NPlusOneWarning(UserWarning):
+    pass
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+class NPlusOneDetector:
+    """
+    Count the queries which get a reference, by table, reference name and the
+    line of code which used the reference.  When one line gets the same
+    reference more than "threshold" times, an NPlusOneWarning is warned (or an
+    NPlusOneError is raised if "action" is "raise").  See
+    DictDB.detect_n_plus_one.
+    """
+
+    def __init__(self, threshold: int = 10, action: str = 'warn'):
+        if action not in ('warn', 'raise'):
+            raise ValueError('action must be "warn" or "raise"')
+        self.threshold = threshold
+        self.action = action
+        # (table, reference, call site) -> count
+        self.counts = Counter()
+
+    def resolved(self, table: str, ref_name: str, call_site: str):
+        """
+        Count a query which got a reference.
+        """
+        key = (table, ref_name, call_site)
+        self.counts[key] += 1
+        if self.counts[key] != self.threshold + 1:
+            return
+        message = (f'Reference "{ref_name}" of Table("{table}") was gotten more than '
+                   f'{self.threshold} times from {call_site}, one query at a time.  Get the '
+                   f'references of many rows at once, using db.batch() or a get_where with In().')
+        if self.action == 'raise':
+            raise NPlusOneError(message)
+        warnings.warn(message, NPlusOneWarning)
+
+    def by_reference(self) -> Counter:
+        """
+        Get the count of queries of each (table, reference), from all lines.
+        """
+        counts = Counter()
+        for (table, ref_name, _), count in self.counts.items():
+            counts[(table, ref_name)] += count
+        return counts
+
+
+class SlowQueryLog:
+    """
+    An after_execute hook which writes queries slower than "threshold" seconds
+    to a rotating log file, one JSON object per line.  See
+    DictDB.log_slow_queries.  The lines are written (at the INFO level) to
+    "logger" if it is provided, using a rotating log file only if "path" is
+    also provided.
+
+    Queries are grouped by their shape (see query_shape).  The first
+    "sample_after" slow queries of each shape are written, after that only
+    "sample_rate" of them are.  The plan of each of the "explain_top" slowest
+    shapes is gotten once, using EXPLAIN (ANALYZE, BUFFERS) for a Postgres
+    SELECT (EXPLAIN for other queries), or EXPLAIN QUERY PLAN for Sqlite.
+    """
+
+    def __init__(self, db, path: str = None, threshold: float = 0.5, sample_after: int = 10,
+                 sample_rate: float = 0.1, explain_top: int = 10, max_bytes: int = 10 * 1024 * 1024,
+                 backup_count: int = 3, logger: logging.Logger = None):
+        if path is None and logger is None:
+            raise ValueError('provide a path or a logger')
+        self.db = db
+        self.threshold = threshold
+        self.sample_after = sample_after
+        self.sample_rate = sample_rate
+        self.explain_top = explain_top
+        self.lock = threading.Lock()
+        # shape -> {'count', 'seconds', 'max', 'plan'}
+        self.shapes = {}
+        if logger is None:
+            # Not kept by logging.getLogger, so it's freed along with this log
+            logger = logging.Logger('dictorm.slow_queries', logging.INFO)
+        self.logger = logger
+        self.handler = None
+        if path is not None:
+            self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+            self.handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(self.handler)
+
+    def __call__(self, event: QueryEvent):
+        if event.elapsed < self.threshold or event.error is not None:
+            return
+        shape = query_shape(event.sql)
+        with self.lock:
+            stats = self.shapes.get(shape)
+            if stats is None:
+                stats = self.shapes[shape] = {'count': 0, 'seconds': 0.0, 'max': 0.0, 'plan': None}
+            stats['count'] += 1
+            stats['seconds'] += event.elapsed
+            stats['max'] = max(stats['max'], event.elapsed)
+            explain = stats['plan'] is None and shape in self.slowest()
+            if explain:
+                # Only get the plan once
+                stats['plan'] = ''
+            write = stats['count'] <= self.sample_after or random.random() < self.sample_rate
+
+        plan = None
+        if explain:
+            plan = stats['plan'] = self.explain(event)
+        if write or plan is not None:
+            self.logger.info(json.dumps({
+                'time': time.time(),
+                'shape': shape,
+                'sql': event.sql,
+                'table': event.table,
+                'operation': event.operation,
+                'elapsed': event.elapsed,
+                'rowcount': event.rowcount,
+                'count': stats['count'],
+                'plan': plan,
+            }))
+
+    def slowest(self) -> list:
+        """
+        Get the "explain_top" slowest shapes, slowest first.
+        """
+        shapes = sorted(self.shapes.items(), key=lambda i: i[1]['max'], reverse=True)
+        return [shape for shape, _ in shapes[:self.explain_top]]
+
+    def explain(self, event: QueryEvent) -> Optional[str]:
+        """
+        Get the plan of the provided query.  A Postgres SELECT is executed again
+        by EXPLAIN ANALYZE.
+        """
+        postgres = self.db.kind.name == 'postgres'
+        if not postgres:
+            sql = 'EXPLAIN QUERY PLAN ' + event.sql
+        elif event.operation == 'select':
+            sql = 'EXPLAIN (ANALYZE, BUFFERS) ' + event.sql
+        else:
+            sql = 'EXPLAIN ' + event.sql
+        curs = savepoint = None
+        try:
+            curs = self.db.borrow_cursor()
+            # A failed EXPLAIN must not abort the caller's Postgres transaction
+            savepoint = postgres and not curs.connection.autocommit
+            # Not executed by DictDB.execute, this shouldn't be instrumented
+            if savepoint:
+                curs.execute('SAVEPOINT dictorm_explain')
+            if event.values is None:
+                curs.execute(sql)
+            else:
+                curs.execute(sql, event.values)
+            plan = '\n'.join(str(i[-1]) for i in curs.fetchall())
+        except Exception as e:
+            plan = f'Could not explain: {e}'
+        finally:
+            try:
+                if savepoint:
+                    curs.execute('ROLLBACK TO SAVEPOINT dictorm_explain')
+                    curs.execute('RELEASE SAVEPOINT dictorm_explain')
+            except Exception:
+                # Explaining is best effort, the slow query was already logged
+                pass
+            finally:
+                if curs is not None:
+                    self.db.return_cursor(curs)
+        return plan
+
+    def close(self):
+        """
+        Stop logging slow queries.
+        """
+        if self in self.db.after_execute:
+            self.db.after_execute.remove(self)
+        if self.handler is not None:
+            self.logger.removeHandler(self.handler)
+            self.handler.close()
+
+
+def _new_counters() -> dict:
+    return {
+        'queries': QueryStats(), 'rows_fetched': Counter(), 'dicts_materialized': Counter(),
+        'references_resolved': Counter(), 'bulk_load_rows': Counter(), 'bulk_load_seconds': Counter(),
+    }
+
+
+def _add_counters(total: dict, counters: dict):
+    total['queries'].merge(counters['queries'].snapshot())
+    for name, counter in counters.items():
+        if name != 'queries':
+            total[name].update(counter.copy())
+
+
+class _ThreadOwner:
+    """
+    Kept by a thread's local storage, it is freed when the thread exits.
+    """
+    __slots__ = ('__weakref__',)
+
+
+def _thread_exited(metrics_ref: weakref.ref, counters: dict):
+    metrics = metrics_ref()
+    if metrics is not None:
+        metrics._fold(counters)
+
+
+class Metrics:
+    """
+    An after_execute hook which counts queries, errors and latency by table and
+    operation, and counts the rows fetched, Dicts materialized, references
+    resolved and rows bulk loaded by each table.  See DictDB.metrics.
+
+    Each thread counts using its own counters, queries are counted by the
+    thread's own QueryStats.  No lock is shared, except when a thread counts
+    for the first time.  When a thread exits, its counters are added to
+    "exited".  snapshot adds up "exited" and the counters of all living threads.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # The counters of each living thread which has counted
+        self.threads = []
+        # The totals of the threads which have exited
+        self.exited = _new_counters()
+
+    def _counters(self) -> dict:
+        try:
+            return self.local.counters
+        except AttributeError:
+            counters = self.local.counters = _new_counters()
+            owner = self.local.owner = _ThreadOwner()
+            weakref.finalize(owner, _thread_exited, weakref.ref(self), counters).atexit = False
+            with self.lock:
+                self.threads.append(counters)
+            return counters
+
+    def _fold(self, counters: dict):
+        """
+        Add the counters of an exited thread to "exited".
+        """
+        with self.lock:
+            self.threads = [i for i in self.threads if i is not counters]
+            _add_counters(self.exited, counters)
+
+    def __call__(self, event: QueryEvent):
+        self._counters()['queries'](event)
+
+    def rows_fetched(self, table: str, count: int = 1):
+        self._counters()['rows_fetched'][table] += count
+
+    def dicts_materialized(self, table: str, count: int = 1):
+        self._counters()['dicts_materialized'][table] += count
+
+    def reference_resolved(self, table: str, ref_name: str):
+        self._counters()['references_resolved'][(table, ref_name)] += 1
+
+    def bulk_loaded(self, table: str, rows: int, seconds: float):
+        counters = self._counters()
+        counters['bulk_load_rows'][table] += rows
+        counters['bulk_load_seconds'][table] += seconds
+
+    def snapshot(self) -> dict:
+        """
+        Get the totals of all threads' counters.  "queries" is keyed by (table,
+        operation) like a QueryStats snapshot, "references_resolved" by (table,
+        reference), everything else by table.
+        """
+        total = _new_counters()
+        with self.lock:
+            for counters in [self.exited] + self.threads:
+                _add_counters(total, counters)
+        snapshot = {name: dict(counter) for name, counter in total.items() if name != 'queries'}
+        snapshot['queries'] = total['queries'].snapshot()
+        return snapshot
+
+
+class ProfileReport:
+    """
+    An after_execute hook which splits the time spent by DictORM into the
+    PROFILE_CATEGORIES, and totals the time of each query shape.  See
+    DictDB.profile.
+
+    "database" is the time queries took to execute, "row_conversion" is the
+    time spent getting rows from the driver's cursor (for Sqlite, this includes
+    stepping through the query), "dict_construction" is the time spent creating
+    Dicts of those rows, and "query_building" is the time spent building
+    queries.  "elapsed" is the time of the whole profile, everything not in a
+    category was spent by the caller's code.
+
+    If "cprofile" is True, the profiled thread is also profiled by cProfile,
+    see dictorm_functions.
+    """
+
+    def __init__(self, cprofile: bool = False):
+        self.lock = threading.Lock()
+        self.seconds = dict.fromkeys(PROFILE_CATEGORIES, 0.0)
+        # shape -> {'table', 'operation', 'count', 'seconds'}
+        self.shapes = {}
+        self.elapsed = 0.0
+        self.profile = cProfile.Profile() if cprofile else None
+
+    def __call__(self, event: QueryEvent):
+        shape = query_shape(event.sql)
+        with self.lock:
+            self.seconds['database'] += event.elapsed
+            stats = self.shapes.get(shape)
+            if stats is None:
+                stats = self.shapes[shape] = {'table': event.table, 'operation': event.operation,
+                                              'count': 0, 'seconds': 0.0}
+            stats['count'] += 1
+            stats['seconds'] += event.elapsed
+
+    def add(self, category: str, seconds: float):
+        with self.lock:
+            self.seconds[category] += seconds
+
+    def top_shapes(self, count: int = 10) -> list:
+        """
+        Get the "count" query shapes which took the most time, slowest first.
+        """
+        with self.lock:
+            shapes = [dict(stats, shape=shape) for shape, stats in self.shapes.items()]
+        return sorted(shapes, key=lambda i: i['seconds'], reverse=True)[:count]
+
+    def dictorm_functions(self, count: int = 20) -> list:
+        """
+        Get the "count" functions of dictorm that took the most time (excluding
+        the functions they called), according to cProfile.  Each is a dict of
+        function, calls, tottime and cumtime.
+        """
+        if self.profile is None:
+            raise ValueError('cProfile was not used, use profile(cprofile=True)')
+        stats = pstats.Stats(self.profile).stats
+        directory = os.path.dirname(os.path.abspath(__file__))
+        functions = [
+            {'function': f'{os.path.basename(path)}:{line}({name})', 'calls': calls,
+             'tottime': tottime, 'cumtime': cumtime}
+            for (path, line, name), (_, calls, tottime, cumtime, _) in stats.items()
+            if os.path.dirname(os.path.abspath(path)) == directory
+        ]
+        return sorted(functions, key=lambda i: i['tottime'], reverse=True)[:count]
+
+    def summary(self, count: int = 10) -> str:
+        """
+        Get a printable summary of the time spent, and the slowest query shapes.
+        """
+        lines = [f'Profiled {self.elapsed:.6f}s']
+        for category in PROFILE_CATEGORIES:
+            seconds = self.seconds[category]
+            share = seconds / self.elapsed if self.elapsed else 0.0
+            lines.append(f'  {category:<18} {seconds:.6f}s {share:6.1%}')
+        lines.append('Top query shapes:')
+        for i in self.top_shapes(count):
+            lines.append(f'  {i["seconds"]:.6f}s {i["count"]:>6}x {i["shape"]}')
+        return '\n'.join(lines)
+
+
+def _labels(**labels) -> str:
+    def escape(value):
+        value = '' if value is None else str(value)
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def render_prometheus(snapshot: dict) -> str:
+    """
+    Render a snapshot of DictDB.metrics in the Prometheus text format.
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+
+    queries = sorted(snapshot['queries'].items(), key=lambda i: (str(i[0][0]), i[0][1]))
+    metric('dictorm_queries_total', 'counter', 'Queries executed.',
+           [(_labels(table=t, operation=o), i['count']) for (t, o), i in queries])
+    metric('dictorm_query_errors_total', 'counter', 'Queries which raised an error.',
+           [(_labels(table=t, operation=o), i['errors']) for (t, o), i in queries])
+    lines.append('# HELP dictorm_query_duration_seconds Time spent executing queries.')
+    lines.append('# TYPE dictorm_query_duration_seconds histogram')
+    for (table, operation), stats in queries:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('dictorm_query_duration_seconds_bucket{0} {1}'.format(
+                _labels(table=table, operation=operation, le=le), cumulative))
+        labels = _labels(table=table, operation=operation)
+        lines.append(f'dictorm_query_duration_seconds_sum{labels} {stats["seconds"]}')
+        lines.append(f'dictorm_query_duration_seconds_count{labels} {stats["count"]}')
+
+    for name, help_text in (('rows_fetched', 'Rows fetched from the database.'),
+                            ('dicts_materialized', 'Dicts created from fetched rows.'),
+                            ('bulk_load_rows', 'Rows inserted by parallel_load.'),
+                            ('bulk_load_seconds', 'Time spent in parallel_load.')):
+        metric(f'dictorm_{name}_total', 'counter', help_text,
+               [(_labels(table=t), v) for t, v in sorted(snapshot[name].items(), key=str)])
+    metric('dictorm_references_resolved_total', 'counter', 'Queries which got a reference.',
+           [(_labels(table=t, reference=r), v)
+            for (t, r), v in sorted(snapshot['references_resolved'].items(), key=str)])
+
+    cache = snapshot.get('cache')
+    if cache:
+        for name in ('hits', 'misses', 'evictions'):
+            metric(f'dictorm_cache_{name}_total', 'counter', f'ResultCache {name}.',
+                   [('', cache[name])])
+        metric('dictorm_cache_entries', 'gauge', 'Queries kept by the ResultCache.',
+               [('', cache['entries'])])
+    return '\n'.join(lines) + '\n'
@@ -13,6 +13,7 @@ sort_keys = False
 
 __all__ = [
     'And',
+    'BulkInsert',
     'Column',
     'Comparison',
     'Delete',
@@ -156,6 +157,26 @@ class Insert(object):
         return self
 
 
+class BulkInsert(Insert):
+    """
+    Insert many rows using a single multi-row INSERT.  Every row must have the
+    same columns as the first row.
+    """
+    cvp = '({0}) VALUES {1}'
+
+    def __init__(self, table, rows):
+        super(BulkInsert, self).__init__(table, **(rows[0] if rows else {}))
+        self.rows = rows
+
+    def _build_cvp(self):
+        row = '({0})'.format(', '.join([self.interpolation_str, ] * len(self._values)))
+        return (', '.join(['"{}"'.format(i) for i in self._ordered_keys]),
+                ', '.join([row, ] * len(self.rows)))
+
+    def values(self):
+        return [row[k] for row in self.rows for k in self._ordered_keys]
+
+
 class Update(Insert):
     query = 'UPDATE "{table}" SET {cvp}'
     interpolation_str = '%s'
@@ -354,8 +375,8 @@ class Operator(object):
         for comp in self.operators_or_comp:
             if isinstance(comp, Operator):
                 i.extend(comp)
-            elif isinstance(comp, Comparison) and not comp._null_kind():
-                i.append(comp.value())
+            elif isinstance(comp, Comparison):
+                i.extend(comp)
         return iter(i)
 
     def __add__(self, i):
@@ -1,6 +1,7 @@
 '''
 Provide Sqlite3 support by making simple changes to dictorm.pg classes.
 '''
+from .pg import BulkInsert as PostgresqlBulkInsert
 from .pg import Column as PostgresqlColumn
 from .pg import Comparison as PostgresqlComparison
 from .pg import Insert as PostgresqlInsert
@@ -9,6 +10,7 @@ from .pg import Update as PostgresqlUpdate
 
 __all__ = [
     'And',
+    'BulkInsert',
     'Column',
     'Comparison',
     'Insert',
@@ -20,6 +22,21 @@ __all__ = [
 class Comparison(PostgresqlComparison):
     interpolation_str = '?'
 
+    def _in_kind(self):
+        return self.kind == ' IN ' and isinstance(self.column2, tuple)
+
+    def __str__(self):
+        # Sqlite can't interpolate a tuple, interpolate each of its values
+        if self._in_kind():
+            return '"{0}" IN ({1})'.format(self.column1.column,
+                                          ', '.join(self.interpolation_str for _ in self.column2))
+        return super(Comparison, self).__str__()
+
+    def __iter__(self):
+        if self._in_kind():
+            return iter(self.column2)
+        return super(Comparison, self).__iter__()
+
 
 class Column(PostgresqlColumn):
     comparison = Comparison
@@ -33,6 +50,10 @@ class Insert(PostgresqlInsert):
         return self
 
 
+class BulkInsert(PostgresqlBulkInsert):
+    interpolation_str = '?'
+
+
 class Update(PostgresqlUpdate):
     interpolation_str = '?'
 
@@ -0,0 +1,254 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import aiosqlite
+
+import dictorm
+from dictorm.aio import AsyncDict, AsyncDictDB, AsyncResultsGenerator
+
+
+class TestAsyncSqlite(unittest.TestCase):
+
+    async def asyncSetUp(self):
+        self.conn = await aiosqlite.connect(':memory:')
+        await self.conn.executescript('''
+        CREATE TABLE person (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            other INTEGER,
+            manager_id INTEGER REFERENCES person(id)
+        );
+        CREATE TABLE department (
+            id INTEGER PRIMARY KEY,
+            name TEXT
+        );
+        CREATE TABLE person_department (
+            person_id INTEGER REFERENCES person(id),
+            department_id INTEGER REFERENCES department(id),
+            PRIMARY KEY (person_id, department_id)
+        );
+        CREATE TABLE car (
+            id INTEGER PRIMARY KEY,
+            license_plate TEXT,
+            name TEXT,
+            person_id INTEGER REFERENCES person(id)
+        );
+        ALTER TABLE person ADD COLUMN car_id INTEGER REFERENCES car(id);
+        ''')
+        await self.conn.commit()
+        self.db = await AsyncDictDB.create(self.conn)
+
+    async def asyncTearDown(self):
+        await self.conn.close()
+
+    def run_test(self, coro):
+        async def run():
+            await self.asyncSetUp()
+            try:
+                await coro()
+            finally:
+                await self.asyncTearDown()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_get_where(self):
+        async def test():
+            Person = self.db['person']
+            self.assertEqual(Person.pks, ['id'])
+            self.assertEqual(await Person.count(), 0)
+
+            bob = Person(name='Bob')
+            self.assertIsInstance(bob, AsyncDict)
+            self.assertIs(await bob.flush(), bob)
+            self.assertEqual(bob['id'], 1)
+            alice = await Person(name='Alice').flush()
+
+            self.assertEqual(await Person.count(), 2)
+            self.assertEqual(await Person.get_one(1), bob)
+            self.assertEqual(await Person.get_one(name='Alice'), alice)
+            self.assertIsNone(await Person.get_one(3))
+            with self.assertRaises(dictorm.UnexpectedRows):
+                await Person.get_one()
+
+            results = Person.get_where()
+            self.assertIsInstance(results, AsyncResultsGenerator)
+            self.assertEqual([i async for i in results], [bob, alice])
+            # Results are cached
+            self.assertEqual([i async for i in results], [bob, alice])
+            self.assertEqual(await results, [bob, alice])
+
+            self.assertEqual(await Person.get_where().refine(name='Alice'), [alice])
+            self.assertEqual(await Person.get_where().order_by('id DESC').limit(1), [alice])
+            self.assertEqual(await Person.get_where().limit(1).offset(1), [alice])
+            self.assertEqual(await Person.get_raw('SELECT * FROM person WHERE id=?', 2), [alice])
+
+            results = Person.get_where().nocache()
+            self.assertEqual(await results, [bob, alice])
+            self.assertEqual(results.cache, [])
+            with self.assertRaises(dictorm.NoCache):
+                await results
+
+            # Update and delete
+            bob['name'] = 'Steve'
+            await bob.flush()
+            self.assertEqual((await Person.get_one(1))['name'], 'Steve')
+            await alice.delete()
+            self.assertEqual(await Person.get_where(), [bob])
+
+        self.run_test(test)
+
+    def test_references(self):
+        async def test():
+            Person, Car = self.db['person'], self.db['car']
+            Department, PD = self.db['department'], self.db['person_department']
+            Person['manager'] = Person['manager_id'] == Person['id']
+            Person['subordinates'] = Person['id'].many(Person['manager_id'])
+            Person['car'] = Person['car_id'] == Car['id']
+            Person['car_name'] = (Person['car_id'] == Car['id']).substratum('name')
+            PD['department'] = PD['department_id'] == Department['id']
+            Person['person_departments'] = Person['id'].many(PD['person_id'])
+            Person['departments'] = Person['person_departments'].substratum('department')
+            Person['subordinates_departments'] = Person['subordinates'].aggregate('departments')
+
+            bob = await Person(name='Bob').flush()
+            self.assertIsNone(await bob['manager'])
+            self.assertEqual(await bob['subordinates'], [])
+
+            alice = await Person(name='Alice', manager_id=bob['id']).flush()
+            steve = await Person(name='Steve', manager_id=bob['id']).flush()
+            self.assertEqual((await alice['manager']).no_refs(), bob.no_refs())
+            self.assertEqual([i['name'] async for i in bob['subordinates']], ['Alice', 'Steve'])
+            self.assertEqual(await bob['subordinates'].refine(name='Steve'), [steve])
+
+            car = await Car(name='Stratus').flush()
+            alice['car_id'] = car['id']
+            await alice.flush()
+            self.assertEqual(await alice['car'], car)
+            self.assertEqual(await alice['car_name'], 'Stratus')
+            # The referenced row is only gotten once
+            self.assertIs(await alice['car'], await alice['car'])
+
+            sales = await Department(name='Sales').flush()
+            hr = await Department(name='HR').flush()
+            await PD(person_id=alice['id'], department_id=sales['id']).flush()
+            await PD(person_id=steve['id'], department_id=hr['id']).flush()
+            self.assertEqual(await alice['departments'], [sales])
+            self.assertEqual(await bob['subordinates_departments'], [sales, hr])
+
+        self.run_test(test)
+
+    def test_batch(self):
+        async def test():
+            Person, Car = self.db['person'], self.db['car']
+            Person['car'] = Person['car_id'] == Car['id']
+            Person['car_name'] = (Person['car_id'] == Car['id']).substratum('name')
+            cars = [await Car(name=f'Car{i}').flush() for i in range(3)]
+            for i in range(5):
+                await Person(name=f'Person{i}', car_id=cars[i % 3]['id'] if i < 4 else None).flush()
+
+            persons = await Person.get_where()
+            with mock.patch.object(Car, 'get_where', wraps=Car.get_where) as get_where:
+                async with self.db.batch():
+                    self.assertEqual(await asyncio.gather(*(i['car'] for i in persons)),
+                                     cars + [cars[0], None])
+                    self.assertEqual(get_where.call_count, 1)
+                    self.assertEqual(await asyncio.gather(*(i['car_name'] for i in persons[1:])),
+                                     ['Car1', 'Car2', 'Car0', None])
+                    self.assertEqual(get_where.call_count, 2)
+                self.assertIsNone(self.db.loader)
+
+        self.run_test(test)
+
+    def test_transaction(self):
+        async def test():
+            Person = self.db['person']
+            async with self.db.transaction(commit=True):
+                await Person(name='Bob').flush()
+            await self.conn.rollback()
+            self.assertEqual(await Person.count(), 1)
+
+            with self.assertRaises(ValueError):
+                async with self.db.transaction(commit=True):
+                    await Person(name='Alice').flush()
+                    raise ValueError()
+            self.assertEqual(await Person.count(), 1)
+
+        self.run_test(test)
+
+    def test_not_supported(self):
+        async def test():
+            Person = self.db['person']
+            for name in ('invalidate', 'memory_usage', 'evict', 'parallel_map', 'parallel_load'):
+                with self.subTest(name):
+                    self.assertRaises(TypeError, getattr(Person, name))
+
+        self.run_test(test)
+
+
+class FakeAiopgCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = -1
+
+    async def execute(self, sql, values=None):
+        self.conn.executed.append(sql)
+
+    def close(self):
+        pass
+
+
+class FakeAiopgConnection:
+    """
+    Like an aiopg connection, always in autocommit mode and without usable
+    commit or rollback methods.
+    """
+    autocommit = True
+
+    def __init__(self):
+        self.executed = []
+
+    async def cursor(self, cursor_factory=None):
+        return FakeAiopgCursor(self)
+
+    async def commit(self):
+        raise RuntimeError('commit cannot be used in asynchronous mode')
+
+    async def rollback(self):
+        raise RuntimeError('rollback cannot be used in asynchronous mode')
+
+
+class TestAsyncAiopg(unittest.TestCase):
+
+    def test_transaction(self):
+        """
+        The transaction of an autocommit connection is controlled by statements.
+        """
+        conn = FakeAiopgConnection()
+        db = AsyncDictDB(conn)
+        self.assertEqual(db.kind, dictorm.DBKind.postgres)
+
+        async def test():
+            async with db.transaction(commit=True):
+                conn.executed.append('work')
+            with self.assertRaises(ValueError):
+                async with db.transaction(commit=True):
+                    raise ValueError()
+            async with db.transaction():
+                pass
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(test())
+        finally:
+            loop.close()
+        self.assertEqual(conn.executed, ['BEGIN', 'work', 'COMMIT', 'BEGIN', 'ROLLBACK', 'BEGIN'])
+
+
+if __name__ == '__main__':
+    unittest.main()
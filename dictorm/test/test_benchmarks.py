@@ -0,0 +1,62 @@
+import unittest
+
+from benchmarks import BENCHMARKS, compare, get_backends, run
+from benchmarks.load import parse_mix, percentile, run_load
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_run(self):
+        results = run(get_backends(['sqlite-memory']), rows=[3], widths=[2], repeat=1)
+        self.assertEqual([(i['group'], i['name']) for i in results], list(BENCHMARKS))
+        for result in results:
+            self.assertEqual((result['backend'], result['rows'], result['width']), ('sqlite-memory', 3, 2))
+            self.assertGreaterEqual(result['median'], result['min'])
+
+        self.assertRaises(ValueError, get_backends, ['oracle'])
+
+    def test_compare(self):
+        def result(name, median):
+            return {'group': 'get_one', 'name': name, 'backend': 'sqlite-memory', 'rows': 100, 'width': 0,
+                    'median': median}
+
+        baseline = [result('pk', 0.01), result('slower', 0.01), result('tiny', 0.0001)]
+        results = [result('pk', 0.0105), result('slower', 0.02), result('tiny', 0.0002), result('new', 1)]
+        comparisons = compare(baseline, results, threshold=0.1)
+        self.assertEqual([(i['benchmark'], i['regression']) for i in comparisons], [
+            ('get_one.pk sqlite-memory rows=100 width=0', False),
+            ('get_one.slower sqlite-memory rows=100 width=0', True),
+            # Too small to be more than noise
+            ('get_one.tiny sqlite-memory rows=100 width=0', False),
+        ])
+        self.assertAlmostEqual(comparisons[1]['change'], 1.0)
+
+
+class TestLoad(unittest.TestCase):
+
+    def test_run_load(self):
+        backend, = get_backends(['sqlite-file'])
+        self.addCleanup(backend.cleanup)
+        report = run_load(backend, rows=10, workers=2, duration=0.2, mix=parse_mix('read=3,reference=1,write=1'))
+        self.assertEqual(list(report['operations']), ['read', 'reference', 'write'])
+        self.assertEqual(report['count'], sum(i['count'] for i in report['operations'].values()))
+        read = report['operations']['read']
+        self.assertGreater(read['count'], 0)
+        self.assertLessEqual(read['p50'], read['p99'])
+        self.assertLessEqual(read['p99'], read['max'])
+
+        memory, = get_backends(['sqlite-memory'])
+        self.assertRaises(ValueError, run_load, memory)
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('read=60, write=40,insert'), {'read': 60, 'write': 40, 'insert': 1})
+        self.assertRaises(ValueError, parse_mix, 'delete=1')
+        self.assertRaises(ValueError, parse_mix, 'read=0')
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile(values, 1), 100)
+        self.assertEqual(percentile([7], 0.9), 7)
+        self.assertEqual(percentile([], 0.9), 0.0)
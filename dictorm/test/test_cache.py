@@ -0,0 +1,177 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from dictorm.cache import ResultCache, SingleFlight, query_key
+
+
+class TestQueryKey(unittest.TestCase):
+
+    def test_query_key(self):
+        self.assertEqual(query_key('SELECT 1', [1, 'a']), ('SELECT 1', (1, 'a')))
+        self.assertEqual(query_key('SELECT 1', None), ('SELECT 1', ()))
+        self.assertEqual(query_key('SELECT 1', [{'a': 1}]), query_key('SELECT 1', [{'a': 1}]))
+        self.assertNotEqual(query_key('SELECT 1', [1]), query_key('SELECT 2', [1]))
+        hash(query_key('SELECT 1', [[1, 2]]))
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_wait(self):
+        """
+        Identical calls wait for the call in progress, and get copies of its rows.
+        """
+        single_flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return [1, 2]
+
+        with ThreadPoolExecutor(4) as executor:
+            first = executor.submit(single_flight.do, 'key', fetch)
+            started.wait()
+            others = [executor.submit(single_flight.do, 'key', fetch) for _ in range(3)]
+            # Give the other calls time to start waiting
+            time.sleep(0.05)
+            release.set()
+            rows = [first.result()] + [i.result() for i in others]
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(rows, [[1, 2]] * 4)
+        self.assertEqual(len({id(i) for i in rows}), 4)
+        self.assertEqual(single_flight.calls, {})
+
+        # The next call fetches again
+        release.set()
+        self.assertEqual(single_flight.do('key', fetch), [1, 2])
+        self.assertEqual(calls, [1, 1])
+
+    def test_error(self):
+        """
+        An error is raised to every caller.
+        """
+        single_flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def fetch():
+            started.set()
+            release.wait()
+            raise ValueError('oops')
+
+        with ThreadPoolExecutor(2) as executor:
+            first = executor.submit(single_flight.do, 'key', fetch)
+            started.wait()
+            other = executor.submit(single_flight.do, 'key', fetch)
+            time.sleep(0.05)
+            release.set()
+            self.assertRaises(ValueError, first.result)
+            self.assertRaises(ValueError, other.result)
+        self.assertEqual(single_flight.calls, {})
+
+    def test_unshared(self):
+        """
+        A result which isn't a list can't be shared, waiting callers get None.
+        """
+        single_flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        streamed = object()
+
+        def fetch():
+            started.set()
+            release.wait()
+            return streamed
+
+        with ThreadPoolExecutor(2) as executor:
+            first = executor.submit(single_flight.do, 'key', fetch)
+            started.wait()
+            other = executor.submit(single_flight.do, 'key', fetch)
+            time.sleep(0.05)
+            release.set()
+            self.assertIs(first.result(), streamed)
+            self.assertIsNone(other.result())
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_memory_usage(self):
+        cache = ResultCache()
+        self.assertEqual(cache.memory_usage(), 0)
+        cache.put('a', [{'name': 'Bob'}], frozenset(['person']))
+        small = cache.memory_usage()
+        self.assertGreater(small, 0)
+        cache.put('b', [{'name': 'x' * 10000}], frozenset(['person']))
+        self.assertGreater(cache.memory_usage(), small + 10000)
+        # Replaced rows aren't counted twice
+        cache.put('a', [{'name': 'Bob'}], frozenset(['person']))
+        self.assertEqual(cache.memory_usage(), cache.bytes)
+        self.assertLess(cache.memory_usage(), 2 * small + 20000)
+        cache.invalidate('person')
+        self.assertEqual(cache.memory_usage(), 0)
+        cache.put('a', [{'name': 'Bob'}], frozenset(['person']))
+        cache.clear()
+        self.assertEqual(cache.memory_usage(), 0)
+
+    def test_lru(self):
+        cache = ResultCache(maxsize=2)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', [1], frozenset(['person']))
+        cache.put('b', [2], frozenset(['person']))
+        rows = cache.get('a')
+        self.assertEqual(rows, [1])
+        # A copy of the rows is gotten
+        rows.append(3)
+        self.assertEqual(cache.get('a'), [1])
+
+        # The least recently used rows are evicted
+        cache.put('c', [3], frozenset(['car']))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), [3])
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (3, 2, 1))
+        self.assertEqual(cache.tags, {'person': {'a'}, 'car': {'c'}})
+
+        self.assertRaises(ValueError, ResultCache, maxsize=0)
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=10)
+        with mock.patch('dictorm.cache.time.monotonic', return_value=100):
+            cache.put('a', [1], frozenset(['person']))
+        with mock.patch('dictorm.cache.time.monotonic', return_value=109):
+            self.assertEqual(cache.get('a'), [1])
+        with mock.patch('dictorm.cache.time.monotonic', return_value=110):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = ResultCache()
+        cache.put('a', [1], frozenset(['person']))
+        cache.put('b', [2], frozenset(['person', 'car']))
+        cache.put('c', [3], frozenset(['car']))
+        cache.invalidate('person')
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), [3])
+        self.assertEqual(cache.tags, {'car': {'c'}})
+
+        # Rows gotten before an invalidation are not kept
+        tables = frozenset(['car'])
+        generation = cache.generation(tables)
+        cache.invalidate('car')
+        cache.put('d', [4], tables, generation)
+        self.assertIsNone(cache.get('d'))
+        generation = cache.generation(tables)
+        cache.clear()
+        cache.put('d', [4], tables, generation)
+        self.assertEqual(len(cache), 0)
+        cache.put('d', [4], tables, cache.generation(tables))
+        self.assertEqual(cache.get('d'), [4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,26 @@
 #! /usr/bin/env python
+import csv
+import io
+import json
+import logging
+import os
 import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import psycopg2
 from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool
 
 import dictorm
+from dictorm.instrument import NPlusOneError, NPlusOneWarning, PROFILE_CATEGORIES, QueryStats, deep_size
+from dictorm.instrument import QueryEvent, query_shape
+from dictorm.tracing import InMemorySpanExporter, Tracer
 
 test_db_login = {
     'database': 'postgres',
@@ -32,6 +47,11 @@ def _no_refs(o):
 def error(*a, **kw): raise Exception()
 
 
+def double_other(person):
+    # Used by parallel_map, must be picklable
+    return person['other'] * 2
+
+
 class ExtraTestMethods:
 
     @classmethod
@@ -166,9 +186,8 @@ class TestPostgresql(ExtraTestMethods, unittest.TestCase):
         self.assertEqual(list(Person.get_where()), [bob, alice])
 
         # get_where accepts a tuple of ids, and returns those rows
-        if self.db.kind != dictorm.DBKind.sqlite3:
-            self.assertEqual(list(Person.get_where(Person['id'].In([1, 3]))),
-                             [bob, alice])
+        self.assertEqual(list(Person.get_where(Person['id'].In([1, 3]))),
+                         [bob, alice])
 
         # Database row survives an object deletion
         del bob
@@ -455,7 +474,10 @@ class TestPostgresql(ExtraTestMethods, unittest.TestCase):
 
         self.assertRaises(KeyError, bob.__getitem__, 'foo')
 
+        free_cursors = len(self.db._cursors)
         self.assertRaises(dictorm.UnexpectedRows, Person.get_one)
+        # The cursor was returned
+        self.assertEqual(len(self.db._cursors), max(free_cursors, 1))
 
         NoPk = self.db['no_pk']
         foo = NoPk(foo='bar')
@@ -1307,6 +1329,964 @@ class TestPostgresql(ExtraTestMethods, unittest.TestCase):
         except psycopg2.errors.UndefinedColumn as e:
             pass
 
+    def test_export(self):
+        """
+        The rows of a query can be streamed to a CSV or JSON Lines file.
+        """
+        Person = self.db['person']
+        bob, aly = map(lambda i: Person(name=i).flush(), ['Bob', 'Aly'])
+
+        fh = io.StringIO()
+        self.assertEqual(Person.get_where().export(fh), 2)
+        rows = list(csv.DictReader(io.StringIO(fh.getvalue())))
+        self.assertEqual([i['name'] for i in rows], ['Bob', 'Aly'])
+        self.assertEqual(set(rows[0]), set(Person.columns))
+
+        fh = io.StringIO()
+        self.assertEqual(Person.get_where(name='Aly').export(fh, format='jsonl', batch_size=1), 1)
+        self.assertEqual(json.loads(fh.getvalue()), aly.no_refs())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'people.jsonl')
+            self.assertEqual(Person.get_where().export(path, format='jsonl', batch_size=1), 2)
+            with open(path) as fh:
+                self.assertEqual([json.loads(i) for i in fh], [bob.no_refs(), aly.no_refs()])
+
+        # Exporting doesn't interfere with iteration of the same results
+        results = Person.get_where()
+        self.assertEqual(next(results), bob)
+        self.assertEqual(results.export(io.StringIO()), 2)
+        self.assertEqual(next(results), aly)
+
+        self.assertRaises(ValueError, Person.get_where().export, io.StringIO(), format='xml')
+
+        # Exports (including Postgres COPY) are executed by DictDB.execute, and seen by its hooks
+        events = []
+        self.db.after_execute.append(events.append)
+        self.assertEqual(Person.get_where().export(io.StringIO()), 2)
+        self.db.after_execute.remove(events.append)
+        self.assertEqual([(i.table, i.error) for i in events], [('person', None)])
+
+        # Postgres exports which don't use COPY are streamed by a server-side cursor
+        server_cursor = dictorm.ResultsGenerator._server_cursor
+        with mock.patch.object(dictorm.ResultsGenerator, '_server_cursor', autospec=True,
+                               side_effect=server_cursor) as patched:
+            fh = io.StringIO()
+            self.assertEqual(Person.get_where().export(fh, format='jsonl', batch_size=1), 2)
+            self.assertEqual([json.loads(i) for i in fh.getvalue().splitlines()], [bob.no_refs(), aly.no_refs()])
+            Person.get_where().export(io.StringIO())
+        if self.db.kind == dictorm.DBKind.postgres:
+            patched.assert_called_once_with(mock.ANY, 'export', 1)
+        else:
+            patched.assert_not_called()
+
+    def test_batch(self):
+        """
+        One-to-one references of the Dicts gotten in a batch are gotten using one query.
+        """
+        Person, Car = self.db['person'], self.db['car']
+        Person['car'] = Person['car_id'] == Car['id']
+        Person['car_name'] = (Person['car_id'] == Car['id']).substratum('name')
+        cars = [Car(name=f'Car{i}').flush() for i in range(3)]
+        for i in range(6):
+            Person(name=f'Person{i}', car_id=cars[i % 3]['id'] if i < 5 else None).flush()
+
+        with mock.patch.object(Car, 'get_where', wraps=Car.get_where) as get_where:
+            with self.db.batch() as batch:
+                persons = list(Person.get_where().order_by('id ASC'))
+                self.assertEqual([i['car'] for i in persons], cars + [cars[0], cars[1], None])
+                self.assertEqual([i['car_name'] for i in persons], ['Car0', 'Car1', 'Car2', 'Car0', 'Car1', None])
+                self.assertEqual(get_where.call_count, 1)
+
+                # Nested batches are part of the outer batch
+                with self.db.batch() as inner:
+                    self.assertIs(inner, batch)
+
+                # A reference to a row that hasn't been gotten is gotten using another query
+                car = Car(name='Car3').flush()
+                persons[5]['car_id'] = car['id']
+                self.assertEqual(persons[5]['car'], car)
+                self.assertEqual(get_where.call_count, 2)
+            self.assertIsNone(self.db.current_batch())
+
+            # Outside a batch, references are gotten one at a time
+            persons = list(Person.get_where().order_by('id ASC'))
+            self.assertEqual(persons[1]['car'], cars[1])
+            self.assertEqual(persons[2]['car'], cars[2])
+            self.assertEqual(get_where.call_count, 4)
+
+    def test_single_flight(self):
+        """
+        A DictDB can share the rows of identical queries executed at the same time.
+        """
+        db = dictorm.DictDB(self.conn, single_flight=True)
+        Person = db['person']
+        bob, alice = Person(name='Bob').flush(), Person(name='Alice').flush()
+        with mock.patch.object(db.single_flight, 'do', wraps=db.single_flight.do) as do:
+            self.assertEqual(Person.get_one(bob['id']), bob)
+            self.assertEqual(list(Person.get_where().limit(5)), [bob, alice])
+            self.assertEqual(list(Person.get_where(Person['id'] < 0).single_flight()), [])
+            self.assertEqual(do.call_count, 3)
+            # Unbounded queries aren't shared
+            self.assertEqual(list(Person.get_where()), [bob, alice])
+            self.assertEqual(do.call_count, 3)
+
+        with Person.get_where() as persons:
+            self.assertEqual(next(persons), bob)
+        self.assertRaises(StopIteration, next, persons)
+        self.assertEqual(persons.cache, [bob])
+
+    def test_result_cache(self):
+        """
+        The rows of queries can be cached, and are evicted when their tables are changed.
+        """
+        db = dictorm.DictDB(self.conn, result_cache=dictorm.ResultCache(maxsize=10))
+        cache = db.result_cache
+        Person, Car = db['person'], db['car']
+        bob = Person(name='Bob').flush()
+        car = Car(name='Stratus').flush()
+
+        self.assertEqual(list(Person.get_where()), [bob])
+        self.assertEqual(list(Car.get_where()), [car])
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(list(Person.get_where()), [bob])
+        self.assertEqual(Person.get_one(bob['id']), bob)
+        self.assertEqual((cache.hits, len(cache)), (1, 3))
+
+        # A flush evicts the rows of queries of its table
+        alice = Person(name='Alice').flush()
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(list(Person.get_where()), [bob, alice])
+        alice.delete()
+        self.assertEqual(list(Person.get_where()), [bob])
+
+        # A raw query is tagged with the tables it reads, other raw queries invalidate their tables
+        self.assertEqual(list(Car.get_raw('SELECT car.* FROM car JOIN person ON person.id = car.id')),
+                         [car])
+        raw_key = next(k for k in cache.entries if 'JOIN' in k[0])
+        self.assertEqual(cache.entries[raw_key][2], {'car', 'person'})
+        self.assertEqual(list(Person.get_raw('UPDATE person SET name=name')), [])
+        self.assertNotIn('person', cache.tags)
+        self.assertEqual(len(cache), 1)
+
+        # Every table of a comma join, and schema-qualified tables, are tagged
+        schema = 'main' if db.kind == dictorm.DBKind.sqlite3 else 'public'
+        joined = f'SELECT car.* FROM car, {schema}.person AS p'
+        dave = Person(name='Dave').flush()
+        self.assertEqual(list(Car.get_raw(joined)), [car, car])
+        self.assertEqual(cache.entries[next(k for k in cache.entries if k[0] == joined)][2],
+                         {'car', 'person'})
+        dave.delete()
+        self.assertEqual(list(Car.get_raw(joined)), [car])
+
+        # A raw query using something other than a table isn't cached, a change by one clears the
+        # cache
+        entries = len(cache)
+        ids = 'WITH ids AS (SELECT id FROM car) SELECT id FROM ids'
+        self.assertEqual(list(Car.get_raw(f'SELECT * FROM car WHERE id IN ({ids})')), [car])
+        self.assertEqual(len(cache), entries)
+        self.assertEqual(list(Car.get_raw(f'UPDATE car SET name=name WHERE id IN ({ids})')), [])
+        self.assertEqual(len(cache), 0)
+
+        # Changes made without a Dict require an invalidation
+        self.assertEqual(list(Car.get_where()), [car])
+        db.curs.execute('DELETE FROM car')
+        self.assertEqual(list(Car.get_where()), [car])
+        Car.invalidate()
+        self.assertEqual(list(Car.get_where()), [])
+
+        # Rolling back a transaction evicts everything
+        with self.assertRaises(ValueError):
+            with db.transaction():
+                Car(name='Stratus').flush()
+                self.assertEqual(len(Car.get_where()[:]), 1)
+                raise ValueError()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(list(Car.get_where()), [])
+
+        # The rows of a nocache generator aren't kept
+        for i in range(3):
+            Person(name=f'Person{i}').flush()
+        cache.clear()
+        persons = list(Person.get_where().nocache())
+        self.assertGreater(len(persons), 2)
+        self.assertEqual(len(cache), 0)
+
+        # Too many rows to keep are streamed from the cursor
+        cache.max_rows = 2
+        free_cursors = len(db._cursors)
+        self.assertEqual(list(Person.get_where()), persons)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(db._cursors), max(free_cursors, 1))
+        self.assertEqual(list(Person.get_where().limit(2)), persons[:2])
+        self.assertEqual(len(cache), 1)
+        self.assertRaises(ValueError, dictorm.ResultCache, max_rows=-1)
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:  # pragma: no cover
+                self.fail('Timed out')
+            time.sleep(0.01)
+
+    def test_listen(self):
+        """
+        A listener evicts the cached rows of tables changed by another process.
+        """
+        writer, connect = self.get_parallel_db()
+        writer.conn.commit()
+        connect = connect or writer._connect_callable()
+        writer.notify = True
+        reader = dictorm.DictDB(connect(), result_cache=dictorm.ResultCache())
+        self.addCleanup(reader.conn.close)
+        listener = reader.listen(connect, interval=0.01)
+        self.addCleanup(listener.stop)
+
+        self.assertEqual(list(reader['person'].get_where()), [])
+        self.assertEqual(list(reader['car'].get_where()), [])
+        reader.conn.rollback()
+        self.assertEqual(len(reader.result_cache), 2)
+
+        bob = writer['person'](name='Bob').flush()
+        writer.conn.commit()
+        self.wait_for(lambda: 'person' not in reader.result_cache.tags)
+        self.assertEqual(list(reader['person'].get_where()), [bob])
+        reader.conn.rollback()
+
+        listener.stop()
+        self.assertFalse(listener.is_alive())
+        self.assertIsNone(listener.error)
+
+    def test_execute_hooks(self):
+        """
+        Every query is executed by DictDB.execute, which calls the before and after hooks.
+        """
+        before, after = [], []
+        self.db.before_execute.append(lambda e: before.append((e.table, e.operation, e.elapsed)))
+        self.db.after_execute.append(after.append)
+        stats = QueryStats()
+        self.db.after_execute.append(stats)
+
+        Person = self.db['person']
+        bob = Person(name='Bob').flush()
+        bob['name'] = 'Steve'
+        bob.flush()
+        self.assertEqual(list(Person.get_where()), [bob])
+        self.assertEqual(Person.count(), 1)
+        bob.delete()
+        self.db.refresh_tables()
+        self.assertRaises(Exception, list, Person.get_raw('SELECT * FROM no_such_table'))
+        self.conn.rollback()
+
+        operations = {(e.table, e.operation) for e in after}
+        self.assertTrue({('person', 'insert'), ('person', 'update'), ('person', 'select'),
+                         ('person', 'delete'), (None, 'introspect')} <= operations)
+        self.assertEqual(len(before), len(after))
+        self.assertTrue(all(elapsed is None for _, _, elapsed in before))
+        self.assertTrue(all(e.elapsed >= 0 for e in after))
+        self.assertIsNotNone(after[-1].error)
+
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot[('person', 'delete')]['count'], 1)
+        self.assertEqual(snapshot[('person', 'delete')]['rows'], 1)
+        self.assertEqual(snapshot[('person', 'select')]['errors'], 1)
+        self.assertEqual(sum(snapshot[('person', 'select')]['buckets']),
+                         snapshot[('person', 'select')]['count'])
+
+    def test_metrics(self):
+        """
+        A DictDB can count its queries, rows, references and bulk loads.
+        """
+        self.assertRaises(ValueError, self.db.metrics)
+        db = dictorm.DictDB(self.conn, metrics=True, result_cache=dictorm.ResultCache())
+        Person, Car = db['person'], db['car']
+        Person['car'] = Person['car_id'] == Car['id']
+        car = Car(name='Stratus').flush()
+        for i in range(3):
+            Person(name=f'Person{i}', car_id=car['id']).flush()
+        for person in Person.get_where():
+            person['car']
+        list(Person.get_where())
+
+        metrics = db.metrics()
+        self.assertEqual(metrics['queries'][('person', 'insert')]['count'], 3)
+        # Sqlite selects each inserted row
+        returning = 1 if db.kind == dictorm.DBKind.sqlite3 else 0
+        self.assertEqual(metrics['queries'][('person', 'select')]['count'], 1 + 3 * returning)
+        self.assertEqual(metrics['queries'][('car', 'select')]['count'], 1 + returning)
+        # Rows were fetched once, Dicts were created twice
+        self.assertEqual(metrics['rows_fetched'], {'person': 3, 'car': 1})
+        self.assertEqual(metrics['dicts_materialized'], {'person': 6, 'car': 3})
+        self.assertEqual(metrics['references_resolved'], {('person', 'car'): 3})
+        self.assertEqual(metrics['cache'], {'hits': 3, 'misses': 2, 'evictions': 0, 'entries': 2})
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'metrics.prom')
+        db.write_metrics(path)
+        with open(path) as fh:
+            text = fh.read()
+        self.assertIn('dictorm_queries_total{table="person",operation="insert"} 3\n', text)
+        self.assertIn('dictorm_references_resolved_total{table="person",reference="car"} 3\n', text)
+        self.assertEqual(os.listdir(directory.name), ['metrics.prom'])
+
+    def test_tracing(self):
+        """
+        Flushes, queries and references are traced, with a child span for each
+        query executed.
+        """
+        exporter = InMemorySpanExporter()
+        db = dictorm.DictDB(self.conn, tracer=Tracer(exporter))
+        Person, Car = db['person'], db['car']
+        Person['car'] = Person['car_id'] == Car['id']
+        car = Car(name='Stratus').flush()
+        bob = Person(name='Bob', car_id=car['id']).flush()
+        exporter.clear()
+
+        bob = Person.get_one(bob['id'])
+        bob['name'] = 'Jon'
+        bob.flush()
+        self.assertEqual(bob['car'], car)
+        bob.delete()
+
+        spans = exporter.get_finished_spans()
+        parents = [(i.name, i.parent.name if i.parent else None) for i in spans]
+        # Sqlite selects each updated row
+        returning = 1 if db.kind == dictorm.DBKind.sqlite3 else 0
+        self.assertEqual(parents, [
+            ('dictorm.execute', 'dictorm.results'),
+            ('dictorm.results', None),
+        ] + [('dictorm.execute', 'dictorm.flush')] * (1 + returning) + [
+            ('dictorm.flush', None),
+            ('dictorm.execute', 'dictorm.results'),
+            ('dictorm.results', 'dictorm.reference'),
+            ('dictorm.reference', None),
+            ('dictorm.execute', 'dictorm.delete'),
+            ('dictorm.delete', None),
+        ])
+        select, update = spans[0].attributes, spans[2].attributes
+        self.assertEqual(select['db.sql.table'], 'person')
+        self.assertEqual(select['db.operation'], 'select')
+        self.assertEqual(select['db.statement'], query_shape(Person.get_where(id=1).query.build()[0]))
+        self.assertEqual(update['db.operation'], 'update')
+        self.assertEqual(update['dictorm.rowcount'], 1)
+        self.assertEqual(spans[-3].attributes, {'db.sql.table': 'person', 'dictorm.reference': 'car'})
+
+        # A failed query is recorded by its span
+        exporter.clear()
+        self.assertRaises(Exception, db.execute, db.curs, 'SELECT * FROM no_such_table')
+        db.conn.rollback()
+        span, = exporter.get_finished_spans()
+        self.assertEqual(span.events[0][0], 'exception')
+
+    def test_profile(self):
+        """
+        A profile splits the time spent between the database and DictORM, and
+        totals the time of each query shape.
+        """
+        Person = self.db['person']
+        for i in range(5):
+            Person(name=f'Person{i}').flush()
+
+        with self.db.profile() as report:
+            persons = list(Person.get_where())
+            for person in persons:
+                Person.get_one(person['id'])
+        self.assertNotIn(report, self.db.after_execute)
+        self.assertIsNone(self.db._profile)
+        # Not profiled
+        list(Person.get_where())
+
+        self.assertEqual(set(report.seconds), set(PROFILE_CATEGORIES))
+        for category, seconds in report.seconds.items():
+            self.assertGreater(seconds, 0, category)
+        self.assertLess(sum(report.seconds.values()), report.elapsed)
+        top = report.top_shapes()
+        # Both shapes take microseconds, so their order isn't asserted
+        self.assertEqual(sorted((i['table'], i['operation'], i['count']) for i in top),
+                         [('person', 'select', 1), ('person', 'select', 5)])
+        self.assertEqual([i['seconds'] for i in top], sorted((i['seconds'] for i in top), reverse=True))
+        self.assertIn('Top query shapes:', report.summary())
+        self.assertRaises(ValueError, report.dictorm_functions)
+
+        with self.db.profile(cprofile=True) as report:
+            list(Person.get_where())
+        functions = [i['function'] for i in report.dictorm_functions(count=100)]
+        self.assertTrue(any('(__next__)' in i for i in functions), functions)
+        self.assertTrue(all(i.split(':')[0] in ('dictorm.py', 'pg.py', 'sqlite.py', 'instrument.py', 'cache.py',
+                                                'tracing.py') for i in functions), functions)
+
+    def test_memory_usage(self):
+        """
+        The memory of cached Dicts is estimated, and can be limited.
+        """
+        Person, Car = self.db['person'], self.db['car']
+        Person['car'] = Person['car_id'] == Car['id']
+        car = Car(name='Stratus').flush()
+        for i in range(10):
+            Person(name=f'Person{i}' * 10, car_id=car['id']).flush()
+
+        persons = Person.get_where()
+        self.assertEqual(persons.memory_usage(), deep_size([]))
+        next(persons)
+        one = persons.memory_usage()
+        list(persons)
+        self.assertGreater(persons.memory_usage(), one)
+        # Referenced rows are kept by the cached Dicts
+        before = persons.memory_usage()
+        for person in persons:
+            person['car']
+        self.assertGreater(persons.memory_usage(), before)
+        self.assertEqual(Person.memory_usage(), persons.memory_usage())
+        usage = self.db.memory_usage()
+        self.assertEqual(usage['tables']['person'], persons.memory_usage())
+        self.assertEqual(usage['total'], sum(usage['tables'].values()))
+        nocache = Person.get_where().nocache()
+        list(nocache)
+        self.assertEqual(Person.memory_usage(), persons.memory_usage())
+
+        # A completed generator executes its query again once it's evicted
+        Person.evict()
+        self.assertEqual(Person.memory_usage(), 0)
+        self.assertEqual(len(list(persons)), 10)
+
+        # Exceeding the limit evicts the cache of a generator that is in progress
+        self.conn.commit()
+        db = dictorm.DictDB(self.conn, memory_limit=1, result_cache=dictorm.ResultCache())
+        db.memory_check_interval = 3
+        persons = db['person'].get_where()
+        names = [i['name'] for i in persons]
+        self.assertEqual(len(names), 10)
+        self.assertEqual(persons.cache, [])
+        # An evicted generator can't be indexed, it gets all of its results when iterated again
+        self.assertRaises(dictorm.NoCache, persons.__getitem__, 0)
+        self.assertRaises(dictorm.NoCache, persons.__getitem__, slice(0, 2))
+        self.assertEqual([i['name'] for i in persons], names)
+        persons = db['person'].get_where()
+        for _ in range(5):
+            next(persons)
+        self.assertRaises(dictorm.NoCache, persons.__getitem__, 0)
+        self.assertEqual(len(list(persons)), 5)
+        self.assertEqual([i['name'] for i in persons], names)
+        self.assertEqual(db.result_cache.memory_usage(), 0)
+        self.assertEqual(db.memory_usage()['total'], 0)
+        self.assertFalse(db.enforce_memory_limit())
+
+        # The running estimate of a generator's Dicts is kept as they are created
+        db.memory_limit = 10 ** 9
+        persons = db['person'].get_where()
+        list(persons)
+        self.assertGreater(persons._bytes, 0)
+        self.assertAlmostEqual(persons._bytes / persons.memory_usage(), 1, places=1)
+        self.assertFalse(db.enforce_memory_limit())
+        db.memory_limit = 1
+        self.assertTrue(db.enforce_memory_limit())
+        self.assertEqual((persons._bytes, persons.cache), (0, []))
+
+    def test_slow_query_log(self):
+        """
+        Slow queries are logged by shape, with the plan of the slowest shapes.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'slow.log')
+        Person = self.db['person']
+        slow_log = self.db.log_slow_queries(path, threshold=0, sample_after=2, sample_rate=0,
+                                            explain_top=1)
+        for i in range(4):
+            Person.get_one(i)
+        self.assertEqual(Person.count(), 0)
+        slow_log.close()
+        self.assertNotIn(slow_log, self.db.after_execute)
+        Person.get_one(5)
+
+        with open(path) as fh:
+            entries = [json.loads(line) for line in fh]
+        get_one = [i for i in entries if i['shape'] == query_shape(Person.get_where(id=1).query.build()[0])]
+        self.assertEqual([i['count'] for i in get_one], [1, 2])
+        self.assertEqual(get_one[0]['table'], 'person')
+        self.assertEqual(get_one[0]['operation'], 'select')
+        self.assertIn('person', get_one[0]['plan'].lower())
+        self.assertIsNone(get_one[1]['plan'])
+        self.assertEqual(slow_log.shapes[get_one[0]['shape']]['count'], 4)
+        self.assertEqual(len(entries), 3)
+
+        # A query that can't be explained doesn't leak the borrowed cursor
+        free_cursors = len(self.db._cursors)
+        plan = slow_log.explain(QueryEvent('SELECT * FROM "no_such_table"', None, 'no_such_table', 'select'))
+        self.assertTrue(plan.startswith('Could not explain'))
+        self.assertEqual(len(self.db._cursors), max(free_cursors, 1))
+
+        # A cursor that can't be borrowed doesn't fail the query being logged
+        with mock.patch.object(self.db, 'borrow_cursor', side_effect=Exception('no cursor')):
+            plan = slow_log.explain(QueryEvent('SELECT 1', None, 'person', 'select'))
+        self.assertEqual(plan, 'Could not explain: no cursor')
+
+        # Lines can be written to a logger, no logger is kept after a log is closed
+        self.assertNotIn('dictorm.slow_queries', logging.Logger.manager.loggerDict)
+        logger = logging.getLogger('test_slow_queries')
+        with self.assertLogs(logger) as logs:
+            slow_log = self.db.log_slow_queries(logger=logger, threshold=0)
+            Person.get_one(1)
+            slow_log.close()
+        self.assertEqual(json.loads(logs.records[0].getMessage())['table'], 'person')
+        self.assertRaises(ValueError, self.db.log_slow_queries)
+
+    def test_detect_n_plus_one(self):
+        """
+        References gotten one row at a time are detected.
+        """
+        Person, Car = self.db['person'], self.db['car']
+        Person['car'] = Person['car_id'] == Car['id']
+        Person['subordinates'] = Person['id'].many(Person['manager_id'])
+        car = Car(name='Stratus').flush()
+        for i in range(4):
+            Person(name=f'Person{i}', car_id=car['id']).flush()
+
+        with self.db.detect_n_plus_one(threshold=3, action='raise') as detector:
+            persons = list(Person.get_where())
+            for person in persons[:3]:
+                person['car']
+            # The references of another line are counted separately
+            persons[3]['car']
+            self.assertEqual(detector.by_reference(), {('person', 'car'): 4})
+            # The cached reference isn't gotten again
+            persons[0]['car']
+            with self.assertRaises(NPlusOneError) as context:
+                for person in persons:
+                    person['subordinates']
+            self.assertIn('"subordinates" of Table("person")', str(context.exception))
+            self.assertIn(__file__, str(context.exception))
+
+            # References gotten in a batch aren't counted
+            with self.db.batch():
+                for person in Person.get_where():
+                    person['car']
+            self.assertEqual(detector.by_reference()[('person', 'car')], 4)
+
+        with self.assertWarns(NPlusOneWarning):
+            with self.db.detect_n_plus_one(threshold=1):
+                for person in Person.get_where():
+                    person['car']
+        self.assertRaises(ValueError, self.db.detect_n_plus_one(action='foo').__enter__)
+
+        # Nothing is counted outside of detect_n_plus_one
+        for person in Person.get_where():
+            person['car']
+        self.assertEqual(detector.by_reference()[('person', 'car')], 4)
+
+    def test_cursor_reuse(self):
+        """
+        A ResultsGenerator borrows a cursor when it is executed, and returns it once it has been
+        exhausted or closed.
+        """
+        Person = self.db['person']
+        bob, aly = map(lambda i: Person(name=i).flush(), ['Bob', 'Aly'])
+
+        persons = Person.get_where()
+        self.assertIsNone(persons.curs)
+        self.assertEqual(next(persons), bob)
+        curs = persons.curs
+        self.assertIsNotNone(curs)
+        self.assertEqual(list(persons), [aly])
+        self.assertIsNone(persons.curs)
+        self.assertEqual(list(persons), [bob, aly])
+
+        # The returned cursor is used by the next ResultsGenerator
+        persons = Person.get_where()
+        self.assertEqual(next(persons), bob)
+        self.assertIs(persons.curs, curs)
+
+        # A ResultsGenerator can be closed early
+        with Person.get_where() as other_persons:
+            self.assertEqual(next(other_persons), bob)
+            self.assertIsNot(other_persons.curs, curs)
+        self.assertIsNone(other_persons.curs)
+        self.assertRaises(StopIteration, next, other_persons)
+        self.assertEqual(other_persons.cache, [bob])
+        # Closing the other results didn't interfere with the first
+        self.assertEqual(next(persons), aly)
+
+        # Only some cursors are kept for reuse
+        many_persons = [Person.get_where() for _ in range(self.db.max_free_cursors + 2)]
+        for i in many_persons:
+            next(i)
+        for i in many_persons:
+            i.close()
+        self.assertEqual(len(self.db._cursors), self.db.max_free_cursors)
+
+    def get_prefetching_db(self):
+        """
+        Get a DictDB whose connection can be used by a prefetching thread.
+        """
+        return self.db
+
+    def test_prefetching(self):
+        """
+        A ResultsGenerator can fetch batches of rows in a background thread.
+        """
+        db = self.get_prefetching_db()
+        Person = db['person']
+        persons = [Person(name=f'Person{i}', other=i).flush() for i in range(25)]
+
+        results = Person.get_where().order_by('id ASC').prefetching(batches_ahead=2, batch_size=4)
+        self.assertEqual(list(results), persons)
+        self.assertIsNone(results.curs)
+        self.assertEqual(list(results), persons)
+        self.assertEqual(Person.get_where().prefetching().nocache().cache, [])
+        self.assertEqual(list(Person.get_where(Person['id'] < 0).prefetching()), [])
+
+        # The background thread stops when the results are closed early
+        with Person.get_where().order_by('id ASC').prefetching(batches_ahead=1, batch_size=1) as results:
+            self.assertEqual(next(results), persons[0])
+            thread = results._prefetcher.thread
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(results.curs)
+        self.assertRaises(StopIteration, next, results)
+
+        # Errors are raised by the consumer
+        results = Person.get_raw('SELECT * FROM no_such_table').prefetching()
+        self.assertRaises(Exception, next, results)
+        self.assertIsNone(results._prefetcher)
+        db.conn.rollback()
+
+        self.assertRaises(ValueError, Person.get_where().prefetching, batches_ahead=0)
+
+    def get_parallel_db(self):
+        """
+        Get a DictDB whose database can be connected to by worker processes, and the callable that
+        connects to it.
+        """
+        return self.db, partial(psycopg2.connect, **test_db_login)
+
+    def test_parallel_map(self):
+        """
+        A function can be called with every row using a pool of processes.
+        """
+        db, connect = self.get_parallel_db()
+        Person = db['person']
+        self.assertEqual(Person.parallel_map(double_other, workers=2, connect=connect, count_only=True), 0)
+        for i in range(50):
+            Person(name=f'Person{i}', other=i).flush()
+        db.conn.commit()
+
+        results = Person.parallel_map(double_other, workers=2, partitions=7, connect=connect)
+        self.assertEqual(sorted(results), [i * 2 for i in range(50)])
+        # Partitions may be wider than the table
+        results = Person.parallel_map(double_other, name='Person3', workers=2, connect=connect)
+        self.assertEqual(list(results), [6])
+        count = Person.parallel_map(double_other, Person['other'] >= 10, workers=2, partitions=3,
+                                    connect=connect, count_only=True)
+        self.assertEqual(count, 40)
+
+        self.assertRaises(dictorm.NoPrimaryKey, db['no_pk'].parallel_map, double_other, connect=connect)
+        self.assertRaises(dictorm.NoPrimaryKey, db['person_department'].parallel_map, double_other,
+                          connect=connect)
+
+    def test_parallel_load(self):
+        """
+        Many rows can be inserted in batches using many connections.
+        """
+        db, connect = self.get_parallel_db()
+        Person = db['person']
+        rows = ({'name': f'Person{i}', 'other': i} for i in range(105))
+        result = Person.parallel_load(rows, connections=3, batch_size=10, connect=connect)
+        self.assertEqual((result.inserted, result.batches, result.errors), (105, 11, []))
+        db.conn.rollback()
+        self.assertEqual(Person.count(), 105)
+        self.assertEqual(sorted(i['other'] for i in Person.get_where()), list(range(105)))
+
+        # A failed batch is reported, the other batches are committed
+        rows = [{'name': 'Good'}] * 10 + [{'name': 'Bad', 'foo': 'bar'}] + [{'name': 'Good'}] * 4
+        result = Person.parallel_load(rows, connections=2, batch_size=5, connect=connect)
+        self.assertEqual((result.inserted, result.batches), (10, 2))
+        (number, error), = result.errors
+        self.assertEqual(number, 2)
+        self.assertIsInstance(error, Exception)
+        db.conn.rollback()
+        self.assertEqual(Person.count(), 115)
+
+        # Nothing is committed if a batch fails in a single transaction
+        result = Person.parallel_load(rows, connections=1, batch_size=5, connect=connect,
+                                      single_transaction=True)
+        self.assertEqual((result.inserted, len(result.errors)), (0, 1))
+        db.conn.rollback()
+        self.assertEqual(Person.count(), 115)
+        result = Person.parallel_load(rows[:10], connections=1, batch_size=5, connect=connect,
+                                      single_transaction=True)
+        self.assertEqual((result.inserted, result.errors), (10, []))
+        db.conn.rollback()
+        self.assertEqual(Person.count(), 125)
+
+        # Each batch is inserted in chunks small enough for Sqlite's limit of query parameters
+        inserts = []
+        db.before_execute.append(lambda e: e.operation == 'insert' and inserts.append(e))
+        rows = [{'name': 'Chunked', 'other': i} for i in range(1000)]
+        result = Person.parallel_load(rows, connections=1, batch_size=1000, connect=connect)
+        db.before_execute.clear()
+        self.assertEqual((result.inserted, result.batches, len(inserts)), (1000, 1, 3))
+        db.conn.rollback()
+        self.assertEqual(Person.count(), 1125)
+
+        # The loading threads are stopped if the rows can't be gotten
+        def broken_rows():
+            yield from rows[:20]
+            raise ValueError('broken')
+
+        threads = threading.active_count()
+        self.assertRaises(ValueError, Person.parallel_load, broken_rows(), connections=1,
+                          batch_size=1, connect=connect, single_transaction=True)
+        self.assertEqual(threading.active_count(), threads)
+        db.conn.rollback()
+        self.assertEqual(Person.count(), 1125)
+
+        # A connection which doesn't finish in time rolls back the single transaction
+        with mock.patch.object(threading.Barrier, 'wait', side_effect=threading.BrokenBarrierError):
+            result = Person.parallel_load(rows[:10], connections=1, batch_size=5, connect=connect,
+                                          single_transaction=True)
+        self.assertEqual(result.inserted, 0)
+        self.assertEqual([number for number, _ in result.errors], [None])
+        db.conn.rollback()
+        self.assertEqual(Person.count(), 1125)
+
+    def get_pool(self):
+        return ThreadedConnectionPool(1, 4, **test_db_login)
+
+    def test_pool(self):
+        """
+        A DictDB created with a pool can be shared by many threads, each thread uses its own
+        connection and cursor.
+        """
+        pool = self.get_pool()
+        db = dictorm.DictDB(pool)
+        Person = db['person']
+        Person['manager'] = Person['manager_id'] == Person['id']
+        # The connection used to introspect the tables was returned
+        self.assertIsNone(getattr(db._local, 'conn', None))
+
+        bob = Person(name='Bob').flush()
+        self.assertIs(bob._curs, db.curs)
+        main_curs = db.curs
+        db.conn.commit()
+        barrier = threading.Barrier(4)
+
+        def work(i):
+            with db.transaction(commit=True):
+                # All threads have checked out a connection at once
+                barrier.wait(timeout=5)
+                person = Person(name=f'Person{i}', manager_id=bob['id']).flush()
+                self.assertIsNot(person._curs, main_curs)
+                return Person.get_one(person['id'])['manager']['name']
+
+        with ThreadPoolExecutor(3) as executor:
+            futures = [executor.submit(work, i) for i in range(3)]
+            barrier.wait(timeout=5)
+            self.assertEqual([i.result() for i in futures], ['Bob'] * 3)
+
+        self.assertEqual(Person.count(), 4)
+        db.release()
+        self.assertIsNone(getattr(db._local, 'conn', None))
+        pool.closeall()
+
+    def test_pool_release(self):
+        """
+        Releasing a connection closes its cursors and stops the results still reading from it, a
+        thread's connection is released when the thread exits.
+        """
+        pool = self.get_pool()
+        db = dictorm.DictDB(pool)
+        Person = db['person']
+        with db.transaction(commit=True):
+            for i in range(3):
+                Person(name=f'Person{i}').flush()
+
+        with db.transaction():
+            curs = db.curs
+            persons = Person.get_where()
+            self.assertEqual(next(persons)['name'], 'Person0')
+            completed = Person.get_where()
+            self.assertEqual(len(list(completed)), 3)
+        self.assertRaises(Exception, curs.execute, 'SELECT 1')
+        # The results which weren't all gotten can't be read from a connection another thread
+        # may be using
+        self.assertRaises(dictorm.ConnectionReleased, next, persons)
+        self.assertRaises(dictorm.ConnectionReleased, list, persons)
+        self.assertEqual([i['name'] for i in completed], ['Person0', 'Person1', 'Person2'])
+
+        def work():
+            self.assertEqual(Person.count(), 3)
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        # The exited thread's connection was returned, so all connections can be checked out
+        held = [pool.getconn() for _ in range(4)]
+        for conn in held:
+            pool.putconn(conn)
+        pool.closeall()
+
+    def test_lazy(self):
+        """
+        A lazy DictDB lists all tables, but only creates a Table when it is first gotten.
+        """
+        db = dictorm.DictDB(self.conn, lazy=True)
+        self.assertEqual(set(db.keys()), set(self.db.keys()))
+        self.assertTrue(all(dict.__getitem__(db, i) is None for i in db))
+
+        Person = db['person']
+        self.assertIsInstance(Person, dictorm.Table)
+        self.assertEqual(Person.pks, ['id'])
+        self.assertEqual(sorted(Person.columns),
+                         ['car_id', 'id', 'manager_id', 'name', 'other'])
+        self.assertIs(db['person'], Person)
+        # Only the person table was created
+        self.assertIsNone(dict.__getitem__(db, 'car'))
+        self.assertIs(db.get('person'), Person)
+        self.assertIsNone(db.get('foo'))
+        self.assertRaises(KeyError, db.__getitem__, 'foo')
+
+        bob = Person(name='Bob').flush()
+        self.assertEqual(db['person'].get_one(bob['id']), bob)
+
+        # All tables are created when they are all needed
+        self.assertTrue(all(isinstance(i, dictorm.Table) for i in db.values()))
+        self.assertEqual(dict(db.items())['person'], Person)
+        self.assertIsInstance(db.values(), type({}.values()))
+        self.assertIsInstance(db.items(), type({}.items()))
+
+        # A Table is only built by one of the threads which get it at once
+        db = dictorm.DictDB(self.conn, lazy=True)
+        schema = db._introspect(['car'])
+        calls = []
+
+        def introspect(names=None):
+            calls.append(names)
+            time.sleep(0.05)
+            return schema
+
+        with mock.patch.object(db, '_introspect', introspect):
+            with ThreadPoolExecutor(4) as executor:
+                cars = list(executor.map(lambda _: db['car'], range(4)))
+        self.assertEqual(calls, [['car']])
+        self.assertTrue(all(i is cars[0] for i in cars))
+
+    def test_refresh_changed_only(self):
+        """
+        Only the tables that have changed are refreshed, existing Tables are kept.
+        """
+        Person, Car = self.db['person'], self.db['car']
+        Person['car'] = Person['car_id'] == Car['id']
+        Person.order_by = 'name ASC'
+        Car.pks = ['license_plate']
+        self.assertNotIn('nickname', Person.updateable_column_names)
+        car_columns_info = Car.columns_info
+
+        lazy_db = dictorm.DictDB(self.conn, lazy=True)
+        LazyPerson = lazy_db['person']
+
+        self.curs.execute('CREATE TABLE garage (id INTEGER PRIMARY KEY, name TEXT)')
+        self.curs.execute('ALTER TABLE person ADD COLUMN nickname TEXT')
+        self.curs.execute('DROP TABLE station')
+        self.conn.commit()
+        self.db.refresh_tables(changed_only=True)
+
+        self.assertIs(self.db['person'], Person)
+        self.assertIs(self.db['car'], Car)
+        self.assertEqual(list(Person.refs), ['car'])
+        self.assertEqual(Person.order_by, 'name ASC')
+        self.assertEqual(Car.pks, ['license_plate'])
+        # Unchanged column info is kept
+        self.assertIs(Car.columns_info, car_columns_info)
+        self.assertIn('nickname', Person.columns)
+        self.assertIn('nickname', Person.updateable_column_names)
+        self.assertEqual(self.db['garage'].pks, ['id'])
+        self.assertNotIn('station', self.db)
+
+        car = Car(name='Stratus').flush()
+        bob = Person(name='Bob', nickname='B', car_id=car['id']).flush()
+        self.assertEqual(Person.get_one(nickname='B'), bob)
+        self.assertEqual(bob['car'], car)
+
+        lazy_db.refresh_tables(changed_only=True)
+        self.assertIs(lazy_db['person'], LazyPerson)
+        self.assertIn('nickname', LazyPerson.columns)
+        self.assertIn('garage', lazy_db)
+        self.assertNotIn('station', lazy_db)
+
+    def test_schema_cache(self):
+        """
+        A DictDB can load its schema from a cache file, the cache is rewritten when the schema
+        changes.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'schema.json')
+            db = dictorm.DictDB(self.conn, schema_cache=path)
+            with open(path) as fh:
+                cache = json.load(fh)
+            self.assertEqual(len(cache), 1)
+            entry, = cache.values()
+            self.assertEqual(set(entry['tables']), set(self.db))
+
+            # The schema is loaded from the cache
+            entry['tables']['person']['pks'] = ['name']
+            with open(path, 'w') as fh:
+                json.dump(cache, fh)
+            db = dictorm.DictDB(self.conn, schema_cache=path)
+            self.assertEqual(db['person'].pks, ['name'])
+            self.assertEqual(sorted(db['person'].columns),
+                             ['car_id', 'id', 'manager_id', 'name', 'other'])
+            self.assertEqual(db['person'].columns_info, self.db['person'].columns_info)
+
+            # A changed schema is introspected again
+            self.curs.execute('ALTER TABLE person ADD COLUMN nickname TEXT')
+            self.conn.commit()
+            db = dictorm.DictDB(self.conn, schema_cache=path, lazy=True)
+            self.assertEqual(db['person'].pks, ['id'])
+            self.assertIn('nickname', db['person'].columns)
+            with open(path) as fh:
+                cache = json.load(fh)
+            entry, = cache.values()
+            self.assertEqual(entry['tables']['person']['pks'], ['id'])
+
+    def test_introspection_queries(self):
+        """
+        The columns and primary keys of all tables are gotten using two queries, not a query per
+        table.
+        """
+        executed = []
+        original_execute = self.curs.execute
+
+        def execute(*a, **kw):
+            executed.append(a[0])
+            return original_execute(*a, **kw)
+
+        try:
+            self.curs.execute = execute
+            self.db.refresh_tables()
+            self.assertEqual(len(executed), 2)
+
+            Person = self.db['person']
+            self.assertEqual(Person.pks, ['id'])
+            self.assertEqual(self.db['person_department'].pks, ['person_id', 'department_id'])
+            self.assertEqual(self.db['no_pk'].pks, [])
+            self.assertEqual(sorted(Person.columns),
+                             ['car_id', 'id', 'manager_id', 'name', 'other'])
+            # Columns were already gotten
+            self.assertEqual(len(executed), 2)
+        finally:
+            self.curs.execute = original_execute
+
+    def test_composite_pk_order(self):
+        """
+        The columns of a primary key are in the order the key was declared.
+        """
+        self.curs.execute('CREATE TABLE reversed_pk (a INTEGER, b INTEGER, PRIMARY KEY (b, a))')
+        self.db.refresh_tables()
+        table = self.db['reversed_pk']
+        self.assertEqual(table.pks, ['b', 'a'])
+        table._refresh_pks()
+        self.assertEqual(table.pks, ['b', 'a'])
+
 
 class TestPostgres12(ExtraTestMethods, unittest.TestCase):
 
@@ -1388,6 +2368,41 @@ class TestPostgres12(ExtraTestMethods, unittest.TestCase):
         self.assertEqual(steve_car['area'], 12)
 
 
+SQLITE_TABLES_SQL = '''
+CREATE TABLE person (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    other INTEGER,
+    manager_id INTEGER REFERENCES person(id)
+);
+CREATE TABLE department (
+    id INTEGER PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE person_department (
+    person_id INTEGER REFERENCES person(id),
+    department_id INTEGER REFERENCES department(id),
+    PRIMARY KEY (person_id, department_id)
+);
+CREATE TABLE car (
+    id INTEGER PRIMARY KEY,
+    license_plate TEXT,
+    name TEXT,
+    person_id INTEGER REFERENCES person(id)
+);
+ALTER TABLE person ADD COLUMN car_id INTEGER REFERENCES car(id);
+CREATE TABLE no_pk (foo TEXT);
+CREATE TABLE station (
+    person_id INTEGER
+);
+CREATE TABLE possession (
+    id INTEGER PRIMARY KEY,
+    person_id INTEGER,
+    description JSON
+);
+'''
+
+
 class SqliteTestBase(object):
 
     def setUp(self):
@@ -1395,39 +2410,7 @@ class SqliteTestBase(object):
         self.db = dictorm.DictDB(self.conn)
         self.curs = self.db.curs
         self.tearDown()
-        self.curs.executescript('''
-        CREATE TABLE person (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            other INTEGER,
-            manager_id INTEGER REFERENCES person(id)
-        );
-        CREATE TABLE department (
-            id INTEGER PRIMARY KEY,
-            name TEXT
-        );
-        CREATE TABLE person_department (
-            person_id INTEGER REFERENCES person(id),
-            department_id INTEGER REFERENCES department(id),
-            PRIMARY KEY (person_id, department_id)
-        );
-        CREATE TABLE car (
-            id INTEGER PRIMARY KEY,
-            license_plate TEXT,
-            name TEXT,
-            person_id INTEGER REFERENCES person(id)
-        );
-        ALTER TABLE person ADD COLUMN car_id INTEGER REFERENCES car(id);
-        CREATE TABLE no_pk (foo TEXT);
-        CREATE TABLE station (
-            person_id INTEGER
-        );
-        CREATE TABLE possession (
-            id INTEGER PRIMARY KEY,
-            person_id INTEGER,
-            description JSON
-        );
-        ''')
+        self.curs.executescript(SQLITE_TABLES_SQL)
         self.conn.commit()
         self.db.refresh_tables()
 
@@ -1548,6 +2531,114 @@ class TestSqlite(SqliteTestBase, TestPostgresql):
         except sqlite3.OperationalError as e:
             pass
 
+    def get_prefetching_db(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        conn.executescript(SQLITE_TABLES_SQL)
+        return dictorm.DictDB(conn)
+
+    def test_prefetching_same_thread(self):
+        """
+        The error raised by a connection which can't be used by the prefetching thread is raised
+        by the consumer.
+        """
+        Person = self.db['person']
+        self.assertRaises(sqlite3.ProgrammingError, list, Person.get_where().prefetching())
+
+    def get_parallel_db(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        conn = sqlite3.connect(os.path.join(directory.name, 'test.db'))
+        conn.executescript(SQLITE_TABLES_SQL)
+        # Sqlite database files are connected to automatically
+        return dictorm.DictDB(conn), None
+
+    def test_parallel_map_memory(self):
+        Person = self.db['person']
+        self.assertRaises(ValueError, Person.parallel_map, double_other)
+
+    def get_pool(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'test.db')
+        conn = sqlite3.connect(path)
+        conn.executescript('''
+        CREATE TABLE person (id INTEGER PRIMARY KEY, name TEXT, manager_id INTEGER);
+        ''')
+        conn.close()
+        pool = dictorm.SqlitePool(path, maxconn=4, timeout=10)
+        self.addCleanup(pool.closeall)
+        return pool
+
+    def test_sqlite_pool(self):
+        pool = dictorm.SqlitePool(':memory:', maxconn=2)
+        conn1, conn2 = pool.getconn(), pool.getconn()
+        self.assertRaises(dictorm.PoolError, pool.getconn)
+        pool.putconn(conn1)
+        self.assertIs(pool.getconn(), conn1)
+        pool.putconn(conn2, close=True)
+        self.assertIsNot(pool.getconn(), conn2)
+        pool.closeall()
+
+    def test_schema_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.conn = sqlite3.connect(os.path.join(directory, 'test.db'))
+            self.conn.executescript('''
+            CREATE TABLE person (id INTEGER PRIMARY KEY, name TEXT, other INTEGER,
+                manager_id INTEGER, car_id INTEGER);
+            CREATE TABLE car (id INTEGER PRIMARY KEY);
+            ''')
+            self.db = dictorm.DictDB(self.conn)
+            self.curs = self.db.curs
+            super().test_schema_cache()
+
+            # Only the identity and fingerprint are queried when the cache is fresh
+            path = os.path.join(directory, 'schema.json')
+            dictorm.DictDB(self.conn, schema_cache=path)
+            executed = []
+            self.conn.set_trace_callback(executed.append)
+            dictorm.DictDB(self.conn, schema_cache=path)
+            self.assertEqual(executed, ['PRAGMA database_list', 'PRAGMA schema_version'])
+
+        # An in-memory database is not cached
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'schema.json')
+            db = dictorm.DictDB(sqlite3.connect(':memory:'), schema_cache=path)
+            self.assertFalse(os.path.exists(path))
+
+    def test_introspection_queries(self):
+        """
+        The columns and primary keys of all tables are gotten using a single query.
+        """
+        executed = []
+        # Statements run internally by pragma_table_info are prefixed with a comment
+        self.conn.set_trace_callback(lambda i: i.startswith('--') or executed.append(i))
+        try:
+            self.db.refresh_tables()
+            self.assertEqual(len(executed), 1)
+
+            Person = self.db['person']
+            self.assertEqual(Person.pks, ['id'])
+            self.assertEqual(self.db['person_department'].pks, ['person_id', 'department_id'])
+            self.assertEqual(self.db['no_pk'].pks, [])
+            self.assertEqual(sorted(Person.columns),
+                             ['car_id', 'id', 'manager_id', 'name', 'other'])
+            self.assertEqual(Person.columns_info, [dict(i) for i in self.conn.execute('PRAGMA TABLE_INFO(person)')])
+            # Only the PRAGMA above was executed
+            self.assertEqual(len(executed), 2)
+        finally:
+            self.conn.set_trace_callback(None)
+
+    def test_introspection_fallback(self):
+        """
+        Sqlite older than 3.16 introspects each table using PRAGMA table_info.
+        """
+        with mock.patch('dictorm.dictorm.PRAGMA_TABLE_INFO', False):
+            self.assertRaises(ValueError, dictorm.dictorm.schema_queries, dictorm.DBKind.sqlite3)
+            schema = self.db._query_schema()
+            self.assertEqual(self.db._query_schema(['person']), {'person': schema['person']})
+        self.assertEqual(schema, self.db._query_schema())
+        self.assertEqual(schema['person_department'][1], ['person_id', 'department_id'])
+
     # These tests are inherited from Postgres, but they don't function for Sqlite
     test_any = None
     test_columns_property = None
@@ -0,0 +1,161 @@
+import threading
+import unittest
+
+import sys
+
+from dictorm.instrument import LATENCY_BUCKETS, Metrics, QueryEvent, QueryStats, deep_size, estimate_size
+from dictorm.instrument import operation_of, query_shape
+from dictorm.instrument import render_prometheus
+
+
+class TestInstrument(unittest.TestCase):
+
+    def test_operation_of(self):
+        self.assertEqual(operation_of('SELECT * FROM "person"'), 'select')
+        self.assertEqual(operation_of('  insert INTO "person" DEFAULT VALUES'), 'insert')
+        self.assertEqual(operation_of('UPDATE "person" SET "name"=%s'), 'update')
+        self.assertEqual(operation_of('DELETE FROM "person"'), 'delete')
+        self.assertEqual(operation_of('PRAGMA schema_version'), 'other')
+        self.assertEqual(operation_of(''), 'other')
+
+    def test_query_shape(self):
+        self.assertEqual(query_shape('SELECT * FROM "person" WHERE "id"=%s'),
+                         'SELECT * FROM "person" WHERE "id"=%s')
+        self.assertEqual(query_shape('SELECT * FROM "person" WHERE "id" IN (?, ?, ?) LIMIT 10'),
+                         'SELECT * FROM "person" WHERE "id" IN (...) LIMIT ?')
+        self.assertEqual(query_shape("SELECT *\n  FROM person WHERE name='O''Brien' AND id=3.5"),
+                         'SELECT * FROM person WHERE name=? AND id=?')
+        self.assertEqual(query_shape('SELECT * FROM "person2" WHERE "id" = ANY(%s)'),
+                         'SELECT * FROM "person2" WHERE "id" = ANY(%s)')
+
+    def test_deep_size(self):
+        self.assertEqual(deep_size('a'), sys.getsizeof('a'))
+        value = 'x' * 1000
+        rows = [{'name': value}, {'name': value}]
+        # The shared value is only counted once
+        self.assertLess(deep_size(rows), 2 * sys.getsizeof(value))
+        self.assertGreater(deep_size(rows), sys.getsizeof(value))
+        seen = set()
+        first = deep_size(rows[0], seen)
+        self.assertLess(deep_size(rows[1], seen), first - 1000)
+        # Cycles are counted once
+        cycle = []
+        cycle.append(cycle)
+        self.assertEqual(deep_size(cycle), sys.getsizeof(cycle))
+
+    def test_estimate_size(self):
+        rows = [{'name': f'person{i:04}'} for i in range(1000)]
+        self.assertEqual(estimate_size(rows[:10]), deep_size(rows[:10]))
+        # Evenly sized rows are estimated from a sample, shared keys are counted for each row
+        self.assertGreaterEqual(estimate_size(rows), deep_size(rows))
+        self.assertLess(estimate_size(rows), 1.5 * deep_size(rows))
+        self.assertEqual(estimate_size([]), deep_size([]))
+
+    def test_stats(self):
+        stats = QueryStats()
+        for elapsed, rowcount in ((0.0001, 3), (0.003, -1), (20, 1)):
+            event = QueryEvent('SELECT * FROM "person"', [], 'person', 'select')
+            event.elapsed, event.rowcount = elapsed, rowcount
+            stats(event)
+        event = QueryEvent('INSERT INTO "person" DEFAULT VALUES', [], 'person', 'insert')
+        event.elapsed, event.rowcount, event.error = 0.01, -1, ValueError()
+        stats(event)
+
+        snapshot = stats.snapshot()
+        select = snapshot[('person', 'select')]
+        self.assertEqual((select['count'], select['errors'], select['rows']), (3, 0, 4))
+        self.assertAlmostEqual(select['seconds'], 20.0031)
+        buckets = [0] * len(LATENCY_BUCKETS)
+        buckets[0] = buckets[3] = buckets[-1] = 1
+        self.assertEqual(select['buckets'], buckets)
+        insert = snapshot[('person', 'insert')]
+        self.assertEqual((insert['count'], insert['errors'], insert['rows']), (1, 1, 0))
+
+        # The snapshot is a copy
+        select['buckets'][0] = 10
+        self.assertEqual(stats.snapshot()[('person', 'select')]['buckets'][0], 1)
+
+        # Snapshots of other stats can be added
+        other = QueryStats()
+        other.merge(snapshot)
+        other.merge(stats.snapshot())
+        merged = other.snapshot()[('person', 'select')]
+        self.assertEqual((merged['count'], merged['rows'], merged['buckets'][0]), (6, 8, 11))
+        stats.reset()
+        self.assertEqual(stats.snapshot(), {})
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_threads(self):
+        """
+        Each thread counts separately, a snapshot adds up all threads.
+        """
+        metrics = Metrics()
+
+        def work():
+            event = QueryEvent('SELECT * FROM "person"', [], 'person', 'select')
+            event.elapsed, event.rowcount = 0.002, 2
+            for _ in range(10):
+                metrics(event)
+                metrics.rows_fetched('person', 2)
+                metrics.dicts_materialized('person', 2)
+            metrics.reference_resolved('person', 'car')
+            metrics.bulk_loaded('car', 100, 0.5)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The counters of exited threads were added up, they aren't kept
+        self.assertEqual(metrics.threads, [])
+
+        snapshot = metrics.snapshot()
+        select = snapshot['queries'][('person', 'select')]
+        self.assertEqual((select['count'], select['errors']), (40, 0))
+        self.assertAlmostEqual(select['seconds'], 0.08)
+        self.assertEqual(sum(select['buckets']), 40)
+        self.assertEqual(snapshot['rows_fetched'], {'person': 80})
+        self.assertEqual(snapshot['dicts_materialized'], {'person': 80})
+        self.assertEqual(snapshot['references_resolved'], {('person', 'car'): 4})
+        self.assertEqual(snapshot['bulk_load_rows'], {'car': 400})
+        self.assertEqual(snapshot['bulk_load_seconds'], {'car': 2.0})
+
+        # Living threads are counted too
+        work()
+        self.assertEqual(len(metrics.threads), 1)
+        self.assertEqual(metrics.snapshot()['queries'][('person', 'select')]['count'], 50)
+
+    def test_render_prometheus(self):
+        metrics = Metrics()
+        event = QueryEvent('SELECT * FROM "person"', [], 'per"son', 'select')
+        event.elapsed, event.rowcount = 0.002, 2
+        metrics(event)
+        event = QueryEvent('PRAGMA schema_version', None, None, 'introspect')
+        event.elapsed, event.rowcount, event.error = 20, -1, ValueError()
+        metrics(event)
+        metrics.rows_fetched('per"son', 2)
+        snapshot = metrics.snapshot()
+        snapshot['cache'] = {'hits': 1, 'misses': 2, 'evictions': 0, 'entries': 2}
+
+        text = render_prometheus(snapshot)
+        lines = text.splitlines()
+        self.assertIn('# TYPE dictorm_queries_total counter', lines)
+        self.assertIn('dictorm_queries_total{table="per\\"son",operation="select"} 1', lines)
+        self.assertIn('dictorm_query_errors_total{table="",operation="introspect"} 1', lines)
+        self.assertIn('dictorm_query_duration_seconds_bucket{table="per\\"son",operation="select",le="0.001"} 0',
+                      lines)
+        self.assertIn('dictorm_query_duration_seconds_bucket{table="per\\"son",operation="select",le="0.0025"} 1',
+                      lines)
+        self.assertIn('dictorm_query_duration_seconds_bucket{table="",operation="introspect",le="+Inf"} 1',
+                      lines)
+        self.assertIn('dictorm_query_duration_seconds_count{table="",operation="introspect"} 1', lines)
+        self.assertIn('dictorm_rows_fetched_total{table="per\\"son"} 2', lines)
+        self.assertIn('dictorm_cache_misses_total 2', lines)
+        self.assertIn('dictorm_cache_entries 2', lines)
+        self.assertTrue(text.endswith('\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
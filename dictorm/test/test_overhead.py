@@ -0,0 +1,43 @@
+import os
+import unittest
+
+from benchmarks.micro import BUDGETS, MICRO_BENCHMARKS, create_db, measure
+from dictorm.pg import set_sort_keys
+
+set_sort_keys(True)
+
+
+class TestOverhead(unittest.TestCase):
+    """
+    Fail when an operation adds more overhead than its budget.  Budgets can be
+    scaled using DICTORM_OVERHEAD_SCALE, see benchmarks.micro.
+
+    Timings are meaningless under a tracer (such as coverage), so the budgets
+    are only enforced when DICTORM_OVERHEAD_BUDGETS is set.
+    """
+
+    @unittest.skipUnless(os.environ.get('DICTORM_OVERHEAD_BUDGETS'), 'DICTORM_OVERHEAD_BUDGETS is not set')
+    def test_budgets(self):
+        self.assertEqual(set(BUDGETS), set(MICRO_BENCHMARKS))
+        for result in measure(number=2000, repeat=3):
+            with self.subTest(result['name']):
+                self.assertLessEqual(result['overhead'], result['budget'],
+                                     '{name} adds {overhead:.2f}us, its budget is {budget:.2f}us'.format(**result))
+
+    def test_equivalent(self):
+        """
+        Each operation gets the same result as its raw equivalent.
+        """
+        db = create_db()
+        for name in ('select_build', 'insert_build', 'update_build', 'operator_iter', 'get_one'):
+            dictorm, raw = MICRO_BENCHMARKS[name](db)
+            with self.subTest(name):
+                self.assertEqual(_plain(dictorm()), _plain(raw()))
+
+
+def _plain(result):
+    if isinstance(result, tuple):
+        return tuple(_plain(i) for i in result)
+    if isinstance(result, dict):
+        return dict(result)
+    return result
@@ -1,6 +1,6 @@
 import unittest
 
-from dictorm.pg import Select, Insert, Update, Delete, Or, And, Column, set_sort_keys
+from dictorm.pg import Select, Insert, BulkInsert, Update, Delete, Or, And, Column, set_sort_keys
 
 
 class PersonTable(object):
@@ -242,6 +242,13 @@ class TestInsert(unittest.TestCase):
                           ['Bob', ])
                          )
 
+    def test_bulk(self):
+        q = BulkInsert('some_table', [{'name': 'Bob', 'id': 1}, {'name': 'Alice', 'id': 2}])
+        self.assertEqual(q.build(),
+                         ('INSERT INTO "some_table" ("id", "name") VALUES (%s, %s), (%s, %s)',
+                          [1, 'Bob', 2, 'Alice'])
+                         )
+
 
 class TestUpdate(unittest.TestCase):
 
@@ -1,7 +1,7 @@
 import unittest
 
 from dictorm.pg import set_sort_keys
-from dictorm.sqlite import Select, Insert, Update, And, Column
+from dictorm.sqlite import Select, Insert, BulkInsert, Update, And, Column
 
 
 class PersonTable(object):
@@ -28,6 +28,12 @@ class TestSqlite(unittest.TestCase):
         self.assertEqual(str(Person['name'] <= 3), '"name"<=?')
         self.assertEqual(str(Person['name'] != 3), '"name"!=?')
 
+    def test_in(self):
+        q = Select('whatever', Person['id'].In([1, 2, 3]))
+        self.assertEqual(q.build(), ('SELECT * FROM "whatever" WHERE "id" IN (?, ?, ?)', [1, 2, 3]))
+        q = Select('whatever', And(Person['name'] == 'foo', Person['id'].In((4,))))
+        self.assertEqual(q.build(), ('SELECT * FROM "whatever" WHERE "name"=? AND "id" IN (?)', ['foo', 4]))
+
     def test_insert(self):
         self.assertEqual(str(Insert('whatever', name='foo')),
                          'INSERT INTO "whatever" ("name") VALUES (?)')
@@ -43,6 +49,12 @@ class TestSqlite(unittest.TestCase):
                              ('SELECT foo FROM "whatever" WHERE "rowid" = last_insert_rowid()', [])
                          ])
 
+    def test_bulk_insert(self):
+        q = BulkInsert('whatever', [{'name': 'foo', 'foo': 3}, {'name': 'bar', 'foo': 4}])
+        self.assertEqual(q.build(),
+                         ('INSERT INTO "whatever" ("foo", "name") VALUES (?, ?), (?, ?)',
+                          [3, 'foo', 4, 'bar']))
+
     def test_update(self):
         q = Update('whatever', foo='bar').where(
             And(Person['name'] == 'Steve', Person['id'] == 1)
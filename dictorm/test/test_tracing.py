@@ -0,0 +1,62 @@
+import threading
+import unittest
+
+from dictorm.tracing import NO_SPAN, InMemorySpanExporter, Tracer
+
+
+class TestTracer(unittest.TestCase):
+
+    def test_nested_spans(self):
+        exporter = InMemorySpanExporter()
+        tracer = Tracer(exporter)
+        with tracer.start_as_current_span('outer', attributes={'a': 1}) as outer:
+            with tracer.start_as_current_span('inner') as inner:
+                inner.set_attribute('b', 2)
+                self.assertIs(tracer.current_span(), inner)
+            self.assertIs(tracer.current_span(), outer)
+        self.assertIsNone(tracer.current_span())
+
+        self.assertEqual([i.name for i in exporter.get_finished_spans()], ['inner', 'outer'])
+        self.assertIs(inner.parent, outer)
+        self.assertIsNone(outer.parent)
+        self.assertEqual(outer.attributes, {'a': 1})
+        self.assertEqual(inner.attributes, {'b': 2})
+        self.assertFalse(outer.is_recording())
+        self.assertGreaterEqual(outer.duration, inner.duration)
+
+        exporter.clear()
+        self.assertEqual(exporter.get_finished_spans(), ())
+
+    def test_exception(self):
+        tracer = Tracer()
+        with self.assertRaises(ValueError):
+            with tracer.start_as_current_span('failing'):
+                raise ValueError('oops')
+        span, = tracer.exporter.get_finished_spans()
+        self.assertEqual(span.events, [('exception', {'exception.type': 'ValueError',
+                                                      'exception.message': 'oops'})])
+        self.assertIsNone(tracer.current_span())
+
+    def test_threads(self):
+        """
+        Each thread has its own current span.
+        """
+        tracer = Tracer()
+
+        def traced():
+            with tracer.start_as_current_span('thread'):
+                pass
+
+        with tracer.start_as_current_span('main'):
+            thread = threading.Thread(target=traced)
+            thread.start()
+            thread.join()
+        spans = {i.name: i for i in tracer.exporter.get_finished_spans()}
+        self.assertIsNone(spans['thread'].parent)
+        self.assertIsNone(spans['main'].parent)
+
+    def test_no_span(self):
+        with NO_SPAN as span:
+            span.set_attribute('a', 1)
+            span.record_exception(ValueError())
+        self.assertIs(span, NO_SPAN)
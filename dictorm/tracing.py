@@ -0,0 +1,154 @@
+"""
+Trace the operations of a DictDB.  A DictDB provided with a tracer wraps each
+Dict flush and delete, each ResultsGenerator query, each reference that is
+gotten and each parallel load in a span.  Every query executed within one of
+those operations is a child span, with the table, operation, rowcount and
+shape of the query as attributes.  (The threads of a parallel load have their
+own current spans, the queries they execute aren't children of the load's span.)
+
+The tracer can be an OpenTelemetry tracer, but OpenTelemetry isn't required:
+
+>>> from opentelemetry import trace
+>>> db = DictDB(your_db_connection, tracer=trace.get_tracer('dictorm'))
+
+This module's Tracer keeps finished spans in an InMemorySpanExporter, which is
+useful in tests:
+
+>>> exporter = InMemorySpanExporter()
+>>> db = DictDB(your_db_connection, tracer=Tracer(exporter))
+>>> Person(name='Bob').flush()
+>>> [(span.name, span.parent.name if span.parent else None) for span in exporter.get_finished_spans()]
+[('dictorm.execute', 'dictorm.flush'), ('dictorm.flush', None)]
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+__all__ = [
+    'InMemorySpanExporter',
+    'NO_SPAN',
+    'Span',
+    'Tracer',
+]
+
+
+class _NoSpan:
+    """
+    The span of an operation which isn't being traced.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def record_exception(self, exception: BaseException):
+        pass
+
+
+# Used in place of a span when a DictDB has no tracer
+NO_SPAN = _NoSpan()
+
+
+class Span:
+    """
+    A timed operation, and the span it was started within.  Times are seconds
+    since the epoch.
+    """
+
+    def __init__(self, name: str, parent: Optional['Span'] = None, attributes: dict = None):
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.events: List[Tuple[str, dict]] = []
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+
+    def __repr__(self):  # pragma: no cover
+        return f'Span({self.name!r}, {self.attributes!r})'
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict):
+        self.attributes.update(attributes)
+
+    def record_exception(self, exception: BaseException):
+        self.events.append(('exception', {
+            'exception.type': type(exception).__name__,
+            'exception.message': str(exception),
+        }))
+
+    def is_recording(self) -> bool:
+        return self.end_time is None
+
+    def end(self):
+        if self.end_time is None:
+            self.end_time = time.time()
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+class InMemorySpanExporter:
+    """
+    Keep every finished span, in the order they finished.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans: List[Span] = []
+
+    def export(self, spans: List[Span]):
+        with self.lock:
+            self.spans.extend(spans)
+
+    def get_finished_spans(self) -> Tuple[Span, ...]:
+        with self.lock:
+            return tuple(self.spans)
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+
+
+class Tracer:
+    """
+    Start spans with the same method as an OpenTelemetry tracer.  Each thread
+    has its own current span, a span started within another is its child.
+    Finished spans are exported to "exporter".
+    """
+
+    def __init__(self, exporter: InMemorySpanExporter = None):
+        self.exporter = exporter if exporter is not None else InMemorySpanExporter()
+        self._local = threading.local()
+
+    def current_span(self) -> Optional[Span]:
+        return getattr(self._local, 'span', None)
+
+    @contextmanager
+    def start_as_current_span(self, name: str, attributes: dict = None, **kw) -> Iterator[Span]:
+        """
+        Start a span, which is the current span until the with block ends.  An
+        exception raised within the block is recorded by the span.
+        """
+        parent = self.current_span()
+        span = Span(name, parent, attributes)
+        self._local.span = span
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            self._local.span = parent
+            span.end()
+            self.exporter.export([span])
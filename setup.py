@@ -21,6 +21,7 @@ config = {
     ],
     'setup_requires': ['green>=2.12.0'],
     'tests_require': [
+        'aiosqlite',
         'coverage',
         'coveralls',
         'green>=2.12.0',
@@ -28,7 +29,8 @@ config = {
     ],
     'extras_require': {
         'Postgresql': ['psycopg2-binary'],
-        'testing': ['psycopg2-binary', 'green>=2.12.0', 'coveralls', 'coverage'],
+        'asyncio': ['aiosqlite'],
+        'testing': ['psycopg2-binary', 'aiosqlite', 'green>=2.12.0', 'coveralls', 'coverage'],
     }
 }
 